@@ -1,13 +1,30 @@
+import json
+import logging
 import math
+import threading
 import time
-from collections.abc import Callable
+from collections.abc import Callable, Iterable, Iterator
+from typing import Any
 
-from prometheus_client import Counter
+from prometheus_client import Counter, Histogram
 
 from tilecloud import Tile
 
+_LOGGER = logging.getLogger(__name__)
+
 _TILES_COUNTER = Counter("tilecloud_tiles", "Number of tiles")
 _TILES_ERROR_COUINTER = Counter("tilecloud_tiles_errors", "Number of tiles in error")
+_STAGE_DURATION = Histogram(
+    "tilecloud_stage_duration_seconds",
+    "Wall time spent in a pipeline stage per tile",
+    ["stage"],
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60),
+)
+_STAGE_CPU = Counter("tilecloud_stage_cpu_seconds", "CPU time spent in a pipeline stage", ["stage"])
+_STAGE_WAIT = Counter("tilecloud_stage_wait_seconds", "Time a pipeline stage waited for its input", ["stage"])
+_STAGE_BYTES = Counter(
+    "tilecloud_stage_bytes", "Number of bytes of the tiles out of a pipeline stage", ["stage"]
+)
 
 
 class Statistics:
@@ -95,3 +112,204 @@ class StatsCountErrors:
         if tile and tile.error:
             _TILES_ERROR_COUINTER.inc()
         return tile
+
+
+class LogHistogram:
+    """
+    A histogram with logarithmic buckets, the percentiles have a bounded relative error.
+
+        precision:
+        The maximum relative error, default is 1%.
+    """
+
+    def __init__(self, precision: float = 0.01) -> None:
+        self._log_base = math.log1p(2 * precision)
+        self.counts: dict[int, int] = {}
+        self.count = 0
+
+    def add(self, value: float) -> None:
+        index = math.floor(math.log(value) / self._log_base) if value > 0 else -(2**31)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+
+    def percentile(self, percent: float) -> float | None:
+        if not self.count:
+            return None
+        rank = percent / 100 * self.count
+        cumulative = 0
+        for index in sorted(self.counts):
+            cumulative += self.counts[index]
+            if cumulative >= rank:
+                # The middle of the bucket
+                return 0.0 if index == -(2**31) else math.exp((index + 0.5) * self._log_base)
+        return None  # pragma: no cover
+
+
+class StageStatistics:
+    """The statistics of a pipeline stage."""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.start = time.perf_counter()
+        self.count = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.wait = 0.0
+        self.bytes = 0
+        self.histogram = LogHistogram()
+
+    def add(self, wall: float, cpu: float, wait: float, nbytes: int) -> None:
+        self.count += 1
+        self.wall += wall
+        self.cpu += cpu
+        self.wait += wait
+        self.bytes += nbytes
+        self.histogram.add(wall)
+
+    def as_dict(self) -> dict[str, Any]:
+        elapsed = time.perf_counter() - self.start
+        return {
+            "stage": self.name,
+            "tiles": self.count,
+            "wall_seconds": self.wall,
+            "cpu_seconds": self.cpu,
+            "wait_seconds": self.wait,
+            "bytes": self.bytes,
+            "tiles_per_second": self.count / elapsed if elapsed else 0.0,
+            "bytes_per_second": self.bytes / elapsed if elapsed else 0.0,
+            "p50": self.histogram.percentile(50),
+            "p95": self.histogram.percentile(95),
+            "p99": self.histogram.percentile(99),
+        }
+
+    def __str__(self) -> str:
+        values = self.as_dict()
+        percentiles = "/".join(
+            "-" if values[key] is None else f"{values[key] * 1000:.1f}" for key in ("p50", "p95", "p99")
+        )
+        return (
+            f"{self.name}: {self.count} tiles, {values['tiles_per_second']:.1f} tiles/s, "
+            f"{values['bytes_per_second'] / 1024:.1f} KiB/s, p50/p95/p99 {percentiles} ms, "
+            f"cpu {self.cpu:.1f}s, wait {self.wait:.1f}s"
+        )
+
+
+class Profiler:
+    """
+    Profile the stages of a tile pipeline.
+
+    For each stage the wall and CPU time spent in the stage itself, the time waiting for the
+    input tiles, the number of tiles and bytes, and a latency histogram are recorded.
+
+    Usage::
+
+        profiler = Profiler(interval=10)
+        tilestream = profiler.stage("get", tilestream, input_tilestore.get)
+        tilestream = profiler.map("convert", ImageFormatConverter("image/jpeg"), tilestream)
+
+        interval:
+        Log a report every ``interval`` seconds, default is no live report.
+
+        prometheus:
+        Also export the statistics as Prometheus metrics.
+
+        level:
+        The level of the report logs.
+    """
+
+    def __init__(
+        self,
+        interval: float | None = None,
+        logger: logging.Logger = _LOGGER,
+        prometheus: bool = False,
+        level: int = logging.INFO,
+    ) -> None:
+        self.logger = logger
+        self.level = level
+        self.prometheus = prometheus
+        self.statistics: dict[str, StageStatistics] = {}
+        self._stop = threading.Event()
+        if interval is not None:
+            threading.Thread(target=self._report_loop, args=(interval,), daemon=True).start()
+
+    def stage(
+        self,
+        name: str,
+        tilestream: Iterable[Tile | None],
+        function: Callable[[Iterable[Tile | None]], Iterable[Tile | None]],
+    ) -> Iterator[Tile | None]:
+        """Apply ``function`` on ``tilestream`` and profile it as the stage ``name``."""
+        # Registered here to have the stages in the pipeline order in the reports
+        if name not in self.statistics:
+            self.statistics[name] = StageStatistics(name)
+        return self._stage(self.statistics[name], tilestream, function)
+
+    def _stage(
+        self,
+        statistics: StageStatistics,
+        tilestream: Iterable[Tile | None],
+        function: Callable[[Iterable[Tile | None]], Iterable[Tile | None]],
+    ) -> Iterator[Tile | None]:
+        name = statistics.name
+        # The wall and CPU time spent in the upstream stages
+        upstream = [0.0, 0.0]
+
+        def upstream_tilestream() -> Iterator[Tile | None]:
+            iterator = iter(tilestream)
+            while True:
+                start, cpu_start = time.perf_counter(), time.thread_time()
+                try:
+                    tile = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    upstream[0] += time.perf_counter() - start
+                    upstream[1] += time.thread_time() - cpu_start
+                yield tile
+
+        output = iter(function(upstream_tilestream()))
+        while True:
+            upstream_wall, upstream_cpu = upstream
+            start, cpu_start = time.perf_counter(), time.thread_time()
+            try:
+                tile = next(output)
+            except StopIteration:
+                return
+            wait = upstream[0] - upstream_wall
+            wall = time.perf_counter() - start - wait
+            cpu = time.thread_time() - cpu_start - (upstream[1] - upstream_cpu)
+            nbytes = len(tile.data) if tile is not None and tile.data is not None else 0
+            statistics.add(wall, cpu, wait, nbytes)
+            if self.prometheus:
+                _STAGE_DURATION.labels(name).observe(wall)
+                _STAGE_CPU.labels(name).inc(max(0.0, cpu))
+                _STAGE_WAIT.labels(name).inc(wait)
+                _STAGE_BYTES.labels(name).inc(nbytes)
+            yield tile
+
+    def map(
+        self, name: str, function: Callable[[Tile], Tile | None], tilestream: Iterable[Tile | None]
+    ) -> Iterator[Tile | None]:
+        """Apply the filter ``function`` on ``tilestream`` and profile it as the stage ``name``."""
+        return self.stage(name, tilestream, lambda tiles: map(function, tiles))  # type: ignore[arg-type]
+
+    def report(self) -> None:
+        """Log the statistics of all the stages."""
+        for statistics in self.statistics.values():
+            self.logger.log(self.level, "%s", statistics)
+
+    def as_dict(self) -> list[dict[str, Any]]:
+        return [statistics.as_dict() for statistics in self.statistics.values()]
+
+    def dump(self, filename: str) -> None:
+        """Write the statistics in a JSON file."""
+        with open(filename, "w", encoding="utf-8") as file:
+            json.dump(self.as_dict(), file, indent=2)
+
+    def stop(self) -> None:
+        """Stop the live report."""
+        self._stop.set()
+
+    def _report_loop(self, interval: float) -> None:
+        while not self._stop.wait(interval):
+            self.report()
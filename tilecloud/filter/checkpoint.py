@@ -0,0 +1,169 @@
+import json
+import logging
+import os
+import threading
+import time
+import weakref
+from collections.abc import Iterable, Iterator
+from itertools import islice
+from typing import Any
+
+from tilecloud import Tile
+from tilecloud.lib.sharederror import SharedErrorTile
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def _to_ranges(indexes: Iterable[int]) -> list[list[int]]:
+    ranges: list[list[int]] = []
+    for index in sorted(indexes):
+        if ranges and ranges[-1][1] == index:
+            ranges[-1][1] = index + 1
+        else:
+            ranges.append([index, index + 1])
+    return ranges
+
+
+class Checkpoint:
+    """
+    Persist the progress of a tile stream to be able to resume it after a crash.
+
+    The tiles are numbered in the order of the tile stream, which should be deterministic, e.g.
+    the tiles of a bounding pyramid. The progress is stored as a watermark, all the tiles before
+    it are done, and the ranges of the done tiles after it, as the tiles can be completed out of
+    order by parallel or batched stages. The file is written atomically.
+
+    Use :meth:`resume` on the tile stream, then the checkpoint as a filter at the end of the
+    pipeline to mark the tiles as done. A tile dropped from the pipeline without an error, e.g.
+    missing in a sparse source, is done too when it is garbage collected, so the watermark keeps
+    moving. The tiles with an error, e.g. dropped by ``DropErrors`` after a transient error, and
+    the tiles in progress are not done, they are retried on resume, :meth:`close` the checkpoint
+    before the pipeline is discarded.
+
+        filename:
+        The checkpoint file, processes running in parallel should use different files.
+
+        key:
+        The identifier of the tile stream in the file, e.g. built from the source and destination.
+
+        interval:
+        The minimum number of seconds between two writes.
+
+        resume:
+        Load the progress from the file, otherwise start from the beginning.
+    """
+
+    VERSION = 1
+
+    def __init__(self, filename: str, key: str, interval: float = 60.0, resume: bool = True) -> None:
+        self.filename = filename
+        self.key = key
+        self.interval = interval
+        self.watermark = 0
+        self.done: set[int] = set()
+        # Reentrant, the tiles can be garbage collected while the lock is held
+        self._lock = threading.RLock()
+        self._save_lock = threading.Lock()
+        self._last_save = time.monotonic()
+        self._closed = False
+        if resume:
+            self.load()
+
+    def _read(self) -> dict[str, Any]:
+        if not os.path.exists(self.filename):
+            return {"version": self.VERSION, "jobs": {}}
+        with open(self.filename, encoding="utf-8") as file:
+            data: dict[str, Any] = json.load(file)
+        if data.get("version") != self.VERSION:
+            raise ValueError(f"Unsupported checkpoint version in {self.filename}: {data.get('version')}")
+        return data
+
+    def load(self) -> None:
+        job = self._read()["jobs"].get(self.key)
+        if job is None:
+            return
+        with self._lock:
+            self.watermark = job["watermark"]
+            self.done = {index for start, stop in job["done"] for index in range(start, stop)}
+        _LOGGER.info("Resume %s after %d tiles", self.key, self.watermark + len(self.done))
+
+    def save(self) -> None:
+        with self._save_lock:
+            with self._lock:
+                job = {"watermark": self.watermark, "done": _to_ranges(self.done)}
+                self._last_save = time.monotonic()
+            data = self._read()
+            data["jobs"][self.key] = job
+            tmp_filename = self.filename + ".tmp"
+            with open(tmp_filename, "w", encoding="utf-8") as file:
+                json.dump(data, file)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp_filename, self.filename)
+
+    def resume(self, tilestream: Iterable[Tile | None]) -> Iterator[Tile]:
+        """
+        Skip the done tiles of ``tilestream`` without touching any store, and number the others.
+
+        The tiles are copied, so their error is known when they are dropped from the pipeline.
+        """
+        tiles = islice(filter(None, tilestream), self.watermark, None)
+        for index, source_tile in enumerate(tiles, self.watermark):
+            if index not in self.done:
+                errors: list[Any] = [None]
+                tile = SharedErrorTile.copy(source_tile, errors)
+                tile.checkpoint_index = index
+                finalizer = weakref.finalize(tile, self._dropped, index, errors)
+                finalizer.atexit = False
+                tile.checkpoint_finalizer = finalizer
+                self._maybe_save()
+                yield tile
+
+    def mark_done(self, tile: Tile) -> None:
+        index = getattr(tile, "checkpoint_index", None)
+        if index is None:
+            return
+        finalizer = getattr(tile, "checkpoint_finalizer", None)
+        if finalizer is not None:
+            finalizer.detach()
+        if tile.error:
+            # Retried on resume
+            return
+        self._mark_done(index)
+        self._maybe_save()
+
+    def close(self) -> None:
+        """Save the progress, the tiles dropped afterwards, e.g. by a crashed pipeline, aren't done."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self.save()
+
+    def _maybe_save(self) -> None:
+        with self._lock:
+            save = not self._closed and time.monotonic() - self._last_save >= self.interval
+        if save:
+            self.save()
+
+    def _dropped(self, index: int, errors: list[Any]) -> None:
+        if not errors[0]:
+            self._mark_done(index)
+
+    def _mark_done(self, index: int) -> None:
+        # Also called by the garbage collector, so it doesn't save
+        with self._lock:
+            if self._closed:
+                return
+            if index == self.watermark:
+                self.watermark += 1
+                while self.watermark in self.done:
+                    self.done.remove(self.watermark)
+                    self.watermark += 1
+            elif index > self.watermark:
+                self.done.add(index)
+
+    def __call__(self, tile: Tile) -> Tile:
+        if tile:
+            self.mark_done(tile)
+        return tile
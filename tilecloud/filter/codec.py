@@ -0,0 +1,250 @@
+"""
+Module includes filters to compress and decompress the tile data.
+
+The gzip and deflate encodings are always available, brotli (``br``) requires the ``brotli``
+module and zstd (``zstd``) requires the ``zstandard`` module.
+"""
+
+import logging
+import time
+import zlib
+from collections.abc import Iterable
+from typing import Any
+
+from tilecloud import Tile, TileStore
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class Codec:
+    """Compress and decompress data with an HTTP content encoding."""
+
+    encoding: str
+    min_level: int
+    max_level: int
+    default_level: int
+
+    def compress(self, data: bytes | memoryview, level: int) -> bytes:
+        raise NotImplementedError
+
+    def decompress(self, data: bytes | memoryview) -> bytes:
+        raise NotImplementedError
+
+
+class GzipCodec(Codec):
+    """The gzip content encoding."""
+
+    encoding = "gzip"
+    min_level = 1
+    max_level = 9
+    default_level = 6
+    _wbits = 16 + zlib.MAX_WBITS
+
+    def compress(self, data: bytes | memoryview, level: int) -> bytes:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, self._wbits)
+        return compressor.compress(data) + compressor.flush()
+
+    def decompress(self, data: bytes | memoryview) -> bytes:
+        return zlib.decompress(data, self._wbits)
+
+
+class DeflateCodec(GzipCodec):
+    """
+    The deflate content encoding.
+
+    The HTTP deflate encoding is the zlib format, the raw deflate streams sent by some servers
+    are also accepted on decompression.
+    """
+
+    encoding = "deflate"
+    _wbits = zlib.MAX_WBITS
+
+    def decompress(self, data: bytes | memoryview) -> bytes:
+        try:
+            return zlib.decompress(data, self._wbits)
+        except zlib.error:
+            return zlib.decompress(data, -zlib.MAX_WBITS)
+
+
+class BrotliCodec(Codec):
+    """The brotli content encoding."""
+
+    encoding = "br"
+    min_level = 0
+    max_level = 11
+    default_level = 5
+
+    def compress(self, data: bytes | memoryview, level: int) -> bytes:
+        return brotli.compress(bytes(data), quality=level)  # type: ignore[no-any-return]
+
+    def decompress(self, data: bytes | memoryview) -> bytes:
+        return brotli.decompress(bytes(data))  # type: ignore[no-any-return]
+
+
+class ZstdCodec(Codec):
+    """
+    The zstd content encoding.
+
+        dictionary:
+        A shared dictionary trained with :func:`train_zstd_dictionary`, it strongly improves
+        the compression of small tiles. The same dictionary is needed to decompress.
+    """
+
+    encoding = "zstd"
+    min_level = 1
+    max_level = 19
+    default_level = 3
+
+    def __init__(self, dictionary: bytes | None = None) -> None:
+        self.dictionary = None if dictionary is None else zstandard.ZstdCompressionDict(dictionary)
+        self._compressors: dict[int, Any] = {}
+        self._decompressor = zstandard.ZstdDecompressor(dict_data=self.dictionary)
+
+    def compress(self, data: bytes | memoryview, level: int) -> bytes:
+        if level not in self._compressors:
+            self._compressors[level] = zstandard.ZstdCompressor(level=level, dict_data=self.dictionary)
+        return self._compressors[level].compress(data)  # type: ignore[no-any-return]
+
+    def decompress(self, data: bytes | memoryview) -> bytes:
+        return self._decompressor.decompress(data)  # type: ignore[no-any-return]
+
+
+def train_zstd_dictionary(samples: list[bytes], size: int = 112640) -> bytes:
+    """Train a zstd dictionary of ``size`` bytes on sample tiles."""
+    return zstandard.train_dictionary(size, samples).as_bytes()  # type: ignore[no-any-return]
+
+
+def available_encodings() -> list[str]:
+    """Get the content encodings supported in this environment."""
+    encodings = ["gzip", "deflate"]
+    if brotli is not None:
+        encodings.append("br")
+    if zstandard is not None:
+        encodings.append("zstd")
+    return encodings
+
+
+def get_codec(encoding: str, **kwargs: Any) -> Codec:
+    """Get the codec of a content encoding, the ``kwargs`` are passed to the codec constructor."""
+    if encoding not in available_encodings():
+        raise ValueError(f"Unsupported content encoding: {encoding}")
+    codec_class = {"gzip": GzipCodec, "deflate": DeflateCodec, "br": BrotliCodec, "zstd": ZstdCodec}[encoding]
+    return codec_class(**kwargs)
+
+
+def negotiate(encodings: Iterable[str], tilestore: TileStore | None = None) -> str:
+    """
+    Get the first of ``encodings`` supported in this environment and by the target tile store.
+
+    The tile store can restrict the encodings with its ``accept_encodings`` attribute, see
+    :class:`tilecloud.store.s3.S3TileStore`.
+    """
+    accepted = getattr(tilestore, "accept_encodings", None)
+    available = available_encodings()
+    for encoding in encodings:
+        if encoding in available and (accepted is None or encoding in accepted):
+            return encoding
+    raise ValueError(f"No supported content encoding in {list(encodings)}, accepted: {accepted}")
+
+
+class Compressor:
+    """
+    Create a filter that compresses the tile data.
+
+        encodings:
+        The content encodings by order of preference, see :func:`negotiate`. Default is gzip.
+
+        level:
+        The compression level, default is the codec default level.
+
+        tilestore:
+        The target tile store used to negotiate the content encoding.
+
+        cpu_budget:
+        Enable the adaptive mode: the compression level is increased or decreased to keep the
+        average compression CPU time per tile under ``cpu_budget`` seconds.
+
+        min_samples:
+        In the adaptive mode, the number of tiles compressed at a level before it can change
+        again, so the level doesn't follow the noise of the CPU time of a few tiles.
+
+        kwargs:
+        Extra arguments passed to the codec, e.g. the zstd ``dictionary``.
+    """
+
+    def __init__(
+        self,
+        encodings: Iterable[str] = ("gzip",),
+        level: int | None = None,
+        tilestore: TileStore | None = None,
+        cpu_budget: float | None = None,
+        min_samples: int = 20,
+        **kwargs: Any,
+    ) -> None:
+        self.codec = get_codec(negotiate(encodings, tilestore), **kwargs)
+        self.level = self.codec.default_level if level is None else level
+        self.cpu_budget = cpu_budget
+        self.min_samples = min_samples
+        self._average: float | None = None
+        self._samples = 0
+
+    def __call__(self, tile: Tile) -> Tile:
+        assert tile.data is not None
+        assert tile.content_encoding is None
+        start = time.thread_time()
+        tile.data = self.codec.compress(memoryview(tile.data), self.level)
+        tile.content_encoding = self.codec.encoding
+        if self.cpu_budget is not None:
+            self._adapt(time.thread_time() - start)
+        return tile
+
+    def _adapt(self, duration: float) -> None:
+        assert self.cpu_budget is not None
+        self._average = duration if self._average is None else 0.9 * self._average + 0.1 * duration
+        self._samples += 1
+        if self._samples < self.min_samples:
+            return
+        level = self.level
+        if self._average > self.cpu_budget and level > self.codec.min_level:
+            level -= 1
+        elif self._average < self.cpu_budget / 2 and level < self.codec.max_level:
+            level += 1
+        if level != self.level:
+            _LOGGER.debug("Change %s compression level to %d", self.codec.encoding, level)
+            self.level = level
+            self._average = None
+            self._samples = 0
+
+
+class Decompressor:
+    """
+    Create a filter that decompresses the tile data, for all the supported content encodings.
+
+        kwargs:
+        Extra arguments passed to the codecs by encoding, e.g. ``zstd={"dictionary": dictionary}``.
+    """
+
+    def __init__(self, **kwargs: dict[str, Any]) -> None:
+        self.kwargs = kwargs
+        self._codecs: dict[str, Codec] = {}
+
+    def __call__(self, tile: Tile) -> Tile:
+        assert tile.data is not None
+        if tile.content_encoding is not None and tile.content_encoding != "identity":
+            if tile.content_encoding not in self._codecs:
+                self._codecs[tile.content_encoding] = get_codec(
+                    tile.content_encoding, **self.kwargs.get(tile.content_encoding, {})
+                )
+            tile.data = self._codecs[tile.content_encoding].decompress(memoryview(tile.data))
+            tile.content_encoding = None
+        return tile
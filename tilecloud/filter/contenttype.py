@@ -1,27 +1,88 @@
+import zlib
+
 from tilecloud import Tile
 
+# The number of bytes needed to recognize all the supported formats
+_PREFIX_LENGTH = 16
+_GZIP_MAGIC = b"\x1f\x8b"
+_JSON_WHITESPACES = b" \t\r\n"
+# The tags of the fields of a Mapbox vector tile layer: version, name, features, keys, values, extent
+_MVT_LAYER_TAGS = frozenset((0x78, 0x0A, 0x12, 0x1A, 0x22, 0x28))
+
+
+def _is_mvt(prefix: bytes) -> bool:
+    """Check that the data start with a vector tile layer: field 3, length delimited, then a layer field."""
+    if not prefix.startswith(b"\x1a"):
+        return False
+    # The last byte of the varint length of the layer
+    index = 1
+    while index < len(prefix) and prefix[index] & 0x80:
+        index += 1
+    return index <= 5 and index + 1 < len(prefix) and prefix[1] != 0 and prefix[index + 1] in _MVT_LAYER_TAGS
+
+
+def sniff_content_type(data: bytes | memoryview) -> str | None:
+    """Get the content type from the first bytes of not encoded tile data, ``None`` if unknown."""
+    prefix = bytes(data[:_PREFIX_LENGTH])
+    if prefix.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if prefix.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if prefix.startswith(b"RIFF") and prefix[8:12] == b"WEBP":
+        return "image/webp"
+    if prefix.startswith((b"GIF87a", b"GIF89a")):
+        return "image/gif"
+    if prefix.lstrip(_JSON_WHITESPACES)[:1] in (b"{", b"["):
+        return "application/json"
+    if _is_mvt(prefix):
+        return "application/vnd.mapbox-vector-tile"
+    return None
+
 
 class ContentTypeAdder:
     """
     Create a filter that adds a content type to the tile.
 
+    The content type is recognized from the first bytes of the tile data, the gzip encoded
+    data are recognized and only the beginning is decompressed.
+
         content_type:
         Force this content type for the tile. Default is ``None``, meaning
         that the content type will be determined based on the tile data.
+
+        single_type:
+        All the tiles have the same content type, only the first one is sniffed, the content
+        encoding is still recognized for each tile.
     """
 
-    def __init__(self, content_type: str | None = None) -> None:
+    def __init__(self, content_type: str | None = None, single_type: bool = False) -> None:
         self.content_type = content_type
+        self.single_type = single_type
+        # The content type sniffed from the first tile with single_type
+        self._single_content_type: str | None = None
 
     def __call__(self, tile: Tile) -> Tile:
-        if self.content_type is None and tile.content_encoding is None and tile.data is not None:
-            data = str(tile.data)
-            if data.startswith("{"):
-                tile.content_type = "application/json"
-            elif data.startswith("\x89PNG\x0d\x0a\x1a\x0a"):
-                tile.content_type = "image/png"
-            elif data.startswith("\xff\xd8"):
-                tile.content_type = "image/jpeg"
-        else:
+        if self.content_type is not None:
             tile.content_type = self.content_type
+            return tile
+        if tile.data is None:
+            return tile
+        data: bytes | memoryview = tile.data
+        if tile.content_encoding is None and data[:2] == _GZIP_MAGIC:
+            tile.content_encoding = "gzip"
+        if self._single_content_type is not None:
+            tile.content_type = self._single_content_type
+            return tile
+        if tile.content_encoding == "gzip":
+            try:
+                data = zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(data, _PREFIX_LENGTH)
+            except zlib.error:
+                return tile
+        elif tile.content_encoding is not None:
+            return tile
+        content_type = sniff_content_type(data)
+        if content_type is not None:
+            tile.content_type = content_type
+            if self.single_type:
+                self._single_content_type = content_type
         return tile
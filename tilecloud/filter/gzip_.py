@@ -1,7 +1,5 @@
-from gzip import GzipFile
-from io import BytesIO
-
 from tilecloud import Tile
+from tilecloud.filter.codec import GzipCodec
 
 
 class GzipCompressor:
@@ -10,29 +8,31 @@ class GzipCompressor:
 
         compresslevel:
         The compression level. Default is 9.
+
+    See also :class:`tilecloud.filter.codec.Compressor`.
     """
 
     def __init__(self, compresslevel: int = 9) -> None:
         self.compresslevel = compresslevel
+        self._codec = GzipCodec()
 
     def __call__(self, tile: Tile) -> Tile:
         assert tile.data is not None
         assert tile.content_encoding is None
-        bytes_io = BytesIO()
-        gzip_file = GzipFile(compresslevel=self.compresslevel, fileobj=bytes_io, mode="w")
-        gzip_file.write(tile.data)
-        gzip_file.close()
+        tile.data = self._codec.compress(memoryview(tile.data), self.compresslevel)
         tile.content_encoding = "gzip"
-        tile.data = bytes_io.getvalue()
         return tile
 
 
 class GzipDecompressor:
     """Create a filter that decompresses a tile with gzip."""
 
+    def __init__(self) -> None:
+        self._codec = GzipCodec()
+
     def __call__(self, tile: Tile) -> Tile:
         assert tile.data is not None
         if tile.content_encoding == "gzip":
             tile.content_encoding = None
-            tile.data = GzipFile(fileobj=BytesIO(tile.data)).read()
+            tile.data = self._codec.decompress(memoryview(tile.data))
         return tile
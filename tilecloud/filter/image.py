@@ -4,14 +4,24 @@ Module includes filters doing manipulations on the tile image.
 It requires the PIL lib.
 """
 
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 from typing import Any
 
 import PIL.Image
 import PIL.ImageFilter
 
-from tilecloud import Tile, TileStore
-from tilecloud.lib.PIL_ import FORMAT_BY_CONTENT_TYPE
+from tilecloud import Tile, TileCoord, TileStore
+from tilecloud.lib.PIL_ import (
+    FORMAT_BY_CONTENT_TYPE,
+    UniformKey,
+    encode,
+    encode_uniform,
+    find_uniform,
+    get_uniform,
+)
 
 
 class ImageFormatConverter:
@@ -34,10 +44,12 @@ class ImageFormatConverter:
     def __call__(self, tile: Tile) -> Tile:
         if tile.content_type != self.content_type:
             assert tile.data is not None
-            bytes_io = BytesIO()
-            PIL.Image.open(BytesIO(tile.data)).save(bytes_io, self.format, **self.kwargs)
+            key = find_uniform(tile.data)
+            if key is not None:
+                tile.data = encode_uniform(key, self.format, **self.kwargs)
+            else:
+                tile.data = encode(PIL.Image.open(BytesIO(tile.data)), self.format, **self.kwargs)
             tile.content_type = self.content_type
-            tile.data = bytes_io.getvalue()
         return tile
 
 
@@ -67,19 +79,128 @@ class MergeFilter:
             sub_tile = tilestore.get_one(Tile(tile.tilecoord))
             if sub_tile is not None:
                 assert sub_tile.data is not None
+                key = find_uniform(sub_tile.data)
+                if key is not None and _is_transparent(key):
+                    continue
                 image2 = PIL.Image.open(BytesIO(sub_tile.data))
                 image.paste(image2, None, image2)
         content_type = self.content_type
         if content_type is None:
             content_type = tile.content_type
         assert content_type is not None
-        bytes_io = BytesIO()
-        image.save(bytes_io, FORMAT_BY_CONTENT_TYPE[content_type], **self.kwargs)
+        tile.data = encode(image, FORMAT_BY_CONTENT_TYPE[content_type], **self.kwargs)
         tile.content_type = content_type
-        tile.data = bytes_io.getvalue()
         return tile
 
 
+class CompositeFilter:
+    """
+    Create a filter that composites layers over the tile.
+
+    The missing and the fully transparent layers are skipped, the others are alpha composited over the tile, and the result is
+    encoded once.
+
+        tilestores:
+        The :class:`TileStore` objects of the layers, from bottom to top.
+
+        static_tilestores:
+        The layers that rarely change, their decoded images are kept in a LRU cache.
+
+        content_type:
+        The content type to set in the tile. If ``None`` the content type of the tile is kept.
+
+        cache_size:
+        The number of decoded layer images kept in the cache. Default is 1024.
+
+        max_workers:
+        The number of threads used to fetch the layer tiles concurrently. Default is ``None``,
+        the layers are fetched one after the other in the calling thread, as needed by the tile
+        stores bound to their thread like the :class:`tilecloud.store.mbtiles.MBTilesTileStore`.
+
+        kwargs:
+        Extra params passed to the PIL ``save`` function.
+
+    Call :meth:`close` when the filter is no longer used.
+    """
+
+    def __init__(
+        self,
+        tilestores: list[TileStore],
+        static_tilestores: list[TileStore] | None = None,
+        content_type: str | None = None,
+        cache_size: int = 1024,
+        max_workers: int | None = None,
+        **kwargs: Any,
+    ) -> None:
+        self.tilestores = list(tilestores)
+        self.static_tilestores = static_tilestores or []
+        self.content_type = content_type
+        self.cache_size = cache_size
+        self.kwargs = kwargs
+        self._cache: OrderedDict[tuple[int, TileCoord], PIL.Image.Image | None] = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._executor = None if max_workers is None else ThreadPoolExecutor(max_workers)
+
+    def _get_layer(self, tilestore: TileStore, tilecoord: TileCoord) -> PIL.Image.Image | None:
+        if tilestore not in self.static_tilestores:
+            return self._load_layer(tilestore, tilecoord)
+        key = (id(tilestore), tilecoord)
+        with self._cache_lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        image = self._load_layer(tilestore, tilecoord)
+        with self._cache_lock:
+            self._cache[key] = image
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return image
+
+    @staticmethod
+    def _load_layer(tilestore: TileStore, tilecoord: TileCoord) -> PIL.Image.Image | None:
+        sub_tile = tilestore.get_one(Tile(tilecoord))
+        if sub_tile is None or sub_tile.data is None:
+            return None
+        key = find_uniform(sub_tile.data)
+        if key is not None and _is_transparent(key):
+            return None
+        image = PIL.Image.open(BytesIO(sub_tile.data)).convert("RGBA")
+        if image.getextrema()[3][1] == 0:
+            return None
+        return image
+
+    def __call__(self, tile: Tile) -> Tile:
+        assert tile.data is not None
+
+        def get_layer(tilestore: TileStore) -> PIL.Image.Image | None:
+            return self._get_layer(tilestore, tile.tilecoord)
+
+        if self._executor is None:
+            layers = [get_layer(tilestore) for tilestore in self.tilestores]
+        else:
+            layers = list(self._executor.map(get_layer, self.tilestores))
+        content_type = self.content_type or tile.content_type
+        assert content_type is not None
+        if all(layer is None for layer in layers) and content_type == tile.content_type:
+            return tile
+        image = PIL.Image.open(BytesIO(tile.data)).convert("RGBA")
+        for layer in layers:
+            if layer is not None:
+                image = PIL.Image.alpha_composite(image, layer)
+        image_format = FORMAT_BY_CONTENT_TYPE[content_type]
+        if image_format == "JPEG":
+            image = image.convert("RGB")
+        tile.data = encode(image, image_format, **self.kwargs)
+        tile.content_type = content_type
+        return tile
+
+    def close(self) -> None:
+        """Stop the threads that get the layers."""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
 class PILImageFilter:
     """
     Create a filter to filter the tile image (with the PIL ``filter`` function).
@@ -94,13 +215,61 @@ class PILImageFilter:
     def __init__(self, image_filter: PIL.ImageFilter.Filter, **kwargs: Any) -> None:
         self.filter = image_filter
         self.kwargs = kwargs
+        self._uniform_cache: dict[tuple[UniformKey, str], bytes] = {}
 
     def __call__(self, tile: Tile) -> Tile:
         assert tile.data is not None
-        image_file = PIL.Image.open(BytesIO(tile.data))
-        image = image_file.filter(self.filter)
-        bytes_io = BytesIO()
         assert tile.content_type is not None
-        image.save(bytes_io, FORMAT_BY_CONTENT_TYPE.get(tile.content_type, "PNG"), **self.kwargs)
-        tile.data = bytes_io.getvalue()
+        image_format = FORMAT_BY_CONTENT_TYPE.get(tile.content_type, "PNG")
+        key = find_uniform(tile.data)
+        if key is not None:
+            # The filtered image only depends on the color, the size and the filter
+            tile.data = self._filter_uniform(key, image_format)
+            return tile
+        image_file = PIL.Image.open(BytesIO(tile.data))
+        key = get_uniform(tile.data, image_file)
+        if key is not None:
+            tile.data = self._filter_uniform(key, image_format)
+            return tile
+        tile.data = encode(image_file.filter(self.filter), image_format, **self.kwargs)
         return tile
+
+    def _filter_uniform(self, key: UniformKey, image_format: str) -> bytes:
+        cache_key = (key, image_format)
+        if cache_key not in self._uniform_cache:
+            if len(self._uniform_cache) >= 256:
+                self._uniform_cache.clear()
+            mode, size, color = key
+            image = PIL.Image.new(mode, size, color).filter(self.filter)
+            self._uniform_cache[cache_key] = encode(image, image_format, **self.kwargs)
+        return self._uniform_cache[cache_key]
+
+
+class MarkUniform:
+    """
+    Create a filter that marks the uniform (empty or solid color) image tiles.
+
+    The color of the uniform tiles is set in the ``attr`` attribute, ``None`` for the other tiles,
+    so the downstream filters and stores can skip or deduplicate them. The already seen uniform
+    tiles are recognized from their encoded data without being decoded.
+
+        attr:
+        The name of the attribute. Default is ``uniform``.
+    """
+
+    def __init__(self, attr: str = "uniform") -> None:
+        self.attr = attr
+
+    def __call__(self, tile: Tile) -> Tile:
+        if tile and tile.data is not None and tile.content_encoding is None:
+            try:
+                key = get_uniform(tile.data)
+            except PIL.UnidentifiedImageError:
+                key = None
+            setattr(tile, self.attr, None if key is None else key[2])
+        return tile
+
+
+def _is_transparent(key: UniformKey) -> bool:
+    mode, _, color = key
+    return mode in ("LA", "RGBA") and color[-1] == 0
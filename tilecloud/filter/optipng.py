@@ -1,9 +1,25 @@
+import collections
+import functools
 import os
+import tempfile
+import time
+import zlib
+from collections.abc import Iterable, Iterator
+from concurrent.futures import Future, ProcessPoolExecutor
+from io import BytesIO
 from subprocess import call  # nosec
 from tempfile import NamedTemporaryFile
+from typing import Any
+
+from PIL import Image
 
 from tilecloud import Tile
 
+# The zlib strategies tried by default
+DEFAULT_COMPRESS_TYPES = (zlib.Z_DEFAULT_STRATEGY, zlib.Z_FILTERED, zlib.Z_RLE)
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
 
 class OptiPNG:
     """Optimize PNG tiles with optipng."""
@@ -27,3 +43,205 @@ class OptiPNG:
                 except OSError:
                     pass
             return tile
+
+
+class BatchOptiPNG(OptiPNG):
+    """
+    Optimize PNG tiles with optipng, with one optipng run for many tiles.
+
+    Use :meth:`optimize` on the tile stream, the tiles are written in a temporary directory
+    by batches of ``batch_size``.
+    """
+
+    def __init__(self, options: list[str], arg0: str = "/usr/bin/optipng", batch_size: int = 64) -> None:
+        super().__init__(options, arg0)
+        self.batch_size = batch_size
+
+    def optimize(self, tiles: Iterable[Tile | None]) -> Iterator[Tile]:
+        batch: list[Tile] = []
+        for tile in tiles:
+            if tile is None:
+                continue
+            batch.append(tile)
+            if len(batch) >= self.batch_size:
+                yield from self._optimize_batch(batch)
+                batch = []
+        if batch:
+            yield from self._optimize_batch(batch)
+
+    def _optimize_batch(self, tiles: list[Tile]) -> list[Tile]:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filenames = []
+            for index, tile in enumerate(tiles):
+                assert tile.data is not None
+                filename = os.path.join(tmpdir, f"{index}.png")
+                with open(filename, "wb") as file:
+                    file.write(tile.data)
+                filenames.append(filename)
+            # optipng continues with the other files when one fails
+            call([*self.args, *filenames])  # noqa: S603
+            for tile, filename in zip(tiles, filenames, strict=True):
+                with open(filename, "rb") as file:
+                    data = file.read()
+                if data and len(data) < len(tile.data):  # type: ignore[arg-type]
+                    tile.data = data
+        return tiles
+
+
+def _to_palette(image: Image.Image) -> Image.Image | None:
+    """
+    Losslessly convert ``image`` to a palette image.
+
+    Get ``None`` if it has more than 256 colors, or if the same color has many alpha values.
+    """
+    if image.mode not in ("RGB", "RGBA"):
+        return None
+    rgb = image.convert("RGB")
+    colors = rgb.getcolors(256)
+    if colors is None:
+        return None
+    # The median cut keeps each color when there are no more colors than requested
+    result = rgb.quantize(len(colors), method=Image.Quantize.MEDIANCUT, dither=Image.Dither.NONE)
+    if result.convert("RGB").tobytes() != rgb.tobytes():
+        return None
+    if image.mode == "RGBA":
+        indexes = Image.frombytes("L", result.size, result.tobytes())
+        # One (index, alpha) pair by color, else a color has many alpha values
+        pairs = Image.merge("LA", (indexes, image.getchannel("A"))).getcolors(len(colors))
+        if pairs is None:
+            return None
+        alphas = dict(pair for _, pair in pairs)
+        transparency = bytearray(b"\xff" * (max(alphas) + 1))
+        for index, alpha in alphas.items():
+            transparency[index] = alpha
+        result.info["transparency"] = bytes(transparency)
+    return result
+
+
+def optimize_png(
+    data: bytes,
+    compress_level: int = 9,
+    compress_types: Iterable[int] = DEFAULT_COMPRESS_TYPES,
+    palette: bool = True,
+) -> bytes:
+    """
+    Losslessly optimize a PNG image in-process.
+
+    The image is converted to a palette image when it has at most 256 colors, then encoded
+    with each of the zlib strategies ``compress_types``, and the smallest data are returned,
+    or the original data if they are the smallest.
+    """
+    image = Image.open(BytesIO(data))
+    image.load()
+    images = [image]
+    if palette:
+        palette_image = _to_palette(image)
+        if palette_image is not None:
+            images.append(palette_image)
+    result = data
+    for candidate in images:
+        for compress_type in compress_types:
+            bytes_io = BytesIO()
+            save_options: dict[str, Any] = {"compress_level": compress_level, "compress_type": compress_type}
+            if "transparency" in candidate.info:
+                save_options["transparency"] = candidate.info["transparency"]
+            candidate.save(bytes_io, "PNG", **save_options)
+            if bytes_io.tell() < len(result):
+                result = bytes_io.getvalue()
+    return result
+
+
+class PNGOptimizer:
+    """
+    Create a filter that losslessly optimizes PNG tiles in-process with Pillow and zlib.
+
+    See :func:`optimize_png` for the arguments. Use it as a filter, or use :meth:`optimize`
+    on the tile stream to optimize the tiles in ``processes`` processes.
+    """
+
+    def __init__(
+        self,
+        compress_level: int = 9,
+        compress_types: Iterable[int] = DEFAULT_COMPRESS_TYPES,
+        palette: bool = True,
+        processes: int | None = None,
+    ) -> None:
+        self.function = functools.partial(
+            optimize_png,
+            compress_level=compress_level,
+            compress_types=tuple(compress_types),
+            palette=palette,
+        )
+        self.processes = processes or os.cpu_count() or 1
+
+    def __call__(self, tile: Tile) -> Tile:
+        if self._is_png(tile):
+            assert tile.data is not None
+            tile.data = self.function(tile.data)
+        return tile
+
+    @staticmethod
+    def _is_png(tile: Tile | None) -> bool:
+        return (
+            tile is not None
+            and tile.content_type in (None, "image/png")
+            and tile.data is not None
+            and tile.data.startswith(_PNG_SIGNATURE)
+        )
+
+    def optimize(self, tiles: Iterable[Tile | None]) -> Iterator[Tile]:
+        """
+        Optimize the tiles in a process pool, and yield them in order.
+
+        The not PNG tiles are not sent to the processes, they are yielded as soon as the PNG tiles
+        before them are optimized.
+        """
+        max_pending = 2 * self.processes
+        # The tiles not yet yielded, with the optimization of the PNG ones
+        queue: collections.deque[tuple[Tile, Future[bytes] | None]] = collections.deque()
+        nb_pending = 0
+        with ProcessPoolExecutor(self.processes) as executor:
+            for tile in tiles:
+                if tile is None:
+                    continue
+                if self._is_png(tile):
+                    assert tile.data is not None
+                    queue.append((tile, executor.submit(self.function, tile.data)))
+                    nb_pending += 1
+                else:
+                    queue.append((tile, None))
+                # Yield the ready tiles, and wait for the oldest one when too many are pending
+                while queue and (queue[0][1] is None or queue[0][1].done() or nb_pending >= max_pending):
+                    ready, future = queue.popleft()
+                    if future is not None:
+                        ready.data = future.result()
+                        nb_pending -= 1
+                    yield ready
+            for tile, future in queue:
+                if future is not None:
+                    tile.data = future.result()
+                yield tile
+
+
+def benchmark(datas: list[bytes], settings: dict[str, dict[str, Any]]) -> dict[str, dict[str, float]]:
+    """
+    Compare the PNG optimization settings on sample tiles.
+
+    Arguments:
+        datas: The sample PNG tiles
+        settings: The :func:`optimize_png` arguments by setting name
+
+    Returns the saved bytes ratio and the number of tiles per second by setting name.
+
+    """
+    original_size = sum(len(data) for data in datas)
+    results = {}
+    for name, options in settings.items():
+        start = time.perf_counter()
+        size = sum(len(optimize_png(data, **options)) for data in datas)
+        duration = time.perf_counter() - start
+        results[name] = {
+            "bytes_saved": 1 - size / original_size if original_size else 0.0,
+            "tiles_per_second": len(datas) / duration if duration else 0.0,
+        }
+    return results
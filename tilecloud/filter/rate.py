@@ -1,4 +1,8 @@
+import multiprocessing
+import threading
 import time
+from collections.abc import Callable
+from typing import Any
 
 from tilecloud import Tile
 
@@ -21,3 +25,179 @@ class RateLimit:
                 if seconds > 0:
                     time.sleep(seconds)
         return tile
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket.
+
+    The bucket is filled with ``rate`` tokens per second up to ``burst`` tokens.
+
+    :meth:`acquire` reserves the tokens and returns the number of seconds to wait before using them,
+    the waiting is done by the caller without holding the lock.
+    """
+
+    def __init__(self, rate: float, burst: float = 1.0) -> None:
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1.0) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate) - tokens
+            self._last = now
+            return max(0.0, -self._tokens / self.rate)
+
+
+class SharedTokenBucket(TokenBucket):
+    """
+    A token bucket shared by the processes, the state is in shared memory.
+
+    The bucket should be created before starting the processes, and passed to them.
+    """
+
+    def __init__(self, rate: float, burst: float = 1.0) -> None:
+        super().__init__(rate, burst)
+        self._state = multiprocessing.Array("d", [burst, time.monotonic()])
+
+    def acquire(self, tokens: float = 1.0) -> float:
+        with self._state.get_lock():
+            now = time.monotonic()
+            current = min(self.burst, self._state[0] + (now - self._state[1]) * self.rate) - tokens
+            self._state[0] = current
+            self._state[1] = now
+            return max(0.0, -current / self.rate)
+
+    def __getstate__(self) -> dict[str, Any]:
+        state = dict(self.__dict__)
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+
+# KEYS[1]: the bucket key, ARGV: rate, burst, tokens
+_REDIS_ACQUIRE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'last')
+local current = tonumber(state[1]) or burst
+local last = tonumber(state[2]) or now
+current = math.min(burst, current + (now - last) * rate) - tonumber(ARGV[3])
+redis.call('HSET', KEYS[1], 'tokens', tostring(current), 'last', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 60)
+return tostring(math.max(0, -current / rate))
+"""
+
+
+class RedisTokenBucket(TokenBucket):
+    """
+    A token bucket shared through Redis, e.g. by the workers of several hosts.
+
+        client:
+        The Redis client.
+
+        key:
+        The Redis key of the bucket.
+    """
+
+    def __init__(self, client: Any, key: str, rate: float, burst: float = 1.0) -> None:
+        super().__init__(rate, burst)
+        self.key = key
+        self._script = client.register_script(_REDIS_ACQUIRE_SCRIPT)
+
+    def acquire(self, tokens: float = 1.0) -> float:
+        return float(self._script(keys=[self.key], args=[self.rate, self.burst, tokens]))
+
+
+class TokenBucketRateLimit:
+    """
+    Rate limit the number of tiles per second with token buckets, allowing bursts.
+
+        rate:
+        The number of tiles per second.
+
+        burst:
+        The number of tiles that can pass without waiting after an idle period.
+
+        key:
+        A function that gets the bucket key of a tile, e.g. the host, to have one bucket per key.
+        Default is one bucket for all the tiles.
+
+        bucket_factory:
+        A function that creates the bucket of a key, e.g. to create a :class:`SharedTokenBucket`
+        or a :class:`RedisTokenBucket`. Default creates a :class:`TokenBucket`.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: float = 1.0,
+        key: Callable[[Tile], str] | None = None,
+        bucket_factory: Callable[[str], TokenBucket] | None = None,
+    ) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.key = key
+        self.bucket_factory = bucket_factory or (lambda _: TokenBucket(self.rate, self.burst))
+        self.buckets: dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def get_bucket(self, tile: Tile) -> TokenBucket:
+        key = "" if self.key is None else self.key(tile)
+        with self._lock:
+            if key not in self.buckets:
+                self.buckets[key] = self.bucket_factory(key)
+            return self.buckets[key]
+
+    def __call__(self, tile: Tile) -> Tile:
+        if tile:
+            seconds = self.get_bucket(tile).acquire()
+            if seconds > 0:
+                time.sleep(seconds)
+        return tile
+
+
+class AdaptiveRateLimit(TokenBucketRateLimit):
+    """
+    Rate limit that backs off when the upstream server is overloaded.
+
+    Use the filter before getting the tiles, and :meth:`feedback` after. When a tile got a
+    throttling status code (429 or 503) the rate of its bucket is multiplied by ``backoff``,
+    and each successful tile increases it by ``increase`` up to the initial rate.
+
+        min_rate:
+        The minimum rate.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: float = 1.0,
+        backoff: float = 0.5,
+        increase: float = 0.1,
+        min_rate: float = 0.1,
+        throttling_status_codes: tuple[int, ...] = (429, 503),
+        **kwargs: Any,
+    ) -> None:
+        super().__init__(rate, burst, **kwargs)
+        self.backoff = backoff
+        self.increase = increase
+        self.min_rate = min_rate
+        self.throttling_status_codes = throttling_status_codes
+
+    def feedback(self, tile: Tile) -> Tile:
+        if tile:
+            bucket = self.get_bucket(tile)
+            if getattr(tile, "status_code", None) in self.throttling_status_codes:
+                bucket.rate = max(self.min_rate, bucket.rate * self.backoff)
+            elif not tile.error:
+                bucket.rate = min(self.rate, bucket.rate + self.increase)
+        return tile
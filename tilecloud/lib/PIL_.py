@@ -1,2 +1,135 @@
 # pylint: disable=invalid-name # noqa: N999
+"""
+Pillow helpers, including a fast path for the uniform (empty or solid color) images.
+
+The uniform images are detected from the Pillow extrema, or without decoding from the encoded
+data of the already seen uniform images, and their encoded data are taken from a cache.
+"""
+
+import functools
+import threading
+from collections import OrderedDict
+from io import BytesIO
+from typing import Any
+
+from PIL import Image
+
 FORMAT_BY_CONTENT_TYPE = {"image/jpeg": "JPEG", "image/png": "PNG", "image/webp": "WEBP"}
+
+# The modes where a pixel value fully describes the color, unlike e.g. the palette mode
+_UNIFORM_MODES = ("1", "L", "LA", "RGB", "RGBA")
+# The uniform images are small once encoded, don't remember bigger data
+_MAX_UNIFORM_DATA_SIZE = 8192
+_MAX_UNIFORM_DATA_NB = 1024
+
+# The mode, the size and the color of a uniform image
+UniformKey = tuple[str, tuple[int, int], Any]
+
+_UNIFORM_BY_DATA: OrderedDict[bytes, UniformKey] = OrderedDict()
+_UNIFORM_BY_DATA_LOCK = threading.Lock()
+
+
+def get_uniform_color(image: Image.Image) -> Any | None:
+    """Get the color of ``image`` if all its pixels have the same color, ``None`` otherwise."""
+    if image.mode not in _UNIFORM_MODES:
+        return None
+    extrema = image.getextrema()
+    if len(image.getbands()) == 1:
+        extrema = (extrema,)  # type: ignore[assignment]
+    if any(minimum != maximum for minimum, maximum in extrema):  # type: ignore[misc]
+        return None
+    return image.getpixel((0, 0))
+
+
+def get_uniform_key(image: Image.Image) -> UniformKey | None:
+    """
+    Get the mode, size and color of ``image`` if all its pixels have the same color.
+
+    A palette image with a single palette index is described by the color of this index, in the
+    RGB mode if it's opaque, in the RGBA mode otherwise.
+    """
+    if image.mode == "P":
+        if image.getcolors(1) is None:
+            return None
+        color = image.crop((0, 0, 1, 1)).convert("RGBA").getpixel((0, 0))
+        assert isinstance(color, tuple)
+        if color[3] == 255:
+            return ("RGB", image.size, color[:3])
+        return ("RGBA", image.size, color)
+    color = get_uniform_color(image)
+    if color is None:
+        return None
+    return (image.mode, image.size, color)
+
+
+def _remember(data: bytes, key: UniformKey) -> None:
+    if len(data) <= _MAX_UNIFORM_DATA_SIZE:
+        with _UNIFORM_BY_DATA_LOCK:
+            _UNIFORM_BY_DATA[data] = key
+            _UNIFORM_BY_DATA.move_to_end(data)
+            if len(_UNIFORM_BY_DATA) > _MAX_UNIFORM_DATA_NB:
+                _UNIFORM_BY_DATA.popitem(last=False)
+
+
+def find_uniform(data: bytes) -> UniformKey | None:
+    """Get the mode, size and color of ``data`` if it's a known encoded uniform image, without decoding."""
+    if len(data) > _MAX_UNIFORM_DATA_SIZE:
+        return None
+    with _UNIFORM_BY_DATA_LOCK:
+        return _UNIFORM_BY_DATA.get(data)
+
+
+def get_uniform(data: bytes, image: Image.Image | None = None) -> UniformKey | None:
+    """
+    Get the mode, size and color of the image encoded in ``data`` if it's uniform.
+
+    Arguments:
+        data: The encoded image
+        image: The already decoded image, if any
+
+    """
+    key = find_uniform(data)
+    if key is not None or (image is None and len(data) > _MAX_UNIFORM_DATA_SIZE):
+        return key
+    if image is None:
+        image = Image.open(BytesIO(data))
+    key = get_uniform_key(image)
+    if key is not None:
+        _remember(data, key)
+    return key
+
+
+@functools.lru_cache(maxsize=1024)
+def _encode_uniform(key: UniformKey, image_format: str, save_options: tuple[tuple[str, Any], ...]) -> bytes:
+    mode, size, color = key
+    bytes_io = BytesIO()
+    Image.new(mode, size, color).save(bytes_io, image_format, **dict(save_options))
+    data = bytes_io.getvalue()
+    _remember(data, key)
+    return data
+
+
+def encode_uniform(key: UniformKey, image_format: str, **save_options: Any) -> bytes:
+    """Get the canonical encoded data of a uniform image, from a cache."""
+    try:
+        return _encode_uniform(key, image_format, tuple(sorted(save_options.items())))
+    except TypeError:
+        # Not hashable save options
+        mode, size, color = key
+        bytes_io = BytesIO()
+        Image.new(mode, size, color).save(bytes_io, image_format, **save_options)
+        return bytes_io.getvalue()
+
+
+def encode(image: Image.Image, image_format: str, **save_options: Any) -> bytes:
+    """
+    Encode ``image``.
+
+    The uniform images are not encoded again, the encoded data are taken from a cache.
+    """
+    key = get_uniform_key(image)
+    if key is not None:
+        return encode_uniform(key, image_format, **save_options)
+    bytes_io = BytesIO()
+    image.save(bytes_io, image_format, **save_options)
+    return bytes_io.getvalue()
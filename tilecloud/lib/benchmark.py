@@ -0,0 +1,592 @@
+"""
+Benchmark harness with reproducible synthetic tiles and local stand-ins of the remote services.
+
+The scenarios are registered in :data:`SCENARIOS`, they are run with :func:`run` and the results
+are compared against a baseline with :func:`compare`, see the ``tc-benchmark`` command.
+
+The stand-ins :class:`FakeS3Client` and :class:`FakeSQSQueue` are public, they can also be used
+to test the applications that use the S3 and SQS tile stores without the AWS services.
+"""
+
+import http.server
+import itertools
+import logging
+import math
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+from collections import Counter
+from collections.abc import Iterator
+from contextlib import ExitStack, contextmanager
+from io import BytesIO
+from typing import Any, ClassVar
+
+from PIL import Image, ImageDraw
+
+from tilecloud import BoundingPyramid, Bounds, Tile, TileCoord, TileStore
+from tilecloud.layout.template import TemplateTileLayout
+from tilecloud.store.dict import DictTileStore
+from tilecloud.store.filesystem import FilesystemTileStore
+from tilecloud.store.mbtiles import MBTilesTileStore
+from tilecloud.store.metatile import MetaTileSplitterTileStore
+from tilecloud.store.queue import decode_message, encode_binary_message, encode_message
+from tilecloud.store.url import URLTileStore
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def synthetic_image(seed: int, size: int = 256, shapes: int = 8) -> Image.Image:
+    """Draw a reproducible image with ``shapes`` random rectangles and lines."""
+    rand = random.Random(seed)  # noqa: S311
+    image = Image.new(
+        "RGBA", (size, size), (rand.randrange(256), rand.randrange(256), rand.randrange(256), 255)
+    )
+    draw = ImageDraw.Draw(image)
+    for _ in range(shapes):
+        color = (rand.randrange(256), rand.randrange(256), rand.randrange(256), rand.randrange(128, 256))
+        x0, y0 = rand.randrange(size), rand.randrange(size)
+        x1, y1 = rand.randrange(x0, size + 1), rand.randrange(y0, size + 1)
+        if rand.random() < 0.5:
+            draw.rectangle((x0, y0, x1, y1), fill=color)
+        else:
+            draw.line((x0, y0, x1, y1), fill=color, width=rand.randrange(1, 8))
+    return image
+
+
+def synthetic_png(seed: int, size: int = 256) -> bytes:
+    """Get a reproducible PNG image."""
+    bytes_io = BytesIO()
+    synthetic_image(seed, size).save(bytes_io, "PNG")
+    return bytes_io.getvalue()
+
+
+def synthetic_tiles(tilecoords: Iterator[TileCoord], distinct: int = 64, size: int = 256) -> Iterator[Tile]:
+    """
+    Get reproducible PNG tiles.
+
+    Only ``distinct`` different images are generated, they are assigned to the tiles from a
+    hash of the tile coordinates.
+    """
+    datas = [synthetic_png(seed, size) for seed in range(distinct)]
+    for tilecoord in tilecoords:
+        index = zlib.crc32(str(tilecoord).encode()) % distinct
+        yield Tile(tilecoord, data=datas[index], content_type="image/png")
+
+
+def synthetic_bounding_pyramid(count: int, z: int = 18) -> BoundingPyramid:
+    """Get a square bounding pyramid at level ``z`` that contains at least ``count`` tiles."""
+    side = max(1, math.isqrt(count - 1) + 1)
+    x, y = 1 << (z - 1), 1 << (z - 1)
+    return BoundingPyramid({z: (Bounds(x, x + side), Bounds(y, y + side))})
+
+
+@contextmanager
+def http_server(tilestore: TileStore, tilelayout: TemplateTileLayout) -> Iterator[str]:
+    """
+    Serve the tiles of ``tilestore`` in a thread on a local port.
+
+    Returns the base URL of the server, the tile paths are given by ``tilelayout``.
+    """
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self) -> None:
+            try:
+                tilecoord = tilelayout.tilecoord(self.path.lstrip("/"))
+            except ValueError:
+                tilecoord = None
+            tile = None if tilecoord is None else tilestore.get_one(Tile(tilecoord))
+            if tile is None or tile.data is None:
+                self.send_response(404)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", tile.content_type or "application/octet-stream")
+            self.send_header("Content-Length", str(len(tile.data)))
+            self.end_headers()
+            self.wfile.write(tile.data)
+
+        def log_message(self, *args: Any) -> None:
+            del args
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}/"
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+class FakeS3Client:
+    """An in-memory stand-in of the boto3 S3 client, with the methods used by the S3 tile store."""
+
+    def __init__(self) -> None:
+        self.objects: dict[tuple[str, str], dict[str, Any]] = {}
+
+    def put_object(self, Bucket: str, Key: str, Body: bytes, **kwargs: Any) -> None:  # noqa: N803
+        self.objects[(Bucket, Key)] = {"Body": bytes(Body), **kwargs}
+
+    def get_object(self, Bucket: str, Key: str) -> dict[str, Any]:  # noqa: N803
+        import botocore.exceptions  # noqa: PLC0415
+
+        if (Bucket, Key) not in self.objects:
+            raise botocore.exceptions.ClientError(
+                {"Error": {"Code": "NoSuchKey"}, "ResponseMetadata": {"HTTPStatusCode": 404}}, "GetObject"
+            )
+        obj = dict(self.objects[(Bucket, Key)])
+        obj["Body"] = BytesIO(obj["Body"])
+        return obj
+
+    def delete_object(self, Bucket: str, Key: str) -> None:  # noqa: N803
+        self.objects.pop((Bucket, Key), None)
+
+
+class FakeSQSMessage:
+    """A message of :class:`FakeSQSQueue`, like a boto3 SQS message resource."""
+
+    def __init__(self, queue: "FakeSQSQueue", message_id: str, body: str) -> None:
+        self.queue = queue
+        self.message_id = message_id
+        self.body = body
+        self.receipt_handle = ""
+
+    def delete(self) -> None:
+        self.queue.delete_messages(Entries=[{"Id": "0", "ReceiptHandle": self.receipt_handle}])
+
+
+class FakeSQSQueue:
+    """
+    An in-memory stand-in of a boto3 SQS queue resource, with the methods used by the SQS tile store.
+
+    It implements the visibility timeout and the long polling, and counts the requests by method
+    in ``requests``.
+    """
+
+    def __init__(self, visibility_timeout: float = 30, url: str = "fake-sqs") -> None:
+        self.url = url
+        self.visibility_timeout = visibility_timeout
+        self.attributes: dict[str, str] = {}
+        self.requests: Counter[str] = Counter()
+        # By message id: the message and the monotonic time when it is visible
+        self.messages: dict[str, tuple[FakeSQSMessage, float]] = {}
+        self._receipt_handles: dict[str, str] = {}
+        self._condition = threading.Condition()
+
+    def send_message(self, MessageBody: str, **kwargs: Any) -> dict[str, Any]:  # noqa: N803
+        return self._send([{"Id": "0", "MessageBody": MessageBody, **kwargs}], "send_message")
+
+    def send_messages(self, Entries: list[dict[str, Any]]) -> dict[str, Any]:  # noqa: N803
+        return self._send(Entries, "send_messages")
+
+    def _send(self, entries: list[dict[str, Any]], method: str) -> dict[str, Any]:
+        assert len(entries) <= 10
+        self.requests[method] += 1
+        with self._condition:
+            for entry in entries:
+                message_id = str(uuid.uuid4())
+                self.messages[message_id] = (FakeSQSMessage(self, message_id, entry["MessageBody"]), 0.0)
+            self._condition.notify_all()
+        return {"Successful": [{"Id": entry["Id"]} for entry in entries], "Failed": []}
+
+    def _visible(self, now: float, count: int | None = None) -> list[FakeSQSMessage]:
+        messages = (message for message, visible_time in self.messages.values() if visible_time <= now)
+        return list(itertools.islice(messages, count))
+
+    def receive_messages(
+        self,
+        MaxNumberOfMessages: int = 1,  # noqa: N803
+        WaitTimeSeconds: float = 0,  # noqa: N803
+        VisibilityTimeout: float | None = None,  # noqa: N803
+    ) -> list[FakeSQSMessage]:
+        self.requests["receive_messages"] += 1
+        timeout = self.visibility_timeout if VisibilityTimeout is None else VisibilityTimeout
+        deadline = time.monotonic() + WaitTimeSeconds
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                messages = self._visible(now, MaxNumberOfMessages)
+                if messages or now >= deadline:
+                    break
+                self._condition.wait(min(0.05, deadline - now))
+            for message in messages:
+                message.receipt_handle = str(uuid.uuid4())
+                self._receipt_handles[message.receipt_handle] = message.message_id
+                self.messages[message.message_id] = (message, now + timeout)
+        return messages
+
+    def delete_messages(self, Entries: list[dict[str, Any]]) -> dict[str, Any]:  # noqa: N803
+        assert len(Entries) <= 10
+        self.requests["delete_messages"] += 1
+        with self._condition:
+            for entry in Entries:
+                self.messages.pop(self._receipt_handles.pop(entry["ReceiptHandle"], ""), None)
+        return {"Successful": [{"Id": entry["Id"]} for entry in Entries], "Failed": []}
+
+    def change_message_visibility_batch(self, Entries: list[dict[str, Any]]) -> dict[str, Any]:  # noqa: N803
+        assert len(Entries) <= 10
+        self.requests["change_message_visibility_batch"] += 1
+        now = time.monotonic()
+        with self._condition:
+            for entry in Entries:
+                message_id = self._receipt_handles.get(entry["ReceiptHandle"])
+                if message_id in self.messages:
+                    message, _ = self.messages[message_id]
+                    self.messages[message_id] = (message, now + entry["VisibilityTimeout"])
+            self._condition.notify_all()
+        return {"Successful": [{"Id": entry["Id"]} for entry in Entries], "Failed": []}
+
+    def load(self) -> None:
+        self.requests["load"] += 1
+        with self._condition:
+            nb_visible = len(self._visible(time.monotonic()))
+            self.attributes = {
+                "ApproximateNumberOfMessages": str(nb_visible),
+                "ApproximateNumberOfMessagesNotVisible": str(len(self.messages) - nb_visible),
+                "VisibilityTimeout": str(self.visibility_timeout),
+                "DelaySeconds": "0",
+                "ReceiveMessageWaitTimeSeconds": "0",
+                "CreatedTimestamp": "0",
+                "LastModifiedTimestamp": "0",
+            }
+
+
+class Scenario:
+    """
+    A benchmark scenario.
+
+    :meth:`setup` and :meth:`teardown` are not measured, :meth:`run` processes ``count`` items.
+    The scenario can add extra values to the results in ``metrics``.
+
+        size:
+        The default number of items.
+    """
+
+    name = ""
+    description = ""
+    size = 1000
+
+    def setup(self, count: int) -> None:
+        self.count = count
+        self.metrics: dict[str, float] = {}
+
+    def run(self) -> None:
+        raise NotImplementedError
+
+    def teardown(self) -> None:
+        pass
+
+
+class TileCoordScenario(Scenario):
+    """Format and parse tile coordinates."""
+
+    name = "tilecoord"
+    description = "Format and parse tile coordinates"
+    size = 200_000
+
+    def run(self) -> None:
+        for index in range(self.count):
+            tilecoord = TileCoord(18, index, index, 2)
+            assert TileCoord.from_string(str(tilecoord)) == tilecoord
+
+
+class ZIterScenario(Scenario):
+    """Iterate over the tile coordinates of a bounding pyramid level."""
+
+    name = "ziter"
+    description = "Iterate over the coords of a bounding pyramid level"
+    size = 1_000_000
+
+    def setup(self, count: int) -> None:
+        super().setup(count)
+        self.bounding_pyramid = synthetic_bounding_pyramid(count)
+
+    def run(self) -> None:
+        for _ in itertools.islice(self.bounding_pyramid.ziter(18), self.count):
+            pass
+
+
+class TemplateLayoutScenario(Scenario):
+    """Format and parse the file names of a template tile layout."""
+
+    name = "template-layout"
+    description = "Format and parse template layout file names"
+    size = 200_000
+
+    def setup(self, count: int) -> None:
+        super().setup(count)
+        self.tilelayout = TemplateTileLayout("tiles/%(z)d/%(x)d/%(y)d.png")
+        self.tilecoords = list(synthetic_bounding_pyramid(count).ziter(18))[:count]
+
+    def run(self) -> None:
+        for tilecoord in self.tilecoords:
+            assert self.tilelayout.tilecoord(self.tilelayout.filename(tilecoord)) == tilecoord
+
+
+class _TemporaryDirectoryScenario(Scenario):
+    def setup(self, count: int) -> None:
+        super().setup(count)
+        self.tmpdir = tempfile.mkdtemp(prefix="tilecloud-benchmark-")
+        self.tilecoords = list(synthetic_bounding_pyramid(count).ziter(18))[:count]
+
+    def teardown(self) -> None:
+        shutil.rmtree(self.tmpdir)
+
+
+class FilesystemToMBTilesScenario(_TemporaryDirectoryScenario):
+    """Copy PNG tiles from a filesystem tile store to an MBTiles tile store."""
+
+    name = "fs-to-mbtiles"
+    description = "Copy PNG tiles from the filesystem to MBTiles"
+    size = 100_000
+
+    def setup(self, count: int) -> None:
+        super().setup(count)
+        self.tilelayout = TemplateTileLayout(os.path.join(self.tmpdir, "tiles", "%(z)d/%(x)d/%(y)d.png"))
+        input_tilestore = FilesystemTileStore(self.tilelayout)
+        for _ in input_tilestore.put(synthetic_tiles(iter(self.tilecoords))):
+            pass
+
+    def run(self) -> None:
+        input_tilestore = FilesystemTileStore(self.tilelayout, content_type="image/png")
+        connection = sqlite3.connect(os.path.join(self.tmpdir, "tiles.mbtiles"))
+        try:
+            output_tilestore = MBTilesTileStore(connection)
+            tilestream = input_tilestore.get(Tile(tilecoord) for tilecoord in self.tilecoords)
+            for _ in output_tilestore.put(tilestream):
+                pass
+            assert len(output_tilestore) == self.count
+        finally:
+            connection.close()
+
+
+class MetaTileSplitScenario(Scenario):
+    """Split PNG metatiles into PNG tiles."""
+
+    name = "metatile-split"
+    description = "Split 8x8 PNG metatiles"
+    size = 10_000
+
+    def setup(self, count: int) -> None:
+        super().setup(count)
+        datas = [synthetic_png(seed, 8 * 256) for seed in range(4)]
+        self.metatiles = [
+            Tile(TileCoord(18, 8 * index, 0, 8), data=datas[index % len(datas)]) for index in range(count)
+        ]
+        self.splitter = MetaTileSplitterTileStore("image/png")
+
+    def run(self) -> None:
+        for _ in self.splitter.get(
+            Tile(metatile.tilecoord, data=metatile.data) for metatile in self.metatiles
+        ):
+            pass
+
+
+class HTTPGetScenario(Scenario):
+    """Get tiles with a URL tile store from a local HTTP server."""
+
+    name = "http-get"
+    description = "Get tiles from a local HTTP server"
+    size = 5_000
+    max_workers = 8
+
+    def setup(self, count: int) -> None:
+        super().setup(count)
+        self.tilecoords = list(synthetic_bounding_pyramid(count).ziter(18))[:count]
+        source: dict[TileCoord, dict[str, Any]] = {
+            tile.tilecoord: {"data": tile.data, "content_type": tile.content_type}
+            for tile in synthetic_tiles(iter(self.tilecoords))
+        }
+        # Closed in teardown, the server runs during the measured run
+        self._exit_stack = ExitStack()
+        url = self._exit_stack.enter_context(
+            http_server(DictTileStore(source), TemplateTileLayout("%(z)d/%(x)d/%(y)d.png"))
+        )
+        self.tilestore = URLTileStore(
+            [TemplateTileLayout(url + "%(z)d/%(x)d/%(y)d.png")], max_workers=self.max_workers
+        )
+
+    def run(self) -> None:
+        tiles = list(self.tilestore.get(Tile(tilecoord) for tilecoord in self.tilecoords))
+        assert len(tiles) == self.count
+        assert all(tile is not None and tile.error is None for tile in tiles)
+
+    def teardown(self) -> None:
+        self._exit_stack.close()
+
+
+class S3PutGetScenario(Scenario):
+    """Put and get tiles with an S3 tile store on an in-memory S3 client."""
+
+    name = "s3-put-get"
+    description = "Put and get tiles with the S3 store on a fake client"
+    size = 100_000
+
+    def setup(self, count: int) -> None:
+        super().setup(count)
+        from tilecloud.store.s3 import S3TileStore  # noqa: PLC0415
+
+        self.tilestore = S3TileStore("bucket", TemplateTileLayout("tiles/%(z)d/%(x)d/%(y)d.png"))
+        self.tilestore._client = FakeS3Client()  # noqa: SLF001 # pylint: disable=protected-access
+        self.tiles = list(synthetic_tiles(synthetic_bounding_pyramid(count).ziter(18)))[:count]
+
+    def run(self) -> None:
+        for _ in self.tilestore.put(self.tiles):
+            pass
+        for _ in self.tilestore.get(Tile(tile.tilecoord) for tile in self.tiles):
+            pass
+
+
+class QueueMessageScenario(Scenario):
+    """Encode and decode the queue messages."""
+
+    name = "queue-message"
+    description = "Encode and decode base64 JSON queue messages"
+    size = 100_000
+
+    def setup(self, count: int) -> None:
+        super().setup(count)
+        self.tiles = [
+            Tile(TileCoord(tilecoord.z, tilecoord.x, tilecoord.y, 8), metadata={"layer": "default"})
+            for tilecoord in itertools.islice(synthetic_bounding_pyramid(count).ziter(18), count)
+        ]
+        self.metrics["bytes_per_message"] = len(self.encode(self.tiles[0]))
+
+    @staticmethod
+    def encode(tile: Tile) -> str | bytes:
+        return encode_message(tile)
+
+    def run(self) -> None:
+        for tile in self.tiles:
+            decode_message(self.encode(tile))
+
+
+class BinaryQueueMessageScenario(QueueMessageScenario):
+    """Encode and decode the binary queue messages."""
+
+    name = "queue-message-binary"
+    description = "Encode and decode binary queue messages"
+
+    @staticmethod
+    def encode(tile: Tile) -> str | bytes:
+        return encode_binary_message(tile)
+
+
+class SQSConsumeScenario(Scenario):
+    """Consume the tiles of a local SQS queue stand-in, one request per message."""
+
+    name = "sqs-consume"
+    description = "Consume and delete the tiles of an SQS queue with a request per message"
+    size = 20_000
+    store_kwargs: ClassVar[dict[str, Any]] = {"wait_time": 0}
+
+    def setup(self, count: int) -> None:
+        super().setup(count)
+        from tilecloud.store.sqs import SQSTileStore  # noqa: PLC0415
+
+        self.queue = FakeSQSQueue()
+        self.tilestore = SQSTileStore(self.queue, **self.store_kwargs)
+        for _ in self.tilestore.put(
+            Tile(tilecoord)
+            for tilecoord in itertools.islice(synthetic_bounding_pyramid(count).ziter(18), count)
+        ):
+            pass
+        self.queue.requests.clear()
+
+    def run(self) -> None:
+        for _ in self.tilestore.delete(self.tilestore.list()):
+            pass
+        self.metrics["requests_per_tile"] = sum(self.queue.requests.values()) / self.count
+
+
+class BatchSQSConsumeScenario(SQSConsumeScenario):
+    """Consume the tiles of a local SQS queue stand-in, with receiver threads and batch deletes."""
+
+    name = "sqs-consume-batch"
+    description = "Consume and delete the tiles of an SQS queue with receiver threads and batch deletes"
+    store_kwargs: ClassVar[dict[str, Any]] = {"wait_time": 0, "receivers": 2, "delete_batch_size": 10}
+
+
+SCENARIOS: dict[str, type[Scenario]] = {
+    scenario.name: scenario
+    for scenario in (
+        TileCoordScenario,
+        ZIterScenario,
+        TemplateLayoutScenario,
+        FilesystemToMBTilesScenario,
+        MetaTileSplitScenario,
+        HTTPGetScenario,
+        S3PutGetScenario,
+        QueueMessageScenario,
+        BinaryQueueMessageScenario,
+        SQSConsumeScenario,
+        BatchSQSConsumeScenario,
+    )
+}
+
+
+def run(names: list[str] | None = None, scale: float = 1.0, repeat: int = 3) -> dict[str, dict[str, Any]]:
+    """
+    Run the benchmark scenarios.
+
+    Arguments:
+        names: The scenario names, default is all the scenarios
+        scale: The factor applied to the default number of items of the scenarios
+        repeat: The number of measured runs of each scenario
+
+    Returns the number of items, the run durations and the median number of items per second
+    by scenario name.
+
+    """
+    results = {}
+    for name in names or list(SCENARIOS):
+        scenario = SCENARIOS[name]()
+        count = max(1, int(scenario.size * scale))
+        durations = []
+        for _ in range(repeat):
+            scenario.setup(count)
+            try:
+                start = time.perf_counter()
+                scenario.run()
+                durations.append(time.perf_counter() - start)
+            finally:
+                scenario.teardown()
+        median = statistics.median(durations)
+        results[name] = {
+            "count": count,
+            "durations": durations,
+            "items_per_second": count / median if median else 0.0,
+            **scenario.metrics,
+        }
+        _LOGGER.info("%s: %d items, %.0f items/s", name, count, results[name]["items_per_second"])
+    return results
+
+
+def compare(results: dict[str, dict[str, Any]], baseline: dict[str, dict[str, Any]]) -> dict[str, float]:
+    """
+    Compare benchmark results against a baseline.
+
+    Returns the relative throughput change of each scenario present in both, see :func:`regressions`.
+    """
+    changes = {}
+    for name, result in results.items():
+        if name in baseline and baseline[name]["items_per_second"]:
+            changes[name] = result["items_per_second"] / baseline[name]["items_per_second"] - 1
+    return changes
+
+
+def regressions(changes: dict[str, float], tolerance: float = 0.1) -> list[str]:
+    """Get the names of the regressed scenarios."""
+    return [name for name, change in changes.items() if change < -tolerance]
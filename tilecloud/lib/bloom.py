@@ -0,0 +1,122 @@
+"""Bloom filters, to know locally that a key is definitely not in a set."""
+
+import hashlib
+import math
+import struct
+
+_MAGIC = b"TCBF"
+_VERSION = 1
+# magic, version, counting, number of cells, number of hashes, number of added keys
+_HEADER = struct.Struct("<4sBBQIQ")
+
+
+def _to_bytes(key: str | bytes) -> bytes:
+    return key.encode() if isinstance(key, str) else key
+
+
+class BloomFilter:
+    """
+    A Bloom filter.
+
+    A key that was added is always found, a key that was not added is found with a probability
+    of ``error_rate`` while the number of added keys is under ``capacity``.
+
+        capacity:
+        The expected number of keys.
+
+        error_rate:
+        The false positive rate at capacity.
+    """
+
+    counting = False
+
+    def __init__(self, capacity: int, error_rate: float = 0.01) -> None:
+        assert capacity > 0
+        assert 0 < error_rate < 1
+        size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self._init(size, max(1, round(size / capacity * math.log(2))), 0)
+
+    def _init(self, size: int, nb_hashes: int, count: int) -> None:
+        self.size = size
+        self.nb_hashes = nb_hashes
+        self.count = count
+        self._cells = self._new_cells(size)
+
+    @staticmethod
+    def _new_cells(size: int) -> bytearray:
+        return bytearray((size + 7) // 8)
+
+    def _positions(self, key: str | bytes) -> list[int]:
+        digest = hashlib.blake2b(_to_bytes(key), digest_size=16).digest()
+        hash1, hash2 = struct.unpack("<QQ", digest)
+        return [(hash1 + index * hash2) % self.size for index in range(self.nb_hashes)]
+
+    def add(self, key: str | bytes) -> None:
+        for position in self._positions(key):
+            self._cells[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str | bytes) -> bool:
+        return all(self._cells[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def __len__(self) -> int:
+        """Get the number of added keys, the duplicates are counted."""
+        return self.count
+
+    def error_rate(self) -> float:
+        """Get the estimated false positive rate with the current number of keys."""
+        return (1 - math.exp(-self.nb_hashes * self.count / self.size)) ** self.nb_hashes
+
+    def save(self, filename: str) -> None:
+        with open(filename, "wb") as file:
+            file.write(_HEADER.pack(_MAGIC, _VERSION, self.counting, self.size, self.nb_hashes, self.count))
+            file.write(self._cells)
+
+    @staticmethod
+    def load(filename: str) -> "BloomFilter":
+        """Load a filter saved with :meth:`save`, a :class:`CountingBloomFilter` if it was one."""
+        with open(filename, "rb") as file:
+            magic, version, counting, size, nb_hashes, count = _HEADER.unpack(file.read(_HEADER.size))
+            if magic != _MAGIC or version != _VERSION:
+                raise ValueError(f"Not a Bloom filter file: {filename}")
+            bloom_filter_class = CountingBloomFilter if counting else BloomFilter
+            bloom_filter = bloom_filter_class.__new__(bloom_filter_class)
+            bloom_filter._init(size, nb_hashes, count)  # noqa: SLF001 # pylint: disable=protected-access
+            file.readinto(bloom_filter._cells)  # noqa: SLF001 # pylint: disable=protected-access
+        return bloom_filter
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(size={self.size}, nb_hashes={self.nb_hashes}, count={self.count})"
+
+
+class CountingBloomFilter(BloomFilter):
+    """
+    A Bloom filter that supports the removal of keys, using 8 bits counters instead of bits.
+
+    A saturated counter is never decremented, to keep the added keys found.
+    """
+
+    counting = True
+
+    @staticmethod
+    def _new_cells(size: int) -> bytearray:
+        return bytearray(size)
+
+    def add(self, key: str | bytes) -> None:
+        for position in self._positions(key):
+            if self._cells[position] < 255:
+                self._cells[position] += 1
+        self.count += 1
+
+    def remove(self, key: str | bytes) -> None:
+        """Remove a key, it should have been added before."""
+        positions = self._positions(key)
+        if not all(self._cells[position] for position in positions):
+            raise KeyError(key)
+        for position in positions:
+            if self._cells[position] < 255:
+                self._cells[position] -= 1
+        self.count -= 1
+
+    def __contains__(self, key: str | bytes) -> bool:
+        return all(self._cells[position] for position in self._positions(key))
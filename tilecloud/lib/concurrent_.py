@@ -0,0 +1,48 @@
+import collections
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, wait
+
+
+def imap[T, R](
+    executor: Executor,
+    function: Callable[[T], R],
+    iterable: Iterable[T],
+    max_pending: int,
+    ordered: bool = True,
+) -> Iterator[R]:
+    """
+    Lazily map ``function`` over ``iterable`` using ``executor``.
+
+    Contrary to :meth:`concurrent.futures.Executor.map` the input is consumed
+    progressively, at most ``max_pending`` items are submitted at any time, so it
+    can be used on infinite tile streams.
+
+    Arguments:
+        executor: The executor used to run the function
+        function: The function to apply
+        iterable: The input items
+        max_pending: The maximum number of submitted but not yielded items
+        ordered: Yield the results in the input order, otherwise as soon as they are available
+
+    """
+    assert max_pending > 0
+    if ordered:
+        queue: collections.deque[Future[R]] = collections.deque()
+        for item in iterable:
+            queue.append(executor.submit(function, item))
+            if len(queue) >= max_pending:
+                yield queue.popleft().result()
+        while queue:
+            yield queue.popleft().result()
+    else:
+        pending: set[Future[R]] = set()
+        for item in iterable:
+            pending.add(executor.submit(function, item))
+            if len(pending) >= max_pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
@@ -0,0 +1,100 @@
+import logging
+import time
+from collections.abc import Iterable
+
+from tilecloud import BoundingPyramid, Tile, TileCoord, TileStore
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class ExistenceIndex:
+    """
+    The set of the existing tiles of a bounding pyramid, stored as a bitmap.
+
+    It uses one bit per tile of the bounding pyramid, e.g. 6 MB for 50M tiles, and can be used
+    in place of a tile store for the ``tile in tilestore`` checks.
+
+    When the bitmap would be bigger than ``max_bitmap_size`` bytes (e.g. 11 GB for the world
+    up to the level 18), the indexes of the existing tiles are stored in a set instead, so
+    the memory depends on the number of existing tiles rather than on the pyramid volume.
+
+    max_bitmap_size:
+        The maximum size of the bitmap in bytes.
+    """
+
+    def __init__(self, bounding_pyramid: BoundingPyramid, max_bitmap_size: int = 256 * 1024 * 1024) -> None:
+        self.bounding_pyramid = bounding_pyramid
+        # By level: offset, first x, first y, number of rows
+        self._levels: dict[int, tuple[int, int, int, int]] = {}
+        size = 0
+        for z, (xbounds, ybounds) in sorted(bounding_pyramid.bounds.items()):
+            if xbounds.start is None or ybounds.start is None:
+                continue
+            assert xbounds.stop is not None
+            assert ybounds.stop is not None
+            height = ybounds.stop - ybounds.start
+            self._levels[z] = (size, xbounds.start, ybounds.start, height)
+            size += (xbounds.stop - xbounds.start) * height
+        self.size = size
+        self._bitmap: bytearray | None = None
+        self._set: set[int] = set()
+        if (size + 7) // 8 <= max_bitmap_size:
+            self._bitmap = bytearray((size + 7) // 8)
+        else:
+            _LOGGER.info("The bitmap of %d tiles is bigger than %d bytes, using a set", size, max_bitmap_size)
+
+    def _index(self, tilecoord: TileCoord) -> int | None:
+        if tilecoord not in self.bounding_pyramid:
+            return None
+        offset, x, y, height = self._levels[tilecoord.z]
+        return offset + (tilecoord.x - x) * height + tilecoord.y - y
+
+    def add(self, tilecoord: TileCoord) -> None:
+        """Mark the tile as existing, the tiles outside the bounding pyramid are ignored."""
+        index = self._index(tilecoord)
+        if index is None:
+            return
+        if self._bitmap is None:
+            self._set.add(index)
+        else:
+            self._bitmap[index >> 3] |= 1 << (index & 7)
+
+    def update(self, tiles: Iterable[Tile]) -> None:
+        for tile in tiles:
+            self.add(tile.tilecoord)
+
+    def __contains__(self, tile: Tile) -> bool:
+        if not tile:
+            return False
+        index = self._index(tile.tilecoord)
+        if index is None:
+            return False
+        if self._bitmap is None:
+            return index in self._set
+        return bool(self._bitmap[index >> 3] & (1 << (index & 7)))
+
+    def __len__(self) -> int:
+        if self._bitmap is None:
+            return len(self._set)
+        return sum(byte.bit_count() for byte in self._bitmap)
+
+    @classmethod
+    def from_tilestore(
+        cls, tilestore: TileStore, bounding_pyramid: BoundingPyramid, max_bitmap_size: int = 256 * 1024 * 1024
+    ) -> "ExistenceIndex":
+        """
+        Build the index from the listing of a tile store.
+
+        This replaces a request per tile (e.g. a HEAD request for S3) by a listing, e.g. the
+        pages of 1000 keys for S3 or a single query for MBTiles.
+        """
+        start = time.perf_counter()
+        index = cls(bounding_pyramid, max_bitmap_size)
+        index.update(tilestore.list())
+        _LOGGER.info(
+            "Existence index built in %.1f s, %d of %d tiles exist",
+            time.perf_counter() - start,
+            len(index),
+            index.size,
+        )
+        return index
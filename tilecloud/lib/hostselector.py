@@ -0,0 +1,168 @@
+"""
+Select the host (URL template) used to get a tile from a multi-host tile store.
+
+All the selectors handle the circuit breaking of the failing hosts and the per-host
+concurrency caps, they only differ in how they choose between the available hosts.
+"""
+
+import hashlib
+import threading
+import time
+from typing import Any
+
+from tilecloud import TileCoord
+
+
+class Host:
+    """The state of an upstream host."""
+
+    def __init__(self, index: int) -> None:
+        self.index = index
+        self.salt = index.to_bytes(8, "little")
+        self.outstanding = 0
+        self.latency: float | None = None
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.probing = False
+
+    def is_open(self, now: float) -> bool:
+        """Return ``True`` if the circuit is open, the host should not be used."""
+        if self.open_until == 0.0:
+            return False
+        # Half open: let one probe request go through once the recovery timeout is elapsed
+        return now < self.open_until or self.probing
+
+    def __repr__(self) -> str:  # pragma: no cover
+        return (
+            f"Host({self.index}, outstanding={self.outstanding}, latency={self.latency}, "
+            f"failures={self.consecutive_failures})"
+        )
+
+
+class HostSelector:
+    """
+    Base class for the host selectors.
+
+        nb_hosts:
+        The number of hosts.
+
+        max_concurrency:
+        The maximum number of concurrent requests on one host, ``None`` for no limit.
+
+        failure_threshold:
+        The number of consecutive failures after which the circuit of a host is opened.
+
+        recovery_timeout:
+        The number of seconds during which an opened host is not used before being probed again.
+    """
+
+    def __init__(
+        self,
+        nb_hosts: int,
+        max_concurrency: int | None = None,
+        failure_threshold: int = 5,
+        recovery_timeout: float = 30.0,
+    ) -> None:
+        assert nb_hosts > 0
+        self.hosts = [Host(index) for index in range(nb_hosts)]
+        self.max_concurrency = max_concurrency
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self._condition = threading.Condition()
+
+    def acquire(self, tilecoord: TileCoord) -> int:
+        """Get the index of the host to use for ``tilecoord``, wait if all the hosts are busy."""
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                available = [
+                    host
+                    for host in self.hosts
+                    if self.max_concurrency is None or host.outstanding < self.max_concurrency
+                ]
+                if available:
+                    closed = [host for host in available if not host.is_open(now)]
+                    # If all the hosts are failing we continue to use them rather than failing everything
+                    host = self._choose(tilecoord, closed or available)
+                    if host.open_until != 0.0 and now >= host.open_until:
+                        host.probing = True
+                    host.outstanding += 1
+                    return host.index
+                self._condition.wait()
+
+    def release(self, index: int, elapsed: float, success: bool) -> None:
+        """Report the end of a request on the host ``index``."""
+        with self._condition:
+            host = self.hosts[index]
+            host.outstanding -= 1
+            host.probing = False
+            if success:
+                host.consecutive_failures = 0
+                host.open_until = 0.0
+                self._update_latency(host, elapsed)
+            else:
+                host.consecutive_failures += 1
+                if host.consecutive_failures >= self.failure_threshold:
+                    host.open_until = time.monotonic() + self.recovery_timeout
+            self._condition.notify()
+
+    def _update_latency(self, host: Host, elapsed: float) -> None:
+        host.latency = elapsed
+
+    def _choose(self, tilecoord: TileCoord, hosts: list[Host]) -> Host:
+        raise NotImplementedError
+
+
+class ConsistentHashHostSelector(HostSelector):
+    """
+    Select the host with a rendezvous hashing of the tile coordinate.
+
+    A tile is always fetched from the same host while it's available, which is cache friendly,
+    and the tiles of a failing host are evenly distributed on the other ones.
+    """
+
+    def _choose(self, tilecoord: TileCoord, hosts: list[Host]) -> Host:
+        key = f"{tilecoord.z}/{tilecoord.x}/{tilecoord.y}/{tilecoord.n}".encode()
+        return max(hosts, key=lambda host: hashlib.blake2b(key, digest_size=8, salt=host.salt).digest())
+
+
+class LeastOutstandingHostSelector(HostSelector):
+    """Select the host with the least outstanding requests."""
+
+    def __init__(self, nb_hosts: int, **kwargs: Any) -> None:
+        super().__init__(nb_hosts, **kwargs)
+        self._next = 0
+
+    def _choose(self, tilecoord: TileCoord, hosts: list[Host]) -> Host:
+        # Round robin between the hosts with the same number of outstanding requests
+        self._next += 1
+        return min(hosts, key=lambda host: (host.outstanding, (host.index - self._next) % len(self.hosts)))
+
+
+class EWMALatencyHostSelector(LeastOutstandingHostSelector):
+    """
+    Select the host with the lowest expected latency.
+
+    The latency is an exponentially weighted moving average of the successful request durations,
+    multiplied by the number of outstanding requests plus one.
+
+        decay:
+        The weight of the last request duration in the moving average.
+    """
+
+    def __init__(self, nb_hosts: int, decay: float = 0.3, **kwargs: Any) -> None:
+        super().__init__(nb_hosts, **kwargs)
+        self.decay = decay
+
+    def _update_latency(self, host: Host, elapsed: float) -> None:
+        if host.latency is None:
+            host.latency = elapsed
+        else:
+            host.latency = self.decay * elapsed + (1 - self.decay) * host.latency
+
+    def _choose(self, tilecoord: TileCoord, hosts: list[Host]) -> Host:
+        # Hosts without measures are tried first
+        unknown = [host for host in hosts if host.latency is None]
+        if unknown:
+            return super()._choose(tilecoord, unknown)
+        return min(hosts, key=lambda host: (host.latency or 0.0) * (host.outstanding + 1))
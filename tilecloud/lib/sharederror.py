@@ -0,0 +1,38 @@
+from typing import Any, cast
+
+from tilecloud import Tile, TileCoord
+
+
+class SharedErrorTile(Tile):
+    """
+    A tile whose error is also stored in a list, shared e.g. with a finalizer of the tile.
+
+    The finalizers can't access the tile, the shared list tells them whether the tile was dropped
+    from the pipeline with an error, e.g. by ``DropErrors``.
+
+        errors:
+        A list of one item, the error of the tile.
+    """
+
+    def __init__(self, tilecoord: TileCoord, errors: list[Any], **kwargs: Any) -> None:
+        self.shared_errors = errors
+        super().__init__(tilecoord, **kwargs)
+
+    @classmethod
+    def copy(cls, tile: Tile, errors: list[Any]) -> "SharedErrorTile":
+        """Get a copy of ``tile`` with all its attributes."""
+        copy = cls(tile.tilecoord, errors)
+        copy.__dict__.update(tile.__dict__)
+        copy.shared_errors = errors
+        copy.error = tile.error
+        return copy
+
+    @property  # type: ignore[override]
+    def error(self) -> Exception | str | None:
+        return cast("Exception | str | None", self.shared_errors[0])
+
+    @error.setter
+    def error(self, error: Exception | str | None) -> None:
+        self.shared_errors[0] = error
+        # Also in the attributes, used to format the log messages
+        self.__dict__["error"] = error
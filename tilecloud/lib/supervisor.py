@@ -0,0 +1,317 @@
+"""Consume a queue tile store with a pool of local worker processes."""
+
+import itertools
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
+import queue
+import threading
+from collections.abc import Callable, Iterator
+from multiprocessing.context import BaseContext
+from typing import Any
+
+from tilecloud import Tile, TileCoord, TileStore
+
+_LOGGER = logging.getLogger(__name__)
+
+# key, tilecoord, content encoding, content type, data, metadata
+_Task = tuple[int, TileCoord, Any, str | None, bytes | None, dict[str, str]]
+# key, dropped, content encoding, content type, data, metadata, error
+_Result = tuple[int, bool, Any, str | None, bytes | None, dict[str, str], str | None]
+
+
+def _work(
+    function: Callable[[Tile], Tile | None],
+    initializer: Callable[..., None] | None,
+    initargs: tuple[Any, ...],
+    tasks: "multiprocessing.Queue[_Task | None]",
+    results: "multiprocessing.Queue[_Result]",
+    running: Any,
+) -> None:
+    if initializer is not None:
+        initializer(*initargs)
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        key, tilecoord, content_encoding, content_type, data, metadata = task
+        tile = Tile(
+            tilecoord,
+            content_encoding=content_encoding,
+            content_type=content_type,
+            data=data,
+            metadata=metadata,
+        )
+        # Read by the supervisor when the worker crashes
+        running.value = key
+        try:
+            result = function(tile)
+        except Exception as exception:  # pylint: disable=broad-except
+            results.put((key, False, None, None, None, {}, f"{type(exception).__name__}: {exception}"))
+            running.value = -1
+            continue
+        running.value = -1
+        if result is None:
+            results.put((key, True, None, None, None, {}, None))
+        else:
+            error = None if result.error is None else str(result.error)
+            results.put(
+                (
+                    key,
+                    False,
+                    result.content_encoding,
+                    result.content_type,
+                    result.data,
+                    result.metadata,
+                    error,
+                )
+            )
+
+
+class _Worker:
+    def __init__(
+        self, process: multiprocessing.Process, tasks: "multiprocessing.Queue[_Task | None]", running: Any
+    ) -> None:
+        self.process = process
+        self.tasks = tasks
+        # The key of the tile being processed, -1 if none
+        self.running = running
+        self.keys: set[int] = set()
+
+
+class Supervisor:
+    """
+    Consume a queue tile store, e.g. a Redis or an SQS one, with a pool of worker processes.
+
+    The supervisor is the only process connected to the queue, it reads the tiles, dispatches them
+    to the least loaded worker, collects the results and acknowledges the tiles with
+    :meth:`TileStore.delete_one`, so the acknowledgements are batched by the store, see its
+    ``ack_batch_size`` or ``delete_batch_size``. A crashed worker is restarted and the tiles it had
+    are dispatched again to the other workers.
+
+    The tiles stay leased in the queue while they are in a worker, a long processing needs the
+    ``heartbeat_interval`` of the Redis store or the ``visibility_timeout`` of the SQS store.
+
+        store:
+        The queue tile store.
+
+        function:
+        The function applied to the tiles in the workers, like a filter it returns the tile or
+        ``None`` to drop it. Only the coordinate, the data, the content type, the content encoding
+        and the metadata of the tiles are sent to the workers and back.
+
+        processes:
+        The number of worker processes, default is the number of CPUs.
+
+        prefetch:
+        The maximum number of tiles dispatched to a worker and not yet done, a small value keeps
+        the tiles from waiting behind a slow one.
+
+        max_retries:
+        The number of times a tile that was being processed by a crashed worker is dispatched
+        again, then it is acknowledged with an error, so a tile that crashes the workers doesn't
+        crash all of them. The other tiles of the crashed worker are dispatched again without
+        counting a retry.
+
+        stop_timeout:
+        The maximum number of seconds to wait for the thread that reads the store when the
+        iteration stops, it can be blocked in a read while the queue is idle, it is then left
+        behind and stops after its read.
+
+        initializer, initargs:
+        Called in each worker process when it starts, e.g. to load a map.
+
+        mp_context:
+        The multiprocessing context, default is ``forkserver`` where available, the tiles are read
+        in a thread, so forking the supervisor isn't safe.
+    """
+
+    def __init__(
+        self,
+        store: TileStore,
+        function: Callable[[Tile], Tile | None],
+        processes: int | None = None,
+        prefetch: int = 2,
+        max_retries: int = 2,
+        stop_timeout: float = 5.0,
+        initializer: Callable[..., None] | None = None,
+        initargs: tuple[Any, ...] = (),
+        mp_context: BaseContext | None = None,
+    ) -> None:
+        assert prefetch > 0
+        self.store = store
+        self.function = function
+        self.processes = processes or os.cpu_count() or 1
+        self.prefetch = prefetch
+        self.max_retries = max_retries
+        self.stop_timeout = stop_timeout
+        self.initializer = initializer
+        self.initargs = initargs
+        self._context: Any = mp_context or multiprocessing.get_context(
+            "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        )
+        self._results: multiprocessing.Queue[_Result] = self._context.Queue()
+        self._workers: list[_Worker] = []
+        self._tiles: dict[int, Tile] = {}
+        self._retries: dict[int, int] = {}
+        self._read_error: Exception | None = None
+
+    def _start_worker(self) -> _Worker:
+        tasks = self._context.Queue()
+        running = self._context.Value("q", -1, lock=False)
+        process = self._context.Process(
+            target=_work,
+            args=(self.function, self.initializer, self.initargs, tasks, self._results, running),
+            daemon=True,
+        )
+        process.start()
+        return _Worker(process, tasks, running)
+
+    def _dispatch(self, key: int) -> None:
+        worker = min(self._workers, key=lambda worker: len(worker.keys))
+        worker.keys.add(key)
+        tile = self._tiles[key]
+        worker.tasks.put(
+            (key, tile.tilecoord, tile.content_encoding, tile.content_type, tile.data, tile.metadata)
+        )
+
+    def _restart_crashed(self) -> Iterator[Tile]:
+        """Restart the crashed workers, dispatch their tiles again and get the failed ones."""
+        sentinels = {worker.process.sentinel: worker for worker in self._workers}
+        for sentinel in multiprocessing.connection.wait(list(sentinels), timeout=0):
+            crashed = sentinels[sentinel]  # type: ignore[index]
+            crashed.process.join()
+            _LOGGER.warning(
+                "Worker %d crashed with exit code %s, restart it and dispatch again its %d tiles",
+                crashed.process.pid,
+                crashed.process.exitcode,
+                len(crashed.keys),
+            )
+            self._workers[self._workers.index(crashed)] = self._start_worker()
+            for key in sorted(crashed.keys):
+                if key == crashed.running.value:
+                    self._retries[key] = self._retries.get(key, 0) + 1
+                if self._retries.get(key, 0) > self.max_retries:
+                    tile = self._done(key)
+                    tile.error = f"The worker crashed {self.max_retries + 1} times processing the tile"
+                    yield tile
+                else:
+                    self._dispatch(key)
+
+    def _done(self, key: int) -> Tile:
+        for worker in self._workers:
+            worker.keys.discard(key)
+        self._retries.pop(key, None)
+        return self._tiles.pop(key)
+
+    def _collect(self, result: _Result) -> Tile | None:
+        key, dropped, content_encoding, content_type, data, metadata, error = result
+        if key not in self._tiles:
+            # Already done by a worker that crashed after sending the result
+            return None
+        tile = self._done(key)
+        if not dropped:
+            tile.content_encoding = content_encoding
+            tile.content_type = content_type
+            tile.data = data
+            tile.metadata = metadata
+            tile.error = error
+        self.store.delete_one(tile)
+        return None if dropped else tile
+
+    @staticmethod
+    def _put(tiles: "queue.Queue[Tile | None]", tile: Tile | None, stopping: threading.Event) -> bool:
+        """Put a tile in the queue of the read tiles, unless the iteration stops."""
+        while not stopping.is_set():
+            try:
+                tiles.put(tile, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _read(self, tiles: "queue.Queue[Tile | None]", stopping: threading.Event) -> None:
+        """Read the tiles of the store in a thread, the reads can block while the queue is empty."""
+        listed = self.store.list()
+        try:
+            for tile in listed:
+                if not self._put(tiles, tile, stopping):
+                    return
+        except Exception as exception:  # pylint: disable=broad-except
+            self._read_error = exception
+        finally:
+            close = getattr(listed, "close", None)
+            if close is not None:
+                close()
+            self._put(tiles, None, stopping)
+
+    def run(self, poll_interval: float = 0.1) -> Iterator[Tile]:
+        """
+        Process the tiles of the store until its :meth:`TileStore.list` ends and get the done tiles.
+
+        The tiles in error are acknowledged and got with their ``error``, the dropped ones are
+        acknowledged only.
+        """
+        capacity = self.processes * self.prefetch
+        self._workers = [self._start_worker() for _ in range(self.processes)]
+        self._read_error = None
+        tiles: queue.Queue[Tile | None] = queue.Queue(capacity)
+        stopping = threading.Event()
+        reader = threading.Thread(
+            target=self._read, args=(tiles, stopping), name="supervisor-read", daemon=True
+        )
+        reader.start()
+        keys = itertools.count()
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and len(self._tiles) < capacity:
+                    try:
+                        # Wait for the tiles only when no tile is processed
+                        tile = tiles.get(block=not self._tiles, timeout=poll_interval)
+                    except queue.Empty:
+                        break
+                    if tile is None:
+                        exhausted = True
+                        if self._read_error is not None:
+                            raise self._read_error
+                    else:
+                        key = next(keys)
+                        self._tiles[key] = tile
+                        self._dispatch(key)
+                if exhausted and not self._tiles:
+                    return
+                if self._tiles:
+                    try:
+                        result = self._results.get(timeout=poll_interval)
+                    except queue.Empty:
+                        pass
+                    else:
+                        done = self._collect(result)
+                        if done is not None:
+                            yield done
+                for tile in self._restart_crashed():
+                    self.store.delete_one(tile)
+                    yield tile
+        finally:
+            stopping.set()
+            reader.join(self.stop_timeout)
+            if reader.is_alive():
+                _LOGGER.info("The store read is still blocked, leave it behind")
+            flush = getattr(self.store, "flush", None)
+            if flush is not None:
+                flush()
+            self._stop()
+
+    def _stop(self) -> None:
+        for worker in self._workers:
+            worker.tasks.put(None)
+        for worker in self._workers:
+            worker.process.join(timeout=5)
+            if worker.process.is_alive():
+                worker.process.terminate()
+                worker.process.join()
+        self._workers = []
+        self._tiles = {}
+        self._retries = {}
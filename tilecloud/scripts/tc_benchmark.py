@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+import json
+import logging
+import os.path
+import sys
+from optparse import OptionParser
+
+from tilecloud.lib.benchmark import SCENARIOS, compare, regressions, run
+
+
+def main() -> None:
+    logger = logging.getLogger(os.path.basename(sys.argv[0]))
+    option_parser = OptionParser(usage="%prog [options] [scenario...]")
+    option_parser.add_option("-l", "--list", action="store_true", help="list the scenarios")
+    option_parser.add_option(
+        "-s", "--scale", default=1.0, type=float, help="factor applied to the number of items"
+    )
+    option_parser.add_option("-r", "--repeat", default=3, type=int, help="number of runs of each scenario")
+    option_parser.add_option("-o", "--output", metavar="FILE", help="write the results as JSON")
+    option_parser.add_option("-b", "--baseline", metavar="FILE", help="compare with the JSON results")
+    option_parser.add_option(
+        "-t", "--tolerance", default=0.1, type=float, help="allowed relative throughput regression"
+    )
+    option_parser.add_option("-v", "--verbose", action="store_true")
+    options, args = option_parser.parse_args()
+    logging.basicConfig(level=logging.INFO if options.verbose else logging.WARNING)
+
+    if options.list:
+        for name, scenario in SCENARIOS.items():
+            print(f"{name}: {scenario.description} ({scenario.size} items)")
+        return
+
+    for name in args:
+        if name not in SCENARIOS:
+            option_parser.error(f"unknown scenario: {name}")
+
+    results = run(args or None, scale=options.scale, repeat=options.repeat)
+    if options.output:
+        with open(options.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+
+    changes: dict[str, float] = {}
+    if options.baseline:
+        with open(options.baseline, encoding="utf-8") as file:
+            changes = compare(results, json.load(file))
+    for name, result in results.items():
+        change = f" ({changes[name]:+.1%})" if name in changes else ""
+        metrics = "".join(
+            f", {key}: {value}"
+            for key, value in result.items()
+            if key not in ("count", "durations", "items_per_second")
+        )
+        print(f"{name}: {result['count']} items, {result['items_per_second']:.0f} items/s{change}{metrics}")
+
+    regressed = regressions(changes, options.tolerance)
+    if regressed:
+        logger.error("Regressions: %s", ", ".join(regressed))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,10 +4,12 @@ import logging
 import os.path
 import random
 import sys
+from collections.abc import Iterable, Iterator
 from optparse import OptionParser
 
-from tilecloud import BoundingPyramid, TileStore, consume
-from tilecloud.filter.benchmark import Benchmark, StatsCountErrors, StatsCountTiles
+from tilecloud import BoundingPyramid, Tile, TileStore, consume
+from tilecloud.filter.benchmark import Benchmark, Profiler, StatsCountErrors, StatsCountTiles
+from tilecloud.filter.checkpoint import Checkpoint
 from tilecloud.filter.consistenthash import EveryNth
 from tilecloud.filter.contenttype import ContentTypeAdder
 from tilecloud.filter.error import (
@@ -18,16 +20,37 @@ from tilecloud.filter.error import (
     MaximumErrors,
 )
 from tilecloud.filter.logger import Logger
-from tilecloud.filter.rate import RateLimit
+from tilecloud.filter.rate import AdaptiveRateLimit, TokenBucketRateLimit
+from tilecloud.lib.existence import ExistenceIndex
 from tilecloud.store.boundingpyramid import BoundingPyramidTileStore
 
 
+def _skip_existing(
+    tilestream: Iterable[Tile | None],
+    existing: TileStore | ExistenceIndex,
+    checkpoint: Checkpoint | None,
+) -> Iterator[Tile | None]:
+    for tile in tilestream:
+        if tile in existing:
+            if checkpoint:
+                checkpoint(tile)
+        else:
+            yield tile
+
+
 def main() -> None:
     logger = logging.getLogger(os.path.basename(sys.argv[0]))
     option_parser = OptionParser()
     option_parser.add_option("--benchmark", action="store_true")
+    option_parser.add_option("--profile", action="store_true")
+    option_parser.add_option("--profile-interval", metavar="SECONDS", type=float)
+    option_parser.add_option("--profile-json", metavar="FILE")
     option_parser.add_option("-b", "--bounding-pyramid", metavar="BOUNDING-PYRAMID")
+    option_parser.add_option("--checkpoint", metavar="FILE")
+    option_parser.add_option("--checkpoint-interval", metavar="SECONDS", type=float, default=60.0)
+    option_parser.add_option("--resume", action="store_true")
     option_parser.add_option("--add-content-type", action="store_true")
+    option_parser.add_option("--existence-index", action="store_true")
     option_parser.add_option("-i", metavar="I", type=int)
     option_parser.add_option("-g", "--generate", metavar="TILE-STORE", action="append")
     option_parser.add_option("--limit", metavar="N", type=int)
@@ -38,6 +61,8 @@ def main() -> None:
     option_parser.add_option("-n", metavar="N", type=int)
     option_parser.add_option("-o", "--overwrite", action="store_true")
     option_parser.add_option("-r", "--rate-limit", metavar="HZ", type=float)
+    option_parser.add_option("--rate-limit-burst", metavar="N", type=float, default=1.0)
+    option_parser.add_option("--adaptive-rate-limit", action="store_true")
     option_parser.add_option("--randomize", action="store_true")
     option_parser.add_option("--stats", action="store_true")
     option_parser.add_option("-v", "--verbose", action="store_true")
@@ -47,15 +72,31 @@ def main() -> None:
     else:
         logging.basicConfig(level=logging.WARNING)
     assert len(args) >= 2
+    if options.resume and not options.checkpoint:
+        option_parser.error("--resume requires --checkpoint")
+    if options.checkpoint and options.randomize:
+        option_parser.error("--checkpoint is incompatible with --randomize")
+    if options.existence_index and not options.bounding_pyramid:
+        option_parser.error("--existence-index requires --bounding-pyramid")
     if options.bounding_pyramid:
         bounding_pyramid = BoundingPyramid.from_string(options.bounding_pyramid)
     else:
         bounding_pyramid = None
 
     benchmark = Benchmark() if options.benchmark else None
+    profiler = (
+        Profiler(options.profile_interval, logger, prometheus=options.stats, level=logging.WARNING)
+        if options.profile or options.profile_interval or options.profile_json
+        else None
+    )
     generate = map(TileStore.load, options.generate) if options.generate else ()
+    checkpoint = None
     try:
         output_tilestore = TileStore.load(args[-1])
+        existing: TileStore | ExistenceIndex = output_tilestore
+        if options.existence_index and not options.overwrite:
+            assert bounding_pyramid is not None
+            existing = ExistenceIndex.from_tilestore(output_tilestore, bounding_pyramid)
         for arg in args[:-1]:
             input_tilestore = TileStore.load(arg, allows_no_contenttype=options.add_content_type)
             if bounding_pyramid:
@@ -67,17 +108,38 @@ def main() -> None:
             if options.randomize:
                 tilestream = list(tilestream)
                 random.shuffle(tilestream)
+            if options.checkpoint:
+                checkpoint = Checkpoint(
+                    options.checkpoint,
+                    f"{arg} {args[-1]} {options.bounding_pyramid} {options.i}/{options.n}",
+                    options.checkpoint_interval,
+                    resume=options.resume,
+                )
+                tilestream = checkpoint.resume(tilestream)
             if not options.overwrite:
-                tilestream = (tile for tile in tilestream if tile not in output_tilestore)
+                tilestream = _skip_existing(tilestream, existing, checkpoint)
+            rate_limit = None
             if options.rate_limit:
-                tilestream = map(RateLimit(options.rate_limit), tilestream)
+                rate_limit = (
+                    AdaptiveRateLimit(options.rate_limit, options.rate_limit_burst)
+                    if options.adaptive_rate_limit
+                    else TokenBucketRateLimit(options.rate_limit, options.rate_limit_burst)
+                )
+                tilestream = map(rate_limit, tilestream)
             if benchmark:
                 tilestream = map(benchmark.sample(), tilestream)
-            tilestream = input_tilestore.get(tilestream)
+            if profiler:
+                tilestream = profiler.stage("get", tilestream, input_tilestore.get)
+            else:
+                tilestream = input_tilestore.get(tilestream)
+            if isinstance(rate_limit, AdaptiveRateLimit):
+                tilestream = map(rate_limit.feedback, tilestream)
             if benchmark:
                 tilestream = map(benchmark.sample("get"), tilestream)
             for i, g in enumerate(generate):
-                tilestream = g.get(tilestream)
+                tilestream = (
+                    profiler.stage(f"generate-{i}", tilestream, g.get) if profiler else g.get(tilestream)
+                )
                 if options.benchmark:
                     tilestream = map(benchmark.sample("generate-%d" % (i,)), tilestream)
             tilestream = map(LogErrors(logger, logging.ERROR, "%(tilecoord)s: %(error)s"), tilestream)
@@ -92,20 +154,37 @@ def main() -> None:
             tilestream = map(DropErrors(), tilestream)
             if options.add_content_type:
                 tilestream = map(ContentTypeAdder(), tilestream)
-            tilestream = output_tilestore.put(tilestream)
+            if profiler:
+                tilestream = profiler.stage("put", tilestream, output_tilestore.put)
+            else:
+                tilestream = output_tilestore.put(tilestream)
             if benchmark:
                 tilestream = map(benchmark.sample("put"), tilestream)
             if options.move:
-                tilestream = input_tilestore.delete(tilestream)
+                if profiler:
+                    tilestream = profiler.stage("delete", tilestream, input_tilestore.delete)
+                else:
+                    tilestream = input_tilestore.delete(tilestream)
                 if benchmark:
                     tilestream = map(benchmark.sample("delete"), tilestream)
+            if checkpoint:
+                tilestream = map(checkpoint, tilestream)
             if options.verbose:
                 tilestream = map(Logger(logger, logging.INFO, "%(tilecoord)s"), tilestream)
             if options.stats:
                 tilestream = map(StatsCountTiles(), tilestream)
             consume(tilestream, options.limit)
+            if checkpoint:
+                checkpoint.close()
     finally:
         logging.basicConfig(level=logging.INFO)
+        if checkpoint:
+            checkpoint.close()
+        if profiler:
+            profiler.stop()
+            profiler.report()
+            if options.profile_json:
+                profiler.dump(options.profile_json)
         if benchmark:
             keys = ["get"]
             keys.extend("generate-%i" % (i,) for i in range(len(generate)))
@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+
+import logging
+import sys
+from optparse import OptionParser
+
+from prometheus_client import start_http_server
+
+from tilecloud.store.redis import RedisTileStore
+
+
+def main() -> None:
+    logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s: %(message)s", level=logging.INFO)
+    option_parser = OptionParser(
+        usage="%prog [options]", description="Publish the metrics of a Redis tile queue"
+    )
+    option_parser.add_option("--url", metavar="URL", help="the Redis URL, required")
+    option_parser.add_option("--name", default="tilecloud", metavar="NAME", help="the queue name")
+    option_parser.add_option("--lanes", default=1, metavar="N", type=int, help="the number of priority lanes")
+    option_parser.add_option(
+        "--interval", default=15.0, metavar="SECONDS", type=float, help="the sampling interval"
+    )
+    option_parser.add_option("--port", default=9090, metavar="PORT", type=int, help="the Prometheus port")
+    options, args = option_parser.parse_args()
+    if args:
+        option_parser.error("no arguments expected")
+    if options.url is None:
+        option_parser.error("--url is required")
+    store = RedisTileStore(options.url, name=options.name, lane_weights=(1,) * options.lanes)
+    start_http_server(options.port)
+    store.monitor(options.interval)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+import logging
+from collections.abc import Iterator
+from typing import Any
+
+from tilecloud import Tile, TileStore
+from tilecloud.lib.bloom import BloomFilter, CountingBloomFilter
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class BloomFilterTileStore(TileStore):
+    """
+    A tile store that answers locally for the tiles that are definitely not in a sparse store.
+
+    The Bloom filter should know all the tiles of the store: build it with :meth:`populate` from
+    the listing of the store, or load it from a file, then write the tiles through this store.
+    The other calls are sent to the store only for the probably present tiles. Useful in front
+    of remote stores in :class:`tilecloud.store.searchup.SearchUpTileStore` or
+    :class:`tilecloud.store.findfirst.FindFirstTileStore`.
+
+    The tile metadata are not part of the key.
+
+        tilestore:
+        The wrapped tile store.
+
+        bloom_filter:
+        The Bloom filter, use a :class:`tilecloud.lib.bloom.CountingBloomFilter` to support
+        the deletion of tiles. Default is a new empty Bloom filter.
+
+        capacity:
+        The expected number of tiles of the new Bloom filter.
+
+        error_rate:
+        The false positive rate of the new Bloom filter.
+    """
+
+    def __init__(
+        self,
+        tilestore: TileStore,
+        bloom_filter: BloomFilter | None = None,
+        capacity: int = 1000000,
+        error_rate: float = 0.01,
+        **kwargs: Any,
+    ) -> None:
+        TileStore.__init__(self, **kwargs)
+        self.tilestore = tilestore
+        self.bloom_filter = BloomFilter(capacity, error_rate) if bloom_filter is None else bloom_filter
+        self.hits = 0
+        self.misses = 0
+
+    def populate(self) -> None:
+        """Add all the tiles listed by the store to the Bloom filter."""
+        for tile in self.tilestore.list():
+            self.bloom_filter.add(str(tile.tilecoord))
+        _LOGGER.info(
+            "Bloom filter populated: %r, error rate: %.4f", self.bloom_filter, self.bloom_filter.error_rate()
+        )
+
+    def _may_contain(self, tile: Tile) -> bool:
+        if str(tile.tilecoord) in self.bloom_filter:
+            return True
+        self.misses += 1
+        return False
+
+    def __contains__(self, tile: Tile) -> bool:
+        if not tile or not self._may_contain(tile):
+            return False
+        self.hits += 1
+        return tile in self.tilestore
+
+    def get_one(self, tile: Tile) -> Tile | None:
+        if not self._may_contain(tile):
+            return None
+        self.hits += 1
+        return self.tilestore.get_one(tile)
+
+    def list(self) -> Iterator[Tile]:
+        yield from self.tilestore.list()
+
+    def put_one(self, tile: Tile) -> Tile:
+        tile = self.tilestore.put_one(tile)
+        if tile and not tile.error:
+            self.bloom_filter.add(str(tile.tilecoord))
+        return tile
+
+    def delete_one(self, tile: Tile) -> Tile:
+        key = str(tile.tilecoord)
+        counting = self.bloom_filter if isinstance(self.bloom_filter, CountingBloomFilter) else None
+        # The deletion of a missing tile succeeds on most stores (e.g. S3), and removing a key
+        # never added would also remove the tiles sharing its counters.
+        present = counting is not None and key in counting and tile in self.tilestore
+        tile = self.tilestore.delete_one(tile)
+        if counting is not None and present and tile and not tile.error:
+            counting.remove(key)
+        return tile
@@ -15,13 +15,16 @@ class DebugTileStore(TileStore):
     def __init__(self, color: tuple[int, int, int] = (0, 0, 0), **kwargs: Any) -> None:
         TileStore.__init__(self, content_type="image/png", **kwargs)
         self.color = color
+        # The frame is the same for all the tiles, only the text changes
+        self._frame = PIL.Image.new("RGBA", (256, 256), (0, 0, 0, 0))
+        PIL.ImageDraw.Draw(self._frame).line([(0, 255), (0, 0), (255, 0)], fill=self.color)
+        self._font = PIL.ImageFont.load_default()
 
     def get_one(self, tile: Tile) -> Tile | None:
-        image = PIL.Image.new("RGBA", (256, 256), (0, 0, 0, 0))
+        image = self._frame.copy()
         draw = PIL.ImageDraw.Draw(image)
-        draw.line([(0, 255), (0, 0), (255, 0)], fill=self.color)
         text = str(tile.tilecoord)
-        font = PIL.ImageFont.load_default()
+        font = self._font
         bbox = font.getbbox(text)
         width = bbox[2] - bbox[0]
         height = bbox[3] - bbox[1]
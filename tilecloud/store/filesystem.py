@@ -58,9 +58,11 @@ class FilesystemTileStore(TileStore):
         for dirpath, _, filenames in os.walk(top):
             for filename in filenames:
                 path = os.path.join(dirpath, filename)
-                tilecoord = self.tilelayout.tilecoord(path)
-                if tilecoord:
-                    yield Tile(tilecoord, path=path)
+                try:
+                    tilecoord = self.tilelayout.tilecoord(path)
+                except ValueError:
+                    continue
+                yield Tile(tilecoord, path=path)
 
     def put_one(self, tile: Tile) -> Tile:
         assert isinstance(tile.data, bytes)
@@ -1,7 +1,12 @@
+import os
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
 from json import dumps
+from multiprocessing.context import BaseContext
 from typing import Any
 
-from tilecloud import NotSupportedOperation, Tile, TileGrid, TileStore
+from tilecloud import NotSupportedOperation, Tile, TileCoord, TileGrid, TileStore
+from tilecloud.lib.concurrent_ import imap
 
 try:
     import mapnik2 as mapnik
@@ -55,6 +60,7 @@ class MapnikTileStore(TileStore):
         self.drop_empty_utfgrid = drop_empty_utfgrid
 
         self.mapnik = mapnik.Map(tilegrid.tile_size, tilegrid.tile_size)
+        self._size = tilegrid.tile_size
         mapnik.load_map(self.mapnik, mapfile, True)  # noqa: FBT003
         self.mapnik.buffer_size = data_buffer
         if proj4_literal is not None:
@@ -65,7 +71,9 @@ class MapnikTileStore(TileStore):
         bbox2d = mapnik.Box2d(bbox[0], bbox[1], bbox[2], bbox[3])
 
         size = tile.tilecoord.n * self.tilegrid.tile_size + 2 * self.buffer
-        self.mapnik.resize(size, size)
+        if size != self._size:
+            self.mapnik.resize(size, size)
+            self._size = size
         self.mapnik.zoom_to_box(bbox2d)
 
         if self.output_format == "grid":
@@ -96,3 +104,111 @@ class MapnikTileStore(TileStore):
 
     def delete_one(self, tile: Tile) -> Tile:
         raise NotSupportedOperation
+
+
+_WORKER_TILESTORE: TileStore | None = None
+
+
+def _init_worker(tilestore_class: type[TileStore], args: tuple[Any, ...], kwargs: dict[str, Any]) -> None:
+    global _WORKER_TILESTORE  # noqa: PLW0603 # pylint: disable=global-statement
+    _WORKER_TILESTORE = tilestore_class(*args, **kwargs)
+
+
+def _render(item: tuple[int, TileCoord]) -> tuple[int, bytes | None, str | None]:
+    key, tilecoord = item
+    assert _WORKER_TILESTORE is not None
+    try:
+        tile = _WORKER_TILESTORE.get_one(Tile(tilecoord))
+    except Exception as exception:  # pylint: disable=broad-except
+        return key, None, f"{type(exception).__name__}: {exception}"
+    if tile is None:
+        return key, None, None
+    return key, tile.data, None
+
+
+class MapnikRenderingPoolTileStore(TileStore):
+    """
+    Tile store that renders tiles with a pool of Mapnik processes.
+
+    Each worker process loads the mapfile once and keeps its map, the (meta)tiles are dispatched
+    to the first idle worker, and the encoded data come back through the pool pipes. The pool is
+    started on the first rendering.
+
+        tilegrid: the tilegrid.
+        mapfile: the file used to render the tiles.
+        processes: the number of worker processes, default is the number of CPUs.
+        max_pending: the maximum number of tiles being rendered or waiting for a worker,
+        default is twice the number of processes.
+        ordered: yield the tiles in the input order, default is ``False``, the tiles
+        are yielded as soon as they are rendered, so a slow region doesn't block the others.
+        mp_context: the multiprocessing context of the pool.
+        **kwargs: the arguments of the :class:`MapnikTileStore` of the workers.
+    """
+
+    # The tile store created in each worker with the tilegrid, the mapfile and the kwargs
+    tilestore_class: type[TileStore] = MapnikTileStore
+
+    def __init__(
+        self,
+        tilegrid: TileGrid,
+        mapfile: str,
+        processes: int | None = None,
+        max_pending: int | None = None,
+        ordered: bool = False,
+        mp_context: BaseContext | None = None,
+        **kwargs: Any,
+    ) -> None:
+        TileStore.__init__(self)
+        self.tilegrid = tilegrid
+        self.mapfile = mapfile
+        self.processes = processes or os.cpu_count() or 1
+        self.max_pending = max_pending or 2 * self.processes
+        self.ordered = ordered
+        self.mp_context = mp_context
+        self.kwargs = kwargs
+        self.executor: ProcessPoolExecutor | None = None
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.processes,
+                mp_context=self.mp_context,
+                initializer=_init_worker,
+                initargs=(self.tilestore_class, (self.tilegrid, self.mapfile), self.kwargs),
+            )
+        return self.executor
+
+    def get(self, tiles: Iterable[Tile | None]) -> Iterator[Tile | None]:
+        in_progress: dict[int, Tile] = {}
+
+        def items() -> Iterator[tuple[int, TileCoord]]:
+            for key, tile in enumerate(filter(None, tiles)):
+                in_progress[key] = tile
+                yield key, tile.tilecoord
+
+        for key, data, error in imap(self._executor(), _render, items(), self.max_pending, self.ordered):
+            tile = in_progress.pop(key)
+            if error is not None:
+                tile.error = error
+            elif data is None:
+                # Like get_one
+                yield None
+                continue
+            else:
+                tile.data = data
+            yield tile
+
+    def get_one(self, tile: Tile) -> Tile | None:
+        return next(self.get([tile]), None)
+
+    def close(self) -> None:
+        """Stop the worker processes."""
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def put_one(self, tile: Tile) -> Tile:
+        raise NotSupportedOperation
+
+    def delete_one(self, tile: Tile) -> Tile:
+        raise NotSupportedOperation
@@ -1,15 +1,30 @@
-from collections.abc import Iterable, Iterator
+import queue
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 from typing import Any
 
 from PIL import Image
 
-from tilecloud import NotSupportedOperation, Tile, TileStore
-from tilecloud.lib.PIL_ import FORMAT_BY_CONTENT_TYPE
+from tilecloud import NotSupportedOperation, Tile, TileCoord, TileStore
+from tilecloud.lib.PIL_ import FORMAT_BY_CONTENT_TYPE, encode
 
 
 class MetaTileSplitterTileStore(TileStore):
-    """A tile store that splits metatiles into tiles."""
+    """
+    A tile store that splits metatiles into tiles.
+
+    The metatile is decoded once, the uniform (empty or solid color) tiles are taken
+    from a cache of encoded tiles, and the other tiles can be encoded in parallel,
+    Pillow releases the GIL while encoding.
+
+        max_workers:
+        The number of threads used to encode the tiles of a metatile, default is 1, see
+        :meth:`close`.
+    """
 
     def __init__(
         self,
@@ -17,54 +32,59 @@ class MetaTileSplitterTileStore(TileStore):
         tile_size: int = 256,
         border: int = 0,
         save_options: dict[str, Any] | None = None,
+        max_workers: int = 1,
         **kwargs: Any,
     ) -> None:
         self.format = format_pattern
         self.tile_size = tile_size
         self.border = border
         self._save_options = save_options or {}
+        self._executor = ThreadPoolExecutor(max_workers) if max_workers > 1 else None
         TileStore.__init__(self, **kwargs)
 
+    def _encode(self, image: Image.Image) -> bytes:
+        return encode(image, FORMAT_BY_CONTENT_TYPE[self.format], **self._save_options)
+
     def get(self, tiles: Iterable[Tile | None]) -> Iterator[Tile]:
         for metatile in tiles:
             if not metatile:
                 continue
-            if isinstance(metatile.data, bytes):
-                metaimage = Image.open(BytesIO(metatile.data))
+            error = metatile.error
+            if not error and not isinstance(metatile.data, bytes):
+                error = (
+                    "The metatile has no data"
+                    if metatile.data is None
+                    else f"Unsupported metatile data type: {type(metatile.data).__name__}"
+                )
+            if error:
                 for tilecoord in metatile.tilecoord:
-                    if metatile.error:
-                        yield Tile(
-                            tilecoord,
-                            metadata=metatile.metadata,
-                            error=metatile.error,
-                            metatile=metatile,
-                        )
-                        continue
-                    if metatile.data is None:
-                        yield Tile(
-                            tilecoord,
-                            metadata=metatile.metadata,
-                            error="Metatile data is None",
-                            metatile=metatile,
-                        )
-                        continue
-
-                    x = (  # pylint: disable=invalid-name
-                        self.border + (tilecoord.x - metatile.tilecoord.x) * self.tile_size
-                    )
-                    y = (  # pylint: disable=invalid-name
-                        self.border + (tilecoord.y - metatile.tilecoord.y) * self.tile_size
-                    )
-                    image = metaimage.crop((x, y, x + self.tile_size, y + self.tile_size))
-                    bytes_io = BytesIO()
-                    image.save(bytes_io, FORMAT_BY_CONTENT_TYPE[self.format], **self._save_options)
-                    yield Tile(
-                        tilecoord,
-                        data=bytes_io.getvalue(),
-                        content_type=self.format,
-                        metadata=metatile.metadata,
-                        metatile=metatile,
-                    )
+                    yield Tile(tilecoord, metadata=metatile.metadata, error=error, metatile=metatile)
+                continue
+
+            metaimage = Image.open(BytesIO(metatile.data))
+            metaimage.load()
+            tilecoords = list(metatile.tilecoord)
+            images = []
+            for tilecoord in tilecoords:
+                x = (  # pylint: disable=invalid-name
+                    self.border + (tilecoord.x - metatile.tilecoord.x) * self.tile_size
+                )
+                y = (  # pylint: disable=invalid-name
+                    self.border + (tilecoord.y - metatile.tilecoord.y) * self.tile_size
+                )
+                images.append(metaimage.crop((x, y, x + self.tile_size, y + self.tile_size)))
+            if self._executor is None:
+                datas: Iterable[bytes] = map(self._encode, images)
+            else:
+                datas = self._executor.map(self._encode, images)
+            for tilecoord, data in zip(tilecoords, datas, strict=True):
+                yield Tile(
+                    tilecoord,
+                    data=data,
+                    content_type=self.format,
+                    metadata=metatile.metadata,
+                    metatile=metatile,
+                )
 
     def get_one(self, tile: Tile) -> Tile:
         raise NotSupportedOperation
@@ -74,3 +94,172 @@ class MetaTileSplitterTileStore(TileStore):
 
     def delete_one(self, tile: Tile) -> Tile:
         raise NotSupportedOperation
+
+    def close(self) -> None:
+        """Stop the threads that encode the tiles."""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
+_END = object()
+
+
+class MetaTileAssemblerTileStore(TileStore):
+    """
+    A tile store that groups the tiles into metatiles to get them from an upstream tile store.
+
+    The incoming tiles are buffered by metatile, one metatile is requested to the upstream tile
+    store (e.g. an :class:`tilecloud.store.url.URLTileStore` with a
+    :class:`tilecloud.layout.wms.WMSTileLayout`), split, and the requested tiles are yielded with
+    their original metadata.
+
+        tilestore:
+        The upstream tile store that gets the metatiles.
+
+        splitter:
+        The :class:`MetaTileSplitterTileStore` used to split the metatiles.
+
+        n:
+        The size of the metatiles.
+
+        flush_timeout:
+        The maximum number of seconds a tile waits for the other tiles of its metatile,
+        so sparse tile streams still progress. Default is 1 second.
+
+        max_buffered:
+        The maximum number of incomplete metatiles, the oldest one is fetched when reached.
+
+        read_thread:
+        Read the incoming tiles in a thread, so the flush timeout also applies while the incoming
+        tile stream waits, e.g. on an empty queue. The incoming tile stream shouldn't then be bound
+        to the calling thread, e.g. an MBTiles or SQLite store. By default the tiles are read in
+        the calling thread, and the flush timeout is checked when a tile comes.
+    """
+
+    def __init__(
+        self,
+        tilestore: TileStore,
+        splitter: MetaTileSplitterTileStore,
+        n: int = 8,  # pylint: disable=invalid-name
+        flush_timeout: float = 1.0,
+        max_buffered: int = 100,
+        read_thread: bool = False,
+        **kwargs: Any,
+    ) -> None:
+        TileStore.__init__(self, **kwargs)
+        self.tilestore = tilestore
+        self.splitter = splitter
+        self.n = n  # pylint: disable=invalid-name
+        self.flush_timeout = flush_timeout
+        self.max_buffered = max_buffered
+        self.read_thread = read_thread
+
+    def get(self, tiles: Iterable[Tile | None]) -> Iterator[Tile]:
+        if not self.read_thread:
+            iterator = iter(tiles)
+            yield from self._assemble(lambda _timeout: next(iterator, _END))
+            return
+
+        tiles_queue: queue.Queue[Any] = queue.Queue(self.n * self.n * self.max_buffered)
+        errors: list[BaseException] = []
+        stopping = threading.Event()
+
+        def put(item: Any) -> bool:
+            while not stopping.is_set():
+                try:
+                    tiles_queue.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def read() -> None:
+            iterator = iter(tiles)
+            try:
+                for tile in iterator:
+                    if tile is not None and not put(tile):
+                        return
+            except BaseException as exception:  # pylint: disable=broad-except
+                errors.append(exception)
+            finally:
+                close = getattr(iterator, "close", None)
+                if close is not None:
+                    close()
+                put(_END)
+
+        threading.Thread(target=read, daemon=True).start()
+
+        def get_tile(timeout: float | None) -> Any:
+            try:
+                return tiles_queue.get(timeout=timeout)
+            except queue.Empty:
+                return None
+
+        try:
+            yield from self._assemble(get_tile)
+        finally:
+            # Stop the read thread when the iteration stops early
+            stopping.set()
+        if errors:
+            raise errors[0]
+
+    def _assemble(self, get_tile: Callable[[float | None], Any]) -> Iterator[Tile]:
+        """Assemble the tiles got by ``get_tile(timeout)``, ``None`` on timeout, ``_END`` at the end."""
+        # Metatile key => (deadline, tiles)
+        groups: OrderedDict[tuple[TileCoord, tuple[tuple[str, str], ...]], tuple[float, list[Tile]]] = (
+            OrderedDict()
+        )
+        while True:
+            timeout = None
+            if groups:
+                timeout = max(0.0, next(iter(groups.values()))[0] - time.monotonic())
+            tile = get_tile(timeout)
+            if tile is _END:
+                break
+            if tile is not None:
+                key = (tile.tilecoord.metatilecoord(self.n), tuple(sorted(tile.metadata.items())))
+                if key not in groups:
+                    groups[key] = (time.monotonic() + self.flush_timeout, [])
+                group = groups[key][1]
+                group.append(tile)
+                if len(group) >= self.n * self.n:
+                    del groups[key]
+                    yield from self._get_metatile(key[0], group)
+            now = time.monotonic()
+            while groups and (len(groups) > self.max_buffered or next(iter(groups.values()))[0] <= now):
+                key, (_, group) = groups.popitem(last=False)
+                yield from self._get_metatile(key[0], group)
+
+        while groups:
+            key, (_, group) = groups.popitem(last=False)
+            yield from self._get_metatile(key[0], group)
+
+    def _get_metatile(self, metatilecoord: TileCoord, tiles: list[Tile]) -> Iterator[Tile]:
+        metatile = self.tilestore.get_one(Tile(metatilecoord, metadata=dict(tiles[0].metadata)))
+        if metatile is None:
+            return
+        if metatile.error:
+            for tile in tiles:
+                tile.error = metatile.error
+                yield tile
+            return
+        tiles_by_tilecoord: dict[TileCoord, list[Tile]] = {}
+        for tile in tiles:
+            tiles_by_tilecoord.setdefault(tile.tilecoord, []).append(tile)
+        for split_tile in self.splitter.get([metatile]):
+            for tile in tiles_by_tilecoord.get(split_tile.tilecoord, []):
+                tile.data = split_tile.data
+                tile.content_type = split_tile.content_type
+                if split_tile.error:
+                    tile.error = split_tile.error
+                yield tile
+
+    def get_one(self, tile: Tile) -> Tile | None:
+        return next(self.get([tile]), None)
+
+    def put_one(self, tile: Tile) -> Tile:
+        raise NotSupportedOperation
+
+    def delete_one(self, tile: Tile) -> Tile:
+        raise NotSupportedOperation
@@ -1,31 +1,426 @@
 import base64
+import bisect
+import itertools
 import json
-from typing import Any
+import struct
+import threading
+import weakref
+from collections.abc import Callable, Iterable, Iterator, Sequence
+from typing import Any, cast
 
-from tilecloud import Tile, TileCoord
+from tilecloud import BoundingPyramid, Tile, TileCoord
+from tilecloud.lib.sharederror import SharedErrorTile
 
+# The binary messages start with a version byte that can't be the first byte of a base64 or JSON message
+_BINARY_VERSION = 1
+# version, flags, z, x, y, n
+_BINARY_HEADER = struct.Struct("<BBBIIH")
+# nx, ny
+_BINARY_JOB = struct.Struct("<HH")
+_FLAG_METADATA = 1
+_FLAG_JOB = 2
+# The metadata key of the number of times the failed tiles of a job have been sent back to the queue
+_ATTEMPT = "tilecloud_attempt"
 
-def encode_message(tile: Tile) -> str:
-    """Encode a tile to a string message."""
+
+def _tile_metadata(tile: Tile) -> dict[str, Any]:
     metadata = dict(tile.metadata)
     metadata.pop("sqs_message", None)
+    return metadata
+
+
+def encode_message(tile: Tile) -> str:
+    """Encode a tile to a string message."""
     message = {
         "z": tile.tilecoord.z,
         "x": tile.tilecoord.x,
         "y": tile.tilecoord.y,
         "n": tile.tilecoord.n,
-        "metadata": metadata,
+        "metadata": _tile_metadata(tile),
     }
 
     return base64.b64encode(json.dumps(message).encode("utf-8")).decode("utf-8")
 
 
-def decode_message(text: str, **kwargs: Any) -> Tile:
-    """Decode a tile from a string message."""
-    body = json.loads(base64.b64decode(text).decode("utf-8"))
+def _check_range(name: str, value: int, maximum: int) -> None:
+    if not 0 <= value <= maximum:
+        raise ValueError(f"The {name} of a binary message should be between 0 and {maximum}, got {value}")
+
+
+def _encode_binary(
+    z: int,  # pylint: disable=invalid-name
+    x: int,  # pylint: disable=invalid-name
+    y: int,  # pylint: disable=invalid-name
+    n: int,  # pylint: disable=invalid-name
+    metadata: dict[str, Any],
+    job: tuple[int, int] | None = None,
+) -> bytes:
+    _check_range("z", z, 0xFF)
+    _check_range("x", x, 0xFFFFFFFF)
+    _check_range("y", y, 0xFFFFFFFF)
+    _check_range("n", n, 0xFFFF)
+    if job is not None:
+        _check_range("nx", job[0], 0xFFFF)
+        _check_range("ny", job[1], 0xFFFF)
+    flags = (_FLAG_METADATA if metadata else 0) | (_FLAG_JOB if job is not None else 0)
+    parts = [_BINARY_HEADER.pack(_BINARY_VERSION, flags, z, x, y, n)]
+    if job is not None:
+        parts.append(_BINARY_JOB.pack(*job))
+    if metadata:
+        parts.append(json.dumps(metadata, separators=(",", ":")).encode("utf-8"))
+    return b"".join(parts)
+
+
+def encode_binary_message(tile: Tile) -> bytes:
+    """
+    Encode a tile to a compact binary message, for the transports that support binary data.
+
+    The message is a packed header with a version byte and the tile coordinates, followed by the
+    metadata as JSON if any.
+    """
+    tilecoord = tile.tilecoord
+    return _encode_binary(tilecoord.z, tilecoord.x, tilecoord.y, tilecoord.n, _tile_metadata(tile))
+
+
+def _decode_binary(data: bytes) -> dict[str, Any]:
+    version, flags, z, x, y, n = _BINARY_HEADER.unpack_from(data)  # pylint: disable=invalid-name
+    if version != _BINARY_VERSION:
+        raise ValueError(f"Unsupported message version: {version}")
+    body: dict[str, Any] = {"z": z, "x": x, "y": y, "n": n}
+    offset = _BINARY_HEADER.size
+    if flags & _FLAG_JOB:
+        body["nx"], body["ny"] = _BINARY_JOB.unpack_from(data, offset)
+        offset += _BINARY_JOB.size
+    body["metadata"] = json.loads(data[offset:]) if flags & _FLAG_METADATA else {}
+    return body
+
+
+def _decode_body(text: str | bytes) -> dict[str, Any]:
+    if isinstance(text, bytes) and text[:1] == bytes((_BINARY_VERSION,)):
+        return _decode_binary(text)
+    if text[:1] in ("{", b"{"):
+        return cast("dict[str, Any]", json.loads(text))
+    data = base64.b64decode(text)
+    if data[:1] == bytes((_BINARY_VERSION,)):
+        return _decode_binary(data)
+    return cast("dict[str, Any]", json.loads(data.decode("utf-8")))
+
+
+def decode_message(text: str | bytes, **kwargs: Any) -> Tile:
+    """Decode a tile from a message: binary, base64 encoded binary or JSON, or plain JSON."""
+    return _tile_from_body(_decode_body(text), **kwargs)
+
+
+def _tile_from_body(body: dict[str, Any], **kwargs: Any) -> Tile:
     z = body.get("z")  # pylint: disable=invalid-name
     x = body.get("x")  # pylint: disable=invalid-name
     y = body.get("y")  # pylint: disable=invalid-name
     n = body.get("n")  # pylint: disable=invalid-name
     metadata = body.get("metadata", {})
     return Tile(TileCoord(z, x, y, n), metadata=metadata, **kwargs)
+
+
+class Job:
+    """
+    A rectangular block of (meta)tiles sent as a single queue message.
+
+        n:
+        The size of the metatiles, 1 for tiles.
+
+        nx, ny:
+        The number of (meta)tiles in the x and y directions.
+
+        priority:
+        The priority lane of the job, see :func:`get_priority`.
+
+        attempt:
+        The number of times the job has been sent back to the queue with the failed tiles of a
+        previous job, carried in the message metadata.
+    """
+
+    def __init__(
+        self,
+        z: int,
+        x: int,
+        y: int,
+        n: int = 1,
+        nx: int = 1,
+        ny: int = 1,
+        metadata: dict[str, Any] | None = None,
+        priority: int = 0,
+        attempt: int = 0,
+    ) -> None:  # pylint: disable=invalid-name
+        self.z = z  # pylint: disable=invalid-name
+        self.x = x  # pylint: disable=invalid-name
+        self.y = y  # pylint: disable=invalid-name
+        self.n = n  # pylint: disable=invalid-name
+        self.nx = nx  # pylint: disable=invalid-name
+        self.ny = ny  # pylint: disable=invalid-name
+        self.metadata = metadata or {}
+        self.priority = priority
+        self.attempt = attempt
+
+    def __len__(self) -> int:
+        return self.nx * self.ny
+
+    def __repr__(self) -> str:
+        return f"Job({self.z}/{self.x}/{self.y}, n={self.n}, nx={self.nx}, ny={self.ny})"
+
+    def tilecoords(self) -> Iterator[TileCoord]:
+        """Generate the (meta)tile coordinates, by column like :meth:`BoundingPyramid.metatilecoords`."""
+        for i in range(self.nx):
+            for j in range(self.ny):
+                yield TileCoord(self.z, self.x + i * self.n, self.y + j * self.n, self.n)
+
+    def split(self, tilecoords: Iterable[TileCoord]) -> list["Job"]:
+        """Get the jobs of ``tilecoords``, a subset of the job, by vertical runs."""
+        columns: dict[int, list[int]] = {}
+        for tilecoord in tilecoords:
+            columns.setdefault(tilecoord.x, []).append(tilecoord.y)
+        jobs = []
+        for x, ys in sorted(columns.items()):  # pylint: disable=invalid-name
+            ys.sort()
+            start = previous = ys[0]
+            for y in [*ys[1:], None]:  # pylint: disable=invalid-name
+                if y != previous + self.n:
+                    jobs.append(
+                        Job(
+                            self.z,
+                            x,
+                            start,
+                            self.n,
+                            1,
+                            (previous - start) // self.n + 1,
+                            self.metadata,
+                            self.priority,
+                            self.attempt,
+                        )
+                    )
+                    if y is not None:
+                        start = y
+                if y is not None:
+                    previous = y
+        return jobs
+
+    def retry(self, failed: Iterable[TileCoord]) -> list["Job"]:
+        """Get the jobs of the ``failed`` tiles to send back to the queue, with the next attempt."""
+        jobs = self.split(failed)
+        for job in jobs:
+            job.attempt = self.attempt + 1
+        return jobs
+
+    def message_metadata(self) -> dict[str, Any]:
+        """Get the metadata to encode in the message, with the attempt."""
+        return {**self.metadata, _ATTEMPT: self.attempt} if self.attempt else self.metadata
+
+    @classmethod
+    def from_bounding_pyramid(
+        cls,
+        bounding_pyramid: BoundingPyramid,
+        n: int = 1,  # pylint: disable=invalid-name
+        size: int = 8,
+        metadata: dict[str, Any] | None = None,
+    ) -> Iterator["Job"]:
+        """Split the (meta)tiles of a bounding pyramid in jobs of at most ``size`` x ``size`` (meta)tiles."""
+        for z in sorted(bounding_pyramid.bounds.keys()):  # pylint: disable=invalid-name
+            xbounds, ybounds = bounding_pyramid.bounds[z]
+            if xbounds.start is None or ybounds.start is None:
+                continue
+            assert xbounds.stop is not None
+            assert ybounds.stop is not None
+            start = TileCoord(z, xbounds.start, ybounds.start).metatilecoord(n)
+            nb_columns = -(-(xbounds.stop - start.x) // n)
+            nb_rows = -(-(ybounds.stop - start.y) // n)
+            for i in range(0, nb_columns, size):
+                for j in range(0, nb_rows, size):
+                    yield cls(
+                        z,
+                        start.x + i * n,
+                        start.y + j * n,
+                        n,
+                        min(size, nb_columns - i),
+                        min(size, nb_rows - j),
+                        metadata,
+                    )
+
+
+def encode_binary_job_message(job: Job) -> bytes:
+    """Encode a job to a compact binary message, see :func:`encode_binary_message`."""
+    return _encode_binary(job.z, job.x, job.y, job.n, job.message_metadata(), (job.nx, job.ny))
+
+
+def encode_job_message(job: Job) -> str:
+    """Encode a job to a string message."""
+    message = {
+        "z": job.z,
+        "x": job.x,
+        "y": job.y,
+        "n": job.n,
+        "nx": job.nx,
+        "ny": job.ny,
+        "metadata": job.message_metadata(),
+    }
+    return base64.b64encode(json.dumps(message).encode("utf-8")).decode("utf-8")
+
+
+class _JobState:
+    def __init__(self, job: Job, delivery: dict[str, Any]) -> None:
+        self.job = job
+        self.delivery = delivery
+        self.remaining = len(job)
+        self.failed: list[TileCoord] = []
+
+
+class JobTracker:
+    """
+    Expand the job messages into tiles, and track the tiles until the whole job is done.
+
+    The queue tile stores acknowledge a job message only when all its tiles are done. A tile is
+    done when it is deleted from the queue, or when it is dropped from the pipeline without being
+    deleted, e.g. not found by ``get`` or removed by ``DropErrors``. In both cases it is failed if
+    it has an error, and the failed tiles are sent back to the queue as new jobs.
+
+    Each delivery of a message is tracked on its own, so a message delivered again while its tiles
+    are in progress doesn't mix the two deliveries.
+    """
+
+    def __init__(self) -> None:
+        self._jobs: dict[int, _JobState] = {}
+        self._completed: list[tuple[Job, list[TileCoord], dict[str, Any]]] = []
+        self._keys = itertools.count()
+        # Reentrant, the tiles can be dropped by the garbage collector while the lock is held
+        self._lock = threading.RLock()
+
+    def decode(self, text: str | bytes, message_id: Any, **kwargs: Any) -> Iterator[Tile]:
+        """
+        Decode a tile or job message, the tiles of a job get a ``job`` attribute.
+
+        The ``kwargs`` are set on the tiles and given back with the completed job by
+        :meth:`completed`, to acknowledge the message.
+        """
+        del message_id  # The deliveries are tracked, not the messages
+        body = _decode_body(text)
+        if "nx" not in body:
+            yield _tile_from_body(body, **kwargs)
+            return
+        metadata = dict(body.get("metadata") or {})
+        job = Job(
+            body["z"],
+            body["x"],
+            body["y"],
+            body["n"],
+            body["nx"],
+            body["ny"],
+            metadata,
+            kwargs.get("priority", 0),
+            metadata.pop(_ATTEMPT, 0),
+        )
+        key = next(self._keys)
+        with self._lock:
+            self._jobs[key] = _JobState(job, kwargs)
+        generated = 0
+        try:
+            for tilecoord in job.tilecoords():
+                # The error of the tile, read by the finalizer
+                errors: list[Any] = [None]
+                tile = SharedErrorTile(tilecoord, errors, metadata=dict(job.metadata), job=key, **kwargs)
+                tile.job_finalizer = weakref.finalize(tile, self._dropped, key, tilecoord, errors)
+                generated += 1
+                yield tile
+        finally:
+            if generated < len(job):
+                # Not all the tiles are processed, the message will be delivered again
+                with self._lock:
+                    self._jobs.pop(key, None)
+
+    def done(self, tile: Tile) -> None:
+        """Mark a tile of a job as done, failed if it has an error."""
+        tile.job_finalizer.detach()
+        self._done(tile.job, tile.tilecoord if tile.error else None)
+
+    def _dropped(self, key: int, tilecoord: TileCoord, errors: list[Any]) -> None:
+        self._done(key, tilecoord if errors[0] else None)
+
+    def _done(self, key: int, failed: TileCoord | None = None) -> None:
+        with self._lock:
+            state = self._jobs.get(key)
+            if state is None:
+                return
+            state.remaining -= 1
+            if failed is not None:
+                state.failed.append(failed)
+            if state.remaining == 0:
+                del self._jobs[key]
+                self._completed.append((state.job, state.failed, state.delivery))
+
+    def completed(self) -> list[tuple[Job, list[TileCoord], dict[str, Any]]]:
+        """Get and forget the completed jobs, with their failed tiles and the ``kwargs`` of their message."""
+        with self._lock:
+            completed, self._completed = self._completed, []
+        return completed
+
+    def __len__(self) -> int:
+        """Get the number of jobs in progress."""
+        return len(self._jobs)
+
+
+def get_priority(item: Tile | Job) -> int:
+    """
+    Get the priority lane of a tile or a job, from its ``priority`` attribute.
+
+    The lane 0, the default, is the highest priority.
+    """
+    return int(getattr(item, "priority", 0))
+
+
+def zoom_priority(max_zooms: Sequence[int]) -> Callable[[Tile | Job], int]:
+    """
+    Get a priority function that puts the low zoom levels in the high priority lanes.
+
+    The (meta)tiles up to the zoom level ``max_zooms[0]`` go in the lane 0, the next ones up to
+    ``max_zooms[1]`` in the lane 1, and so on, the other ones in the lane ``len(max_zooms)``.
+    """
+    max_zooms = sorted(max_zooms)
+
+    def priority(item: Tile | Job) -> int:
+        z = item.tilecoord.z if isinstance(item, Tile) else item.z  # pylint: disable=invalid-name
+        return bisect.bisect_left(max_zooms, z)
+
+    return priority
+
+
+class LaneScheduler:
+    """
+    Choose the priority lane of the next read, with a smooth weighted round robin.
+
+    When all the lanes have messages the lane ``i`` gets a ``weights[i] / sum(weights)`` share of
+    the reads, so the low priority lanes are slowed down but not starved. An empty lane doesn't
+    accumulate credit while it is idle.
+    """
+
+    def __init__(self, weights: Sequence[float]) -> None:
+        assert weights
+        assert all(weight > 0 for weight in weights)
+        self.weights = list(weights)
+        self._current = [0.0] * len(self.weights)
+
+    def __len__(self) -> int:
+        return len(self.weights)
+
+    def order(self) -> list[int]:
+        """Get the lanes in the order to try them for the next read."""
+        return sorted(
+            range(len(self.weights)), key=lambda lane: (-(self._current[lane] + self.weights[lane]), lane)
+        )
+
+    def served(self, lane: int, empty: Iterable[int] = ()) -> None:
+        """Record that the read was served by ``lane``, after trying the ``empty`` lanes."""
+        empty = set(empty)
+        total = 0.0
+        for index, weight in enumerate(self.weights):
+            if index in empty:
+                self._current[index] = 0.0
+            else:
+                self._current[index] += weight
+                total += weight
+        self._current[lane] -= total
@@ -1,16 +1,30 @@
+import contextlib
+import json
 import logging
 import os
 import socket
 import sys
+import threading
 import time
-from collections.abc import Iterable, Iterator
+import weakref
+from collections.abc import Callable, Iterable, Iterator, Sequence
 from typing import TYPE_CHECKING, Any
 
 import redis.sentinel
 from prometheus_client import Counter, Gauge
 
-from tilecloud import Tile, TileStore
-from tilecloud.store.queue import decode_message, encode_message
+from tilecloud import BoundingPyramid, Tile, TileCoord, TileStore
+from tilecloud.store.queue import (
+    Job,
+    JobTracker,
+    LaneScheduler,
+    decode_message,
+    encode_binary_job_message,
+    encode_binary_message,
+    encode_job_message,
+    encode_message,
+    get_priority,
+)
 
 if TYPE_CHECKING:
     Redis = redis.Redis[str]
@@ -28,10 +42,199 @@ _DECODE_ERROR_COUNTER = Counter("tilecloud_redis_decode_error", "Number of decod
 _READ_ERROR_COUNTER = Counter("tilecloud_redis_read_error", "Number of read errors on Redis", ["name"])
 _DROPPED_COUNTER = Counter("tilecloud_redis_dropped", "Number of dropped messages on Redis", ["name"])
 _STOLEN_COUNTER = Counter("tilecloud_redis_stolen", "Number of stolen messages on Redis", ["name"])
+_CONSUMED_COUNTER = Counter("tilecloud_redis_consumed", "Number of messages read from Redis", ["name"])
+_ACKNOWLEDGED_COUNTER = Counter(
+    "tilecloud_redis_acknowledged", "Number of messages acknowledged on Redis", ["name"]
+)
+_LAG_GAUGE = Gauge("tilecloud_redis_lag", "Number of messages not yet read from Redis", ["name"])
+_ADDED_GAUGE = Gauge("tilecloud_redis_added", "Number of messages ever added to Redis", ["name"])
+_CONSUMERS_GAUGE = Gauge("tilecloud_redis_consumers", "Number of consumers on Redis", ["name"])
+_CONSUMER_PENDING_GAUGE = Gauge(
+    "tilecloud_redis_consumer_pending",
+    "Number of pending messages of a consumer on Redis",
+    ["name", "consumer"],
+)
+_CONSUMER_IDLE_GAUGE = Gauge(
+    "tilecloud_redis_consumer_idle",
+    "Number of seconds since the last read of a consumer on Redis",
+    ["name", "consumer"],
+)
+_ERRORS_GAUGE = Gauge("tilecloud_redis_errors", "Number of recent errors on Redis", ["name"])
+_LOST_LEASE_COUNTER = Counter(
+    "tilecloud_redis_lost_lease", "Number of messages in progress claimed by another consumer", ["name"]
+)
+_DEDUPLICATED_COUNTER = Counter(
+    "tilecloud_redis_deduplicated", "Number of messages not added because already pending on Redis", ["name"]
+)
+
+# KEYS[1]: the pending set, KEYS[2]: the stream, ARGV: the message, the time to live in milliseconds
+# Add the message only if it isn't already pending, the pending set is scored by expiration time
+_ADD_UNIQUE_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if redis.call('ZADD', KEYS[1], 'NX', now + tonumber(ARGV[2]), ARGV[1]) == 0 then
+    return 0
+end
+redis.call('XADD', KEYS[2], '*', 'message', ARGV[1])
+return 1
+"""
+
+# KEYS[1]: the lock, ARGV: the owner, the time to live in milliseconds
+# Take or keep the lock, returns 1 if the owner has the lock
+_ELECT_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    return 1
+end
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+    return 1
+end
+return 0
+"""
+
+# KEYS[1]: the stream, ARGV: the group, the consumer, the message ids
+# Reset the idle time of the messages still pending for the consumer, and get the other ones
+_RENEW_SCRIPT = """
+local lost = {}
+for i = 3, #ARGV do
+    if #redis.call('XPENDING', KEYS[1], ARGV[1], ARGV[i], ARGV[i], 1, ARGV[2]) == 0 then
+        table.insert(lost, ARGV[i])
+    else
+        redis.call('XCLAIM', KEYS[1], ARGV[1], ARGV[2], 0, ARGV[i], 'JUSTID')
+    end
+end
+return lost
+"""
+
+# KEYS[1]: the stream, ARGV: z, n, x start, x stop, y start, y stop, metadata as JSON, "1" for the
+# binary messages
+# Add the messages of the (meta)tiles in the range, in the x then y order, encoded like
+# encode_binary_message or encode_message, so they are read by the older consumers
+_ADD_RANGE_SCRIPT = """
+local alphabet = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/'
+local function char(value)
+    return alphabet:sub(value + 1, value + 1)
+end
+local function base64(data)
+    local parts = {}
+    for i = 1, #data, 3 do
+        local a, b, c = data:byte(i, i + 2)
+        local value = a * 65536 + (b or 0) * 256 + (c or 0)
+        parts[#parts + 1] = char(math.floor(value / 262144)) .. char(math.floor(value / 4096) % 64)
+            .. (b and char(math.floor(value / 64) % 64) or '=') .. (c and char(value % 64) or '=')
+    end
+    return table.concat(parts)
+end
+local function uint(value, size)
+    local bytes = ''
+    for _ = 1, size do
+        bytes = bytes .. string.char(value % 256)
+        value = math.floor(value / 256)
+    end
+    return bytes
+end
+
+local z, n = tonumber(ARGV[1]), tonumber(ARGV[2])
+local metadata, binary = ARGV[7], ARGV[8] == '1'
+local binary_metadata = ''
+if binary and metadata ~= '{}' then
+    binary_metadata = metadata
+end
+local count = 0
+for x = tonumber(ARGV[3]), tonumber(ARGV[4]) - 1, n do
+    for y = tonumber(ARGV[5]), tonumber(ARGV[6]) - 1, n do
+        local message
+        if binary then
+            message = string.char(1, #binary_metadata > 0 and 1 or 0, z) .. uint(x, 4) .. uint(y, 4)
+                .. uint(n, 2) .. binary_metadata
+        else
+            message = base64(string.format(
+                '{"z": %d, "x": %d, "y": %d, "n": %d, "metadata": %s}', z, x, y, n, metadata
+            ))
+        end
+        redis.call('XADD', KEYS[1], '*', 'message', message)
+        count = count + 1
+    end
+end
+return count
+"""
 
 
 class RedisTileStore(TileStore):
-    """Redis queue."""
+    """
+    Redis queue.
+
+        binary_messages:
+        Use the compact binary messages, otherwise the base64 encoded JSON messages that can be
+        read by the older versions. Both are read. Opt-in for the rolling upgrades: enable it on
+        the producers once all the consumers are upgraded.
+
+        put_batch_size:
+        The number of messages added at once in a pipeline by :meth:`put`.
+
+        read_count:
+        The number of messages read at once by :meth:`list`.
+
+        ack_batch_size:
+        The number of deleted tiles acknowledged and deleted at once in a pipeline.
+
+        ack_interval:
+        The maximum number of seconds a deleted tile waits to be acknowledged.
+
+        pending_count:
+        The maximum number of old pending messages claimed at once with ``XAUTOCLAIM``.
+
+        pending_max_count:
+        The maximum number of old pending messages claimed by a scan of the pending messages, then
+        the next scan restarts from the oldest one. Without ``XAUTOCLAIM`` (Redis < 6.2), the
+        maximum number of pending messages examined by a scan.
+
+        max_retries:
+        The number of times a message is claimed again after ``pending_timeout``, and the number
+        of times the failed tiles of a job are sent back to the queue, then the tiles are added to
+        the errors stream.
+
+        lane_weights:
+        The weights of the priority lanes, the first one is the highest priority, see
+        :class:`~tilecloud.store.queue.LaneScheduler`. The lane 0 is the stream ``name``, the lane
+        ``i`` the stream ``name_lane<i>``.
+
+        priority:
+        Get the priority lane of a tile or a job to put, default is
+        :func:`~tilecloud.store.queue.get_priority`, see also
+        :func:`~tilecloud.store.queue.zoom_priority`. The tiles from :meth:`list` get the
+        ``priority`` attribute of their lane.
+
+        deduplicate:
+        Don't add a message that is already waiting in the queue, e.g. the same metatile enqueued
+        by several overlapping edits. The pending messages are kept in a sorted set, a message is
+        removed from it when it is read, by any consumer, with or without ``deduplicate``, so a
+        tile changed during its rendering is added again. Not used by
+        :meth:`put_bounding_pyramid`.
+
+        deduplicate_ttl:
+        The number of seconds after which a pending message is forgotten, e.g. when it is dropped
+        or the queue is trimmed.
+
+        heartbeat_interval:
+        Renew the lease of the messages in progress every ``heartbeat_interval`` seconds while
+        :meth:`list` runs, by resetting their idle time with ``XCLAIM ... JUSTID``, which doesn't
+        count as a retry. A slow but healthy tile isn't stolen by another consumer, so
+        ``pending_timeout`` can be short, a few intervals, to quickly retry the tiles of a crashed
+        consumer. The lease of a tile that leaves the pipeline without being deleted, e.g. not
+        found by ``get``, isn't renewed anymore. The job messages are in progress until all their
+        tiles are done, see :class:`~tilecloud.store.queue.JobTracker`.
+
+        monitor_interval:
+        Run :meth:`monitor` in a thread while :meth:`list` runs, one of the workers is elected to
+        sample the metrics of the queue every ``monitor_interval`` seconds.
+
+    The workers only update local counters, they don't update the ``tilecloud_redis_nb_messages``
+    and ``tilecloud_redis_pending`` gauges anymore, the metrics of the queue are sampled by
+    :meth:`monitor`, in the workers with ``monitor_interval`` or in the ``tc-redis-monitor``
+    command.
+    """
 
     _master: Redis
     _slave: Redis
@@ -48,6 +251,17 @@ class RedisTileStore(TileStore):
         max_errors_nb: int = 100,
         pending_count: int = 10,
         pending_max_count: int = sys.maxsize,
+        binary_messages: bool = False,
+        put_batch_size: int = 100,
+        read_count: int = 1,
+        ack_batch_size: int = 1,
+        ack_interval: float = 1.0,
+        lane_weights: Sequence[float] = (1,),
+        priority: Callable[[Tile | Job], int] = get_priority,
+        deduplicate: bool = False,
+        deduplicate_ttl: int = 24 * 3600,
+        heartbeat_interval: float | None = None,
+        monitor_interval: float | None = None,
         sentinels: list[tuple[str, int]] | None = None,
         service_name: str = "mymaster",
         sentinel_kwargs: Any = None,
@@ -80,21 +294,62 @@ class RedisTileStore(TileStore):
         self._max_errors_nb = max_errors_nb
         self._pending_count = pending_count
         self._pending_max_count = pending_max_count
+        self._binary_messages = binary_messages
+        self._encode: Callable[[Tile], str | bytes] = (
+            encode_binary_message if binary_messages else encode_message
+        )
+        self._encode_job: Callable[[Job], str | bytes] = (
+            encode_binary_job_message if binary_messages else encode_job_message
+        )
+        self._put_batch_size = put_batch_size
+        self._read_count = read_count
+        self._ack_batch_size = ack_batch_size
+        self._ack_interval = ack_interval
+        self._to_ack: list[tuple[bytes, bytes]] = []
+        self._ack_time = time.monotonic()
+        # The tiles can be acknowledged in another thread than the one that lists them
+        self._ack_lock = threading.Lock()
+        self._scheduler = LaneScheduler(lane_weights)
+        self._priority = priority
+        self._deduplicate = deduplicate
+        self._deduplicate_ttl_ms = deduplicate_ttl * 1000
+        self._add_unique_script = self._master.register_script(_ADD_UNIQUE_SCRIPT)
+        self._autoclaim = True
+        self._jobs = JobTracker()
+        self._heartbeat_interval = heartbeat_interval
+        self._monitor_interval = monitor_interval
+        self._renew_script = self._master.register_script(_RENEW_SCRIPT)
+        self._elect_script = self._master.register_script(_ELECT_SCRIPT)
+        self._monitored: set[tuple[str, ...]] = set()
+        # The read and not yet acknowledged messages, by stream
+        self._in_flight: dict[bytes, set[bytes]] = {}
+        # Reentrant, the tiles can be garbage collected while the lock is held
+        self._in_flight_lock = threading.RLock()
         if not name.startswith("queue_"):
             name = "queue_" + name
         self._name_str = name
         self._name = name.encode("utf-8")
         self._errors_name = self._name + b"_errors"
-        try:
-            logger.debug(
-                "Create the Redis stream name: %s, group name: %s, id: 0-0, MKSTREAM",
-                name,
-                STREAM_GROUP,
-            )
-            self._master.xgroup_create(name=self._name, groupname=STREAM_GROUP, id="0-0", mkstream=True)
-        except redis.ResponseError as error:
-            if "BUSYGROUP" not in str(error):
-                raise
+        self._pending_name = self._name + b"_pending"
+        self._monitor_name = self._name + b"_monitor"
+        self._lanes = [self._name] + [
+            self._name + f"_lane{lane}".encode() for lane in range(1, len(lane_weights))
+        ]
+        self._lane_indexes = {lane_name: lane for lane, lane_name in enumerate(self._lanes)}
+        self._claim_start_ids: dict[bytes, bytes | str] = dict.fromkeys(self._lanes, "0-0")
+        # The number of messages claimed since the scan started from the oldest one
+        self._claimed_counts: dict[bytes, int] = dict.fromkeys(self._lanes, 0)
+        for lane_name in self._lanes:
+            try:
+                logger.debug(
+                    "Create the Redis stream name: %s, group name: %s, id: 0-0, MKSTREAM",
+                    lane_name,
+                    STREAM_GROUP,
+                )
+                self._master.xgroup_create(name=lane_name, groupname=STREAM_GROUP, id="0-0", mkstream=True)
+            except redis.ResponseError as error:
+                if "BUSYGROUP" not in str(error):
+                    raise
 
     def __contains__(self, tile: Tile) -> bool:
         return False
@@ -103,113 +358,619 @@ class RedisTileStore(TileStore):
         return tile
 
     def list(self) -> Iterator[Tile]:
-        count = 0
-        while True:
-            try:
-                logger.debug(
-                    "Wait for new tiles, group name: %s, consumer name: %s, streams: %s, count: 1, block: %s",
-                    STREAM_GROUP,
-                    CONSUMER_NAME,
-                    self._name,
-                    round(self._timeout_ms),
+        stopping = threading.Event()
+        if self._heartbeat_interval is not None:
+            threading.Thread(
+                target=self._heartbeat, args=(stopping,), name="redis-heartbeat", daemon=True
+            ).start()
+        if self._monitor_interval is not None:
+            threading.Thread(
+                target=self.monitor,
+                args=(self._monitor_interval, stopping),
+                name="redis-monitor",
+                daemon=True,
+            ).start()
+        try:
+            yield from self._list()
+        finally:
+            stopping.set()
+            self.flush()
+
+    def _heartbeat(self, stopping: threading.Event) -> None:
+        assert self._heartbeat_interval is not None
+        while not stopping.wait(self._heartbeat_interval):
+            with self._in_flight_lock:
+                in_flight = {lane_name: list(ids) for lane_name, ids in self._in_flight.items() if ids}
+            if in_flight:
+                try:
+                    self._renew(in_flight)
+                except redis.exceptions.RedisError:
+                    logger.warning("Failed renewing the Redis messages lease", exc_info=True)
+
+    def _forget_in_flight(self, lane_name: bytes, id_: bytes) -> None:
+        with self._in_flight_lock:
+            self._in_flight.get(lane_name, set()).discard(id_)
+
+    def _renew(self, in_flight: dict[bytes, Sequence[bytes]]) -> None:
+        logger.debug("Renew the lease of %d messages", sum(len(ids) for ids in in_flight.values()))
+        pipeline = self._master.pipeline(transaction=False)
+        for lane_name, ids in in_flight.items():
+            self._renew_script(keys=[lane_name], args=[STREAM_GROUP, CONSUMER_NAME, *ids], client=pipeline)
+        for lane_name, result in zip(in_flight, pipeline.execute(), strict=True):
+            with self._in_flight_lock:
+                # Not the acknowledged ones
+                lost = [id_ for id_ in result if id_ in self._in_flight.get(lane_name, set())]
+                self._in_flight.get(lane_name, set()).difference_update(lost)
+            if lost:
+                logger.warning(
+                    "%d messages in progress have been claimed by another consumer, name: %s, ids: %s",
+                    len(lost),
+                    lane_name,
+                    lost,
                 )
+                _LOST_LEASE_COUNTER.labels(self._name_str).inc(len(lost))
+
+    def _lane(self, item: Tile | Job) -> bytes:
+        return self._lanes[min(max(self._priority(item), 0), len(self._lanes) - 1)]
+
+    def _read(self) -> Any:
+        if len(self._lanes) > 1:
+            order = self._scheduler.order()
+            for index, lane in enumerate(order):
                 queues = self._master.xreadgroup(
                     groupname=STREAM_GROUP,
                     consumername=CONSUMER_NAME,
-                    streams={self._name: ">"},
-                    count=1,
-                    block=round(self._timeout_ms),
+                    streams={self._lanes[lane]: ">"},
+                    count=self._read_count,
                 )
+                if queues:
+                    self._scheduler.served(lane, order[:index])
+                    return queues
+        logger.debug(
+            "Wait for new tiles, group name: %s, consumer name: %s, streams: %s, count: %d, block: %s",
+            STREAM_GROUP,
+            CONSUMER_NAME,
+            self._lanes,
+            self._read_count,
+            round(self._timeout_ms),
+        )
+        return self._master.xreadgroup(
+            groupname=STREAM_GROUP,
+            consumername=CONSUMER_NAME,
+            streams=dict.fromkeys(self._lanes, ">"),
+            count=self._read_count,
+            block=round(self._timeout_ms),
+        )
+
+    def _list(self) -> Iterator[Tile]:
+        while True:
+            try:
+                # The jobs completed by dropped tiles
+                self._maybe_flush()
+                queues = self._read()
                 logger.debug("Get %d new elements", len(queues))
 
                 if not queues:
+                    # Don't keep the processed tiles while the queue is empty
+                    self.flush()
                     queues, has_pendings = self._claim_olds()
-                    if not has_pendings:
-                        _NB_MESSAGE_COUNTER.labels(self._name_str).set(0)
-                        _PENDING_COUNTER.labels(self._name_str).set(0)
-                        if self._stop_if_empty:
-                            break
+                    if not has_pendings and self._stop_if_empty:
+                        break
                 if queues:
+                    # The producers may deduplicate even if this consumer doesn't
+                    self._forget_pending(queues)
+                    if self._heartbeat_interval is not None:
+                        with self._in_flight_lock:
+                            for queue_name, queue_messages in queues:
+                                self._in_flight.setdefault(queue_name, set()).update(
+                                    id_ for id_, body in queue_messages if body is not None
+                                )
                     for redis_message in queues:
                         queue_name, queue_messages = redis_message
-                        assert queue_name == self._name
+                        lane = self._lane_indexes[queue_name]
+                        _CONSUMED_COUNTER.labels(self._name_str).inc(len(queue_messages))
                         for message in queue_messages:
                             id_, body = message
+                            if body is None:
+                                # Deleted from the stream while pending
+                                continue
                             try:
-                                tile = decode_message(body[b"message"], from_redis=True, sqs_message=id_)
-                                yield tile
+                                for tile in self._jobs.decode(
+                                    body[b"message"], id_, from_redis=True, sqs_message=id_, priority=lane
+                                ):
+                                    if self._heartbeat_interval is not None and not hasattr(tile, "job"):
+                                        # Stop renewing the lease of a tile that leaves the pipeline
+                                        # without being deleted, it is claimed again after pending_timeout
+                                        weakref.finalize(tile, self._forget_in_flight, queue_name, id_)
+                                    yield tile
                             except Exception:  # pylint: disable=broad-except
                                 logger.warning("Failed decoding the Redis message", exc_info=True)
                                 _DECODE_ERROR_COUNTER.labels(self._name_str).inc()
-                            count += 1
-
-                    if count % 10 == 0:
-                        _NB_MESSAGE_COUNTER.labels(self._name_str).set(self._slave.xlen(self._name))
-                        pending = self._slave.xpending(  # type: ignore[no-untyped-call]
-                            self._name,
-                            STREAM_GROUP,
-                        )
-                        _PENDING_COUNTER.labels(self._name_str).set(pending["pending"])
+                                with self._in_flight_lock:
+                                    self._in_flight.get(queue_name, set()).discard(id_)
             except redis.exceptions.TimeoutError:
                 logger.warning("Failed reading Redis messages", exc_info=True)
                 _READ_ERROR_COUNTER.labels(self._name_str).inc()
                 time.sleep(1)
 
+    def _depths(self) -> dict[bytes, tuple[int, int]]:
+        """Get the number of messages and of pending messages of the lanes."""
+        pipeline = self._slave.pipeline(transaction=False)
+        for lane_name in self._lanes:
+            pipeline.xlen(lane_name)
+            pipeline.xpending(lane_name, STREAM_GROUP)  # type: ignore[no-untyped-call]
+        results = pipeline.execute()
+        return {
+            lane_name: (nb_messages, pending["pending"])
+            for lane_name, nb_messages, pending in zip(self._lanes, results[::2], results[1::2], strict=True)
+        }
+
+    def monitor(self, interval: float = 15.0, stopping: threading.Event | None = None) -> None:
+        """
+        Sample the metrics of the queue every ``interval`` seconds, until ``stopping`` is set.
+
+        It can run in a thread of each worker or in a sidecar process, only one monitor of the queue
+        samples at a time, elected with a Redis lock, the other ones publish nothing.
+        """
+        stopping = stopping or threading.Event()
+        while True:
+            try:
+                if self._elect_script(
+                    keys=[self._monitor_name], args=[CONSUMER_NAME, round(interval * 3000)]
+                ):
+                    self.sample()
+                else:
+                    self._clear_samples()
+            except redis.exceptions.RedisError:
+                logger.warning("Failed sampling the Redis queue metrics", exc_info=True)
+            if stopping.wait(interval):
+                self._clear_samples()
+                return
+
+    def sample(self) -> dict[str, Any]:
+        """
+        Sample the metrics of the queue and publish them.
+
+        By stream name: the number of messages, the number of pending messages, the number of
+        messages not yet read (Redis 7), the number of messages ever added (Redis 7), and by
+        consumer the number of pending messages and the idle time. And the number of recent errors.
+        """
+        self._trim_errors()
+        pipeline = self._slave.pipeline(transaction=False)
+        for lane_name in self._lanes:
+            pipeline.xinfo_stream(lane_name)
+            pipeline.xinfo_groups(lane_name)
+            pipeline.xinfo_consumers(lane_name, STREAM_GROUP)
+        pipeline.xlen(self._errors_name)
+        results = pipeline.execute()
+
+        samples: dict[str, Any] = {"errors": results[-1]}
+        monitored = {("errors", self._name_str)}
+        _ERRORS_GAUGE.labels(self._name_str).set(results[-1])
+        for lane_name, stream, groups, consumers in zip(
+            self._lanes, results[:-1:3], results[1:-1:3], results[2:-1:3], strict=True
+        ):
+            name = lane_name.decode()
+            group = next(group for group in groups if group["name"] in (STREAM_GROUP, STREAM_GROUP.encode()))
+            sample: dict[str, Any] = {
+                "length": stream["length"],
+                "pending": group["pending"],
+                "lag": group.get("lag"),
+                "added": stream.get("entries-added"),
+                "consumers": {
+                    consumer["name"].decode(): {
+                        "pending": consumer["pending"],
+                        "idle": consumer["idle"] / 1000,
+                    }
+                    for consumer in consumers
+                },
+            }
+            samples[name] = sample
+            _NB_MESSAGE_COUNTER.labels(name).set(sample["length"])
+            _PENDING_COUNTER.labels(name).set(sample["pending"])
+            _CONSUMERS_GAUGE.labels(name).set(len(sample["consumers"]))
+            monitored.update({("length", name), ("pending", name), ("consumers", name)})
+            if sample["lag"] is not None:
+                _LAG_GAUGE.labels(name).set(sample["lag"])
+                monitored.add(("lag", name))
+            if sample["added"] is not None:
+                _ADDED_GAUGE.labels(name).set(sample["added"])
+                monitored.add(("added", name))
+            for consumer_name, consumer in sample["consumers"].items():
+                _CONSUMER_PENDING_GAUGE.labels(name, consumer_name).set(consumer["pending"])
+                _CONSUMER_IDLE_GAUGE.labels(name, consumer_name).set(consumer["idle"])
+                monitored.update(
+                    {("consumer_pending", name, consumer_name), ("consumer_idle", name, consumer_name)}
+                )
+        # The consumers that disappeared
+        self._clear_samples(self._monitored - monitored)
+        self._monitored = monitored
+        return samples
+
+    def _clear_samples(self, samples: Iterable[tuple[str, ...]] | None = None) -> None:
+        """Remove the published samples, e.g. when another monitor has been elected."""
+        gauges = {
+            "errors": _ERRORS_GAUGE,
+            "length": _NB_MESSAGE_COUNTER,
+            "pending": _PENDING_COUNTER,
+            "consumers": _CONSUMERS_GAUGE,
+            "lag": _LAG_GAUGE,
+            "added": _ADDED_GAUGE,
+            "consumer_pending": _CONSUMER_PENDING_GAUGE,
+            "consumer_idle": _CONSUMER_IDLE_GAUGE,
+        }
+        for metric, *labels in self._monitored if samples is None else samples:
+            with contextlib.suppress(KeyError):
+                gauges[metric].remove(*labels)
+        if samples is None:
+            self._monitored = set()
+
+    def _forget_pending(self, queues: Iterable[tuple[bytes, Any]]) -> None:
+        messages = [
+            body[b"message"] for _, queue_messages in queues for _, body in queue_messages if body is not None
+        ]
+        if messages:
+            self._master.zrem(self._pending_name, *messages)
+
+    def _add(self, client: Any, lane_name: bytes, message: str | bytes) -> Any:
+        """Add a message with ``client``, the Redis client or a pipeline, only once if deduplicated."""
+        if self._deduplicate:
+            return self._add_unique_script(
+                keys=[self._pending_name, lane_name], args=[message, self._deduplicate_ttl_ms], client=client
+            )
+        return client.xadd(name=lane_name, fields={"message": message})
+
     def put_one(self, tile: Tile) -> Tile:
         try:
-            logger.debug(
-                "Add tile to the Redis stream name: %s, fields: %s",
-                self._name,
-                encode_message(tile),
-            )
-            self._master.xadd(name=self._name, fields={"message": encode_message(tile)})
+            message = self._encode(tile)
+            lane_name = self._lane(tile)
+            logger.debug("Add tile to the Redis stream name: %s, fields: %s", lane_name, message)
+            if not self._add(self._master, lane_name, message):
+                _DEDUPLICATED_COUNTER.labels(self._name_str).inc()
         except Exception as exception:  # pylint: disable=broad-except
             logger.warning("Failed sending Redis message", exc_info=True)
             tile.error = exception
         return tile
 
     def put(self, tiles: Iterable[Tile]) -> Iterator[Tile]:
+        batch: list[Tile] = []
         for tile in tiles:
-            self.put_one(tile)
-            yield tile
+            batch.append(tile)
+            if len(batch) >= self._put_batch_size:
+                yield from self._put_batch(batch)
+                batch = []
+        if batch:
+            yield from self._put_batch(batch)
+
+    def _put_batch(self, tiles: Sequence[Tile]) -> Sequence[Tile]:
+        logger.debug("Add %d tiles to the Redis stream name: %s", len(tiles), self._name)
+        try:
+            pipeline = self._master.pipeline(transaction=False)
+            for tile in tiles:
+                self._add(pipeline, self._lane(tile), self._encode(tile))
+            results = pipeline.execute(raise_on_error=False)
+        except Exception as exception:  # pylint: disable=broad-except
+            logger.warning("Failed sending Redis messages", exc_info=True)
+            for tile in tiles:
+                tile.error = exception
+            return tiles
+        nb_deduplicated = 0
+        for tile, result in zip(tiles, results, strict=True):
+            if isinstance(result, Exception):
+                logger.warning("Failed sending Redis message: %s", result)
+                tile.error = result
+            elif not result:
+                nb_deduplicated += 1
+        if nb_deduplicated:
+            _DEDUPLICATED_COUNTER.labels(self._name_str).inc(nb_deduplicated)
+        return tiles
+
+    def put_jobs(self, jobs: Iterable[Job]) -> int:
+        """
+        Add job messages, each of them is expanded into tiles by :meth:`list`.
+
+        Returns the number of added jobs, without the deduplicated ones.
+        """
+        count = 0
+        nb_jobs = 0
+        pipeline = self._master.pipeline(transaction=False)
+        for job in jobs:
+            self._add(pipeline, self._lane(job), self._encode_job(job))
+            nb_jobs += 1
+            if len(pipeline) >= self._put_batch_size:
+                count += sum(1 for result in pipeline.execute() if result)
+        count += sum(1 for result in pipeline.execute() if result)
+        if count < nb_jobs:
+            _DEDUPLICATED_COUNTER.labels(self._name_str).inc(nb_jobs - count)
+        logger.debug("Added %d jobs to the Redis stream name: %s", count, self._name)
+        return count
+
+    def put_bounding_pyramid(
+        self,
+        bounding_pyramid: BoundingPyramid,
+        n: int = 1,  # pylint: disable=invalid-name
+        metadata: dict[str, Any] | None = None,
+        max_script_messages: int = 10000,
+        progress: Callable[[int], None] | None = None,
+        priority: int = 0,
+    ) -> int:
+        """
+        Add the (meta)tiles of a bounding pyramid, in the :meth:`BoundingPyramid.metatilecoords` order.
+
+        The messages are created by a server side script, by ranges of columns of at most
+        ``max_script_messages`` messages to don't block the server for too long. They are encoded
+        like the ones of :meth:`put`, depending on ``binary_messages``.
+
+            progress:
+            Called with the number of added messages after each range.
+
+            priority:
+            The priority of the messages, given to the ``priority`` function of the store as the
+            priority of a job of each range, e.g. with
+            :func:`~tilecloud.store.queue.zoom_priority` the zoom levels go in their lanes.
+
+        Returns the number of added messages.
+        """
+        script = self._master.register_script(_ADD_RANGE_SCRIPT)
+        metadata_json = (
+            json.dumps(metadata or {}, separators=(",", ":"))
+            if self._binary_messages
+            else json.dumps(metadata or {})
+        )
+        count = 0
+        lanes = set()
+        for z in sorted(bounding_pyramid.bounds.keys()):
+            xbounds, ybounds = bounding_pyramid.bounds[z]
+            if xbounds.start is None or ybounds.start is None:
+                continue
+            assert xbounds.stop is not None
+            assert ybounds.stop is not None
+            start = TileCoord(z, xbounds.start, ybounds.start).metatilecoord(n)
+            nb_rows = -(-(ybounds.stop - start.y) // n)
+            step = max(1, max_script_messages // nb_rows) * n
+            for x in range(start.x, xbounds.stop, step):
+                stop = min(x + step, xbounds.stop)
+                lane_name = self._lane(
+                    Job(z, x, start.y, n, -(-(stop - x) // n), nb_rows, metadata, priority)
+                )
+                lanes.add(lane_name)
+                count += int(
+                    script(
+                        keys=[lane_name],
+                        args=[
+                            z,
+                            n,
+                            x,
+                            stop,
+                            start.y,
+                            ybounds.stop,
+                            metadata_json,
+                            int(self._binary_messages),
+                        ],
+                    )
+                )
+                if progress is not None:
+                    progress(count)
+        logger.info("Added %d messages to the Redis streams: %s", count, sorted(lanes))
+        return count
 
     def delete_one(self, tile: Tile) -> Tile:
         # Once consumed from redis, we don't have to delete the tile from the queue.
         assert hasattr(tile, "from_redis")
         assert hasattr(tile, "sqs_message")
         assert tile.from_redis is True
-        logger.debug(
-            "Acknowledge tile from Redis stream name: %s, group name: %s, sqs message: %s",
-            self._name,
-            STREAM_GROUP,
-            tile.sqs_message,
-        )
-        self._master.xack(self._name, STREAM_GROUP, tile.sqs_message)  # type: ignore[no-untyped-call]
-        logger.debug("Delete tile from Redis stream name: %s, sqs message: %s", self._name, tile.sqs_message)
-        self._master.xdel(self._name, tile.sqs_message)
+        if hasattr(tile, "job"):
+            self._jobs.done(tile)
+        else:
+            with self._ack_lock:
+                self._to_ack.append((self._lanes[getattr(tile, "priority", 0)], tile.sqs_message))
+        self._maybe_flush()
         return tile
 
+    def _complete_jobs(self) -> None:
+        """Requeue the failed tiles of the completed jobs, or add them to the errors, and acknowledge the jobs."""
+        for job, failed, delivery in self._jobs.completed():
+            if failed:
+                if job.attempt < self._max_retries:
+                    logger.info("Requeue %d failed tiles of %r", len(failed), job)
+                    self.put_jobs(job.retry(failed))
+                else:
+                    logger.warning(
+                        "Drop %d failed tiles of %r after %d attempts", len(failed), job, job.attempt + 1
+                    )
+                    pipeline = self._master.pipeline(transaction=False)
+                    self._add_errors(pipeline, failed)
+                    pipeline.execute()
+                    _DROPPED_COUNTER.labels(self._name_str).inc(len(failed))
+            with self._ack_lock:
+                self._to_ack.append((self._lanes[delivery["priority"]], delivery["sqs_message"]))
+
+    def _maybe_flush(self) -> None:
+        self._complete_jobs()
+        with self._ack_lock:
+            flush = (
+                len(self._to_ack) >= self._ack_batch_size
+                or time.monotonic() - self._ack_time >= self._ack_interval
+            )
+        if flush:
+            self.flush()
+
+    def flush(self) -> None:
+        """Acknowledge and delete the deleted tiles from the Redis stream."""
+        self._complete_jobs()
+        with self._ack_lock:
+            self._ack_time = time.monotonic()
+            acked, self._to_ack = self._to_ack, []
+        if not acked:
+            return
+        to_ack: dict[bytes, list[bytes]] = {}
+        for lane_name, id_ in acked:
+            to_ack.setdefault(lane_name, []).append(id_)
+        pipeline = self._master.pipeline(transaction=False)
+        for lane_name, ids in to_ack.items():
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    "Acknowledge and delete tiles from Redis stream name: %s, group name: %s, sqs messages: %s",
+                    lane_name,
+                    STREAM_GROUP,
+                    ids,
+                )
+            pipeline.xack(lane_name, STREAM_GROUP, *ids)  # type: ignore[no-untyped-call]
+            pipeline.xdel(lane_name, *ids)
+        pipeline.execute()
+        _ACKNOWLEDGED_COUNTER.labels(self._name_str).inc(sum(len(ids) for ids in to_ack.values()))
+        with self._in_flight_lock:
+            for lane_name, ids in to_ack.items():
+                self._in_flight.get(lane_name, set()).difference_update(ids)
+
     def delete_all(self) -> None:
         """Delete the queue completely, used only by tests."""
-        logger.debug("Delete all tiles from Redis stream name: %s", self._name)
-        self._master.xtrim(name=self._name, maxlen=0)
-        # xtrim doesn't empty the group claims. So we have to delete and re-create groups
-        logger.debug("Delete all tiles from Redis stream name: %s, group name: %s", self._name, STREAM_GROUP)
-        self._master.xgroup_destroy(name=self._name, groupname=STREAM_GROUP)  # type: ignore[no-untyped-call]
-        logger.debug(
-            "Create the Redis stream name: %s, group name: %s, id: 0-0, MKSTREAM",
-            self._name,
-            STREAM_GROUP,
-        )
-        self._master.xgroup_create(name=self._name, groupname=STREAM_GROUP, id="0-0", mkstream=True)
+        for lane_name in self._lanes:
+            logger.debug("Delete all tiles from Redis stream name: %s", lane_name)
+            self._master.xtrim(name=lane_name, maxlen=0)
+            # xtrim doesn't empty the group claims. So we have to delete and re-create groups
+            logger.debug(
+                "Delete all tiles from Redis stream name: %s, group name: %s", lane_name, STREAM_GROUP
+            )
+            self._master.xgroup_destroy(name=lane_name, groupname=STREAM_GROUP)  # type: ignore[no-untyped-call]
+            logger.debug(
+                "Create the Redis stream name: %s, group name: %s, id: 0-0, MKSTREAM",
+                lane_name,
+                STREAM_GROUP,
+            )
+            self._master.xgroup_create(name=lane_name, groupname=STREAM_GROUP, id="0-0", mkstream=True)
         logger.debug(
             "Delete all tiles from Redis stream name: %s, group name: %s",
             self._errors_name,
             STREAM_GROUP,
         )
         self._master.xtrim(name=self._errors_name, maxlen=0)
+        self._master.delete(self._pending_name, self._monitor_name)
 
     def _claim_olds(self) -> tuple[Iterable[tuple[bytes, Any]], bool]:
+        """Claim the old pending messages of the first lane, in priority order, that has some."""
+        has_pendings = False
+        for lane_name in self._lanes:
+            queues, lane_has_pendings = self._claim_lane_olds(lane_name)
+            if queues:
+                return queues, True
+            has_pendings = has_pendings or lane_has_pendings
+        return [], has_pendings
+
+    def _claim_lane_olds(self, name: bytes) -> tuple[Iterable[tuple[bytes, Any]], bool]:
+        if self._autoclaim:
+            try:
+                return self._autoclaim_olds(name)
+            except redis.ResponseError as error:
+                if "unknown command" not in str(error).lower():
+                    raise
+                logger.info("XAUTOCLAIM not supported by the Redis server, fallback on XPENDING")
+                self._autoclaim = False
+        return self._scan_olds(name)
+
+    def _autoclaim_olds(self, name: bytes) -> tuple[Iterable[tuple[bytes, Any]], bool]:
+        logger.debug(
+            "Auto claim old's name: %s, group name: %s, consumer name: %s, min idle time: %d, start: %s",
+            name,
+            STREAM_GROUP,
+            CONSUMER_NAME,
+            self._pending_timeout_ms,
+            self._claim_start_ids[name],
+        )
+        result = self._master.xautoclaim(
+            name=name,
+            groupname=STREAM_GROUP,
+            consumername=CONSUMER_NAME,
+            min_idle_time=self._pending_timeout_ms,
+            start_id=self._claim_start_ids[name],
+            count=max(1, min(self._pending_count, self._pending_max_count - self._claimed_counts[name])),
+        )
+        self._claimed_counts[name] += len(result[1])
+        if self._claimed_counts[name] >= self._pending_max_count:
+            # Restart the scan from the oldest message
+            self._claim_start_ids[name] = "0-0"
+            self._claimed_counts[name] = 0
+        else:
+            self._claim_start_ids[name] = result[0]
+        if result[0] in ("0-0", b"0-0"):
+            self._claimed_counts[name] = 0
+        messages = [message for message in result[1] if message[1] is not None]
+        if not messages:
+            if result[0] not in ("0-0", b"0-0"):
+                # Continue the scan of the pending messages on the next call
+                return [], True
+            pending = self._master.xpending(name, STREAM_GROUP)  # type: ignore[no-untyped-call]
+            return [], pending["pending"] > 0
+
+        # The delivery counts of the claimed messages, in one request
+        pendings = self._master.xpending_range(
+            name=name,
+            groupname=STREAM_GROUP,
+            min=messages[0][0],
+            max=messages[-1][0],
+            count=len(messages),
+            consumername=CONSUMER_NAME,
+        )
+        times_delivered = {pending["message_id"]: int(pending["times_delivered"]) for pending in pendings}
+        to_steal = []
+        to_drop = []
+        for message in messages:
+            # The claim counts as a delivery
+            nb_retries = times_delivered.get(message[0], 1) - 1
+            if nb_retries <= self._max_retries:
+                logger.info(
+                    "A message has been pending for too long. Stealing it (retry #%d): %s",
+                    nb_retries,
+                    message[0],
+                )
+                to_steal.append(message)
+            else:
+                logger.warning(
+                    "A message has been pending for too long and retried too many times. Dropping it: %s",
+                    message[0],
+                )
+                to_drop.append(message)
+        if to_drop:
+            self._drop(name, to_drop)
+        if to_steal:
+            _STOLEN_COUNTER.labels(self._name_str).inc(len(to_steal))
+            return [(name, to_steal)], True
+        return [], True
+
+    def _drop(self, name: bytes, drop_messages: Sequence[tuple[bytes, dict[bytes, Any]]]) -> None:
+        drop_ids = [drop_message[0] for drop_message in drop_messages]
+        logger.debug(
+            "Acknowledge and delete old's name: %s, group name: %s, message ids: %s",
+            name,
+            STREAM_GROUP,
+            drop_ids,
+        )
+        pipeline = self._master.pipeline(transaction=False)
+        pipeline.xack(name, STREAM_GROUP, *drop_ids)  # type: ignore[no-untyped-call]
+        pipeline.xdel(name, *drop_ids)
+        self._add_errors(
+            pipeline,
+            (decode_message(drop_message[b"message"]).tilecoord for _, drop_message in drop_messages),
+        )
+        pipeline.execute()
+        _DROPPED_COUNTER.labels(self._name_str).inc(len(drop_messages))
+
+    def _add_errors(self, pipeline: redis.client.Pipeline, tilecoords: Iterable[TileCoord]) -> None:  # type: ignore[type-arg]
+        for tilecoord in tilecoords:
+            logger.debug(
+                "Add to errors name: %s, tile coord: %s, max len: %s",
+                self._errors_name,
+                tilecoord,
+                self._max_errors_nb,
+            )
+            pipeline.xadd(
+                name=self._errors_name,
+                fields={"tilecoord": str(tilecoord)},
+                maxlen=self._max_errors_nb,
+            )
+
+    def _scan_olds(self, name: bytes) -> tuple[Iterable[tuple[bytes, Any]], bool]:
+        """Claim the old pending messages on the Redis servers that don't support XAUTOCLAIM."""
         logger.debug("Claim old's")
         to_steal: list[int] = []
         to_drop: list[int] = []
@@ -220,13 +981,13 @@ class RedisTileStore(TileStore):
                 break
             logger.debug(
                 "Get pending messages, name: %s, group name: %s, min: %d, max: +, count: %d",
-                self._name,
+                name,
                 STREAM_GROUP,
                 min_,
                 self._pending_count,
             )
             pendings = self._master.xpending_range(
-                name=self._name,
+                name=name,
                 groupname=STREAM_GROUP,
                 min=min_,
                 max="+",
@@ -267,93 +1028,77 @@ class RedisTileStore(TileStore):
         if to_drop:
             logger.debug(
                 "Claim old's name: %s, group name: %s, consumer name: %s, min idle time: %d, message ids: %s",
-                self._name,
+                name,
                 STREAM_GROUP,
                 CONSUMER_NAME,
                 self._pending_timeout_ms,
                 to_drop,
             )
             drop_messages = self._master.xclaim(  # type: ignore[no-untyped-call]
-                name=self._name,
+                name=name,
                 groupname=STREAM_GROUP,
                 consumername=CONSUMER_NAME,
                 min_idle_time=self._pending_timeout_ms,
                 message_ids=to_drop,
             )
-            drop_ids = [drop_message[0] for drop_message in drop_messages]
-            logger.debug(
-                "Acknowledge old's name: %s, group name: %s, message ids: %s",
-                self._name,
-                STREAM_GROUP,
-                drop_ids,
-            )
-            self._master.xack(self._name, STREAM_GROUP, *drop_ids)  # type: ignore[no-untyped-call]
-            logger.debug("Delete old's name: %s, message ids: %s", self._name, drop_ids)
-            self._master.xdel(self._name, *drop_ids)
-            for _, drop_message in drop_messages:
-                tile = decode_message(drop_message[b"message"])
-                logger.debug(
-                    "Add to errors name: %s, tile coord: %s, max len: %s",
-                    self._errors_name,
-                    tile.tilecoord,
-                    self._max_errors_nb,
-                )
-                self._master.xadd(
-                    name=self._errors_name,
-                    fields={"tilecoord": str(tile.tilecoord)},
-                    maxlen=self._max_errors_nb,
-                )
-            _DROPPED_COUNTER.labels(self._name_str).inc(len(to_drop))
+            self._drop(name, drop_messages)
 
         logger.debug("%d elements to steal", len(to_steal))
         if to_steal:
             logger.debug(
                 "Claim old's name: %s, group name: %s, consumer name: %s, min idle time: %d, message ids: %s",
-                self._name,
+                name,
                 STREAM_GROUP,
                 CONSUMER_NAME,
                 self._pending_timeout_ms,
                 to_steal,
             )
             messages = self._master.xclaim(  # type: ignore[no-untyped-call]
-                name=self._name,
+                name=name,
                 groupname=STREAM_GROUP,
                 consumername=CONSUMER_NAME,
                 min_idle_time=self._pending_timeout_ms,
                 message_ids=to_steal,
             )
             _STOLEN_COUNTER.labels(self._name_str).inc(len(to_steal))
-            return [(self._name, messages)], has_pendings
+            return [(name, messages)], has_pendings
         # Empty means there are pending jobs, but they are not old enough to be stolen
         return [], has_pendings
 
     def get_status(self) -> dict[str, str | int]:
         """Get a map of stats."""
-        nb_messages = self._slave.xlen(self._name)
-        pending = self._slave.xpending(self._name, STREAM_GROUP)  # type: ignore[no-untyped-call]
+        depths = self._depths()
         tiles_in_error = self._get_errors()
 
-        _NB_MESSAGE_COUNTER.labels(self._name_str).set(nb_messages)
-        return {
-            "Approximate number of tiles to generate": nb_messages,
-            "Approximate number of generating tiles": pending["pending"],
+        status: dict[str, str | int] = {
+            "Approximate number of tiles to generate": sum(depth[0] for depth in depths.values()),
+            "Approximate number of generating tiles": sum(depth[1] for depth in depths.values()),
             "Tiles in error": ", ".join(tiles_in_error),
         }
+        if len(self._lanes) > 1:
+            for lane, lane_name in enumerate(self._lanes):
+                status[f"Approximate number of tiles to generate in lane {lane}"] = depths[lane_name][0]
+                status[f"Approximate number of generating tiles in lane {lane}"] = depths[lane_name][1]
+        return status
+
+    def _trim_errors(self) -> None:
+        """Delete the errors older than ``max_errors_age``."""
+        now, now_us = self._master.time()
+        old_timestamp = round((now - self._max_errors_age) * 1000 + now_us / 1000)
+        try:
+            deleted = self._master.xtrim(self._errors_name, minid=old_timestamp + 1, approximate=False)
+        except redis.exceptions.ResponseError:
+            # Redis < 6.2, without MINID
+            old_errors = [
+                error_id for error_id, _ in self._slave.xrange(name=self._errors_name, max=old_timestamp)
+            ]
+            deleted = self._master.xdel(self._errors_name, *old_errors) if old_errors else 0
+        if deleted:
+            logger.info("Deleting %d old errors, name: %s", deleted, self._errors_name)
 
     def _get_errors(self) -> set[str]:
-        now, now_us = self._slave.time()
-        old_timestamp = (now - self._max_errors_age) * 1000 + now_us / 1000
-
-        errors = self._slave.xrange(name=self._errors_name)
-        tiles_in_error = set()
-        old_errors = []
-        for error_id, error_message in errors:
-            timestamp = int(error_id.decode().split("-")[0])
-            if timestamp <= old_timestamp:
-                old_errors.append(error_id)
-            else:
-                tiles_in_error.add(error_message[b"tilecoord"].decode())
-        if old_errors:
-            logger.info("Deleting %d old errors, name: %s", len(old_errors), self._errors_name)
-            self._master.xdel(self._errors_name, *old_errors)
-        return tiles_in_error
+        self._trim_errors()
+        return {
+            error_message[b"tilecoord"].decode()
+            for _, error_message in self._slave.xrange(name=self._errors_name)
+        }
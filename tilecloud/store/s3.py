@@ -1,6 +1,6 @@
 import logging
 import threading
-from collections.abc import Iterator
+from collections.abc import Iterable, Iterator
 from typing import Any, cast
 
 import boto3
@@ -16,7 +16,14 @@ _CLIENT_TIMEOUT = 60
 
 
 class S3TileStore(TileStore):
-    """Tiles stored in Amazon S3."""
+    """
+    Tiles stored in Amazon S3.
+
+        accept_encodings:
+        The content encodings accepted by the clients of the bucket, used by
+        :class:`tilecloud.filter.codec.Compressor` to choose the encoding of the tiles, the tiles
+        with another content encoding are not put and got with an error. Default is all.
+    """
 
     def __init__(
         self,
@@ -25,6 +32,7 @@ class S3TileStore(TileStore):
         dry_run: bool = False,
         s3_host: Any | None = None,
         cache_control: Any | None = None,
+        accept_encodings: Iterable[str] | None = None,
         **kwargs: Any,
     ) -> None:
         self._s3_host = s3_host
@@ -33,6 +41,7 @@ class S3TileStore(TileStore):
         self.tilelayout = tilelayout
         self.dry_run = dry_run
         self.cache_control = cache_control
+        self.accept_encodings = None if accept_encodings is None else frozenset(accept_encodings)
         TileStore.__init__(self, **kwargs)
 
     def __contains__(self, tile: Tile) -> bool:
@@ -73,15 +82,24 @@ class S3TileStore(TileStore):
 
     def list(self) -> Iterator[Tile]:
         prefix = getattr(self.tilelayout, "prefix", "")
-        for s3_key in self.client.list_objects(Bucket=self.bucket, Prefix=prefix):
-            try:
-                tilecoord = self.tilelayout.tilecoord(s3_key["Key"])
-            except ValueError:
-                continue
-            yield Tile(tilecoord)
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for s3_key in page.get("Contents", []):
+                try:
+                    tilecoord = self.tilelayout.tilecoord(s3_key["Key"])
+                except ValueError:
+                    continue
+                yield Tile(tilecoord)
 
     def put_one(self, tile: Tile) -> Tile:
         assert tile.data is not None
+        if (
+            self.accept_encodings is not None
+            and tile.content_encoding is not None
+            and tile.content_encoding not in self.accept_encodings
+        ):
+            tile.error = f"Content encoding not accepted by the bucket: {tile.content_encoding}"
+            return tile
         key_name = self.tilelayout.filename(tile.tilecoord, tile.metadata)
         args = {}
         if tile.content_encoding is not None:
@@ -1,18 +1,53 @@
+import base64
 import builtins
+import hashlib
 import logging
+import threading
 import time
-from collections.abc import Callable, Iterable, Iterator
-from typing import Any
+import weakref
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator, Sequence
+from typing import Any, cast
 
 import botocore.client
 import botocore.exceptions
 
 from tilecloud import Tile, TileStore
-from tilecloud.store.queue import decode_message, encode_message
+from tilecloud.store.queue import (
+    Job,
+    JobTracker,
+    LaneScheduler,
+    encode_binary_job_message,
+    encode_binary_message,
+    encode_job_message,
+    encode_message,
+    get_priority,
+)
+
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
 
 _BATCH_SIZE = 10  # max Amazon allows
 _LOGGER = logging.getLogger(__name__)
 
+# The gauges are only exported with the prometheus extra
+_NB_MESSAGE_GAUGE = (
+    None
+    if prometheus_client is None
+    else prometheus_client.Gauge(
+        "tilecloud_sqs_nb_messages", "Approximate number of messages in SQS", ["queue", "priority"]
+    )
+)
+_NOT_VISIBLE_GAUGE = (
+    None
+    if prometheus_client is None
+    else prometheus_client.Gauge(
+        "tilecloud_sqs_not_visible", "Approximate number of messages in flight in SQS", ["queue", "priority"]
+    )
+)
+
 
 def _maybe_stop(queue: "botocore.client.SQS") -> bool:
     try:
@@ -29,18 +64,182 @@ def _maybe_stop(queue: "botocore.client.SQS") -> bool:
     return False
 
 
+class _Receivers:
+    """Receiver threads that long poll the queues of the lanes into bounded local buffers."""
+
+    def __init__(self, store: "SQSTileStore", nb_receivers: int, buffer_size: int) -> None:
+        self.store = store
+        self.buffer_size = buffer_size
+        self.buffers: list[deque[Any]] = [deque() for _ in store.queues]
+        self.condition = threading.Condition()
+        self.stopping = threading.Event()
+        # The receivers that got nothing since the last received message
+        self.empty_polls: set[int] = set()
+        self.threads = [
+            threading.Thread(
+                target=self._run, args=(index, lane), name=f"sqs-receiver-{lane}-{index}", daemon=True
+            )
+            for index, lane in enumerate(
+                lane for lane in range(len(store.queues)) for _ in range(nb_receivers)
+            )
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def _run(self, index: int, lane: int) -> None:
+        while not self.stopping.is_set():
+            with self.condition:
+                # After an empty poll, wait for the other receivers or the decision of the consumer
+                while (
+                    len(self.buffers[lane]) >= self.buffer_size or index in self.empty_polls
+                ) and not self.stopping.is_set():
+                    self.condition.wait(1)
+            if self.stopping.is_set():
+                return
+            sqs_messages = self.store._receive_lane(lane, self.store.wait_time)  # noqa: SLF001 # pylint: disable=protected-access
+            with self.condition:
+                stopped = self.stopping.is_set()
+                if not stopped:
+                    if sqs_messages:
+                        self.buffers[lane].extend(sqs_messages)
+                        self.empty_polls.clear()
+                    else:
+                        self.empty_polls.add(index)
+                    self.condition.notify_all()
+            if stopped and sqs_messages:
+                # Received after the end of the listing
+                self.store._release((lane, sqs_message) for sqs_message in sqs_messages)  # noqa: SLF001 # pylint: disable=protected-access
+
+    def get(self) -> tuple[int, Any] | None:
+        """Get a buffered message, from the lane chosen by the scheduler, None when all the queues look empty."""
+        scheduler = self.store._scheduler  # noqa: SLF001 # pylint: disable=protected-access
+        with self.condition:
+            while True:
+                order = scheduler.order()
+                for index, lane in enumerate(order):
+                    if self.buffers[lane]:
+                        scheduler.served(lane, order[:index])
+                        self.condition.notify_all()
+                        return lane, self.buffers[lane].popleft()
+                if len(self.empty_polls) == len(self.threads):
+                    self.empty_polls.clear()
+                    self.condition.notify_all()
+                    return None
+                self.condition.wait(1)
+
+    def stop(self) -> builtins.list[tuple[int, Any]]:
+        """Stop the receivers, and get the buffered messages."""
+        self.stopping.set()
+        with self.condition:
+            buffered = [
+                (lane, sqs_message) for lane, buffer in enumerate(self.buffers) for sqs_message in buffer
+            ]
+            for buffer in self.buffers:
+                buffer.clear()
+            self.condition.notify_all()
+        return buffered
+
+
 class SQSTileStore(TileStore):
-    """A tile store that store the tiles queue in Amazon SQS."""
+    """
+    A tile store that store the tiles queue in Amazon SQS.
+
+        binary_messages:
+        Use the base64 encoded compact binary messages, otherwise the base64 encoded JSON
+        messages that can be read by the older versions. Both are read. Opt-in for the rolling
+        upgrades: enable it on the producers once all the consumers are upgraded.
+
+        lane_queues:
+        The queues of the lower priority lanes, ``queue`` is the lane 0, the highest priority.
+
+        lane_weights:
+        The weights of the priority lanes, see :class:`~tilecloud.store.queue.LaneScheduler`.
+        Default halves the weight at each lane.
+
+        priority:
+        Get the priority lane of a tile or a job to send, default is
+        :func:`~tilecloud.store.queue.get_priority`, see also
+        :func:`~tilecloud.store.queue.zoom_priority`. The tiles from :meth:`list` get the
+        ``priority`` attribute of their lane.
+
+        deduplicate:
+        Send the messages with a deduplication ID computed from the message, for FIFO queues: SQS
+        doesn't add a message already sent in the last 5 minutes. Each message gets its own
+        message group to keep the parallelism of the consumers.
+
+        wait_time:
+        The number of seconds of the long polling of the receive requests, at most 20. With
+        several lanes and no receiver threads, only the last tried lane is long polled.
+
+        receivers:
+        The number of receiver threads by lane that fill a local buffer while the tiles are
+        processed, 0 to receive the messages in :meth:`list`.
+
+        buffer_size:
+        The maximum number of buffered messages by lane, they are invisible in the queue.
+
+        delete_batch_size:
+        The number of deleted tiles deleted at once from the queue with ``DeleteMessageBatch``,
+        at most 10.
+
+        delete_interval:
+        The maximum number of seconds a deleted tile waits to be deleted from the queue.
+
+        max_retries:
+        The number of times the failed tiles of a job are sent back to the queue, then they are
+        logged as errors and dropped. The retries of the tile messages are handled by the redrive
+        policy of the queue.
+
+        visibility_timeout:
+        The visibility timeout of the received messages, in seconds. The visibility of the
+        messages still in progress, including the buffered ones, is extended before it expires,
+        so a slow tile isn't received by another consumer while a crashed consumer releases its
+        messages quickly. Default uses the visibility timeout of the queue without extension.
+    """
 
     def __init__(
         self,
         queue: "botocore.client.SQS",
         on_empty: Callable[["botocore.client.SQS"], bool] = _maybe_stop,
+        binary_messages: bool = False,
+        lane_queues: Sequence["botocore.client.SQS"] = (),
+        lane_weights: Sequence[float] | None = None,
+        priority: Callable[[Tile | Job], int] = get_priority,
+        deduplicate: bool = False,
+        wait_time: int = 20,
+        receivers: int = 0,
+        buffer_size: int = 100,
+        delete_batch_size: int = 1,
+        delete_interval: float = 1.0,
+        visibility_timeout: int | None = None,
+        max_retries: int = 5,
         **kwargs: Any,
     ) -> None:
         TileStore.__init__(self, **kwargs)
         self.queue = queue
         self.on_empty = on_empty
+        self.binary_messages = binary_messages
+        self.queues = [queue, *lane_queues]
+        if lane_weights is None:
+            lane_weights = [2.0 ** (len(self.queues) - lane - 1) for lane in range(len(self.queues))]
+        assert len(lane_weights) == len(self.queues)
+        self._scheduler = LaneScheduler(lane_weights)
+        self._priority = priority
+        self.deduplicate = deduplicate
+        self.wait_time = wait_time
+        self.receivers = receivers
+        self.buffer_size = buffer_size
+        self.delete_batch_size = min(delete_batch_size, _BATCH_SIZE)
+        self.delete_interval = delete_interval
+        self.visibility_timeout = visibility_timeout
+        self.max_retries = max_retries
+        self._jobs = JobTracker()
+        # Reentrant, the tiles can be garbage collected while the lock is held
+        self._lock = threading.RLock()
+        # By message id: the lane, the message and the monotonic time when it becomes visible again
+        self._in_flight: dict[str, tuple[int, Any, float]] = {}
+        self._to_delete: builtins.list[tuple[int, Any]] = []
+        self._delete_time = time.monotonic()
 
     def __contains__(self, tile: Tile) -> bool:
         return False
@@ -48,37 +247,231 @@ class SQSTileStore(TileStore):
     def get_one(self, tile: Tile) -> Tile:
         return tile
 
-    def list(self) -> Iterator[Tile]:
-        while True:
-            try:
-                sqs_messages = self.queue.receive_messages(MaxNumberOfMessages=_BATCH_SIZE)
-            except botocore.exceptions.EndpointConnectionError:
-                _LOGGER.warning("Error fetching SQS messages", exc_info=True)
-                sqs_messages = []
-
-            if not sqs_messages:
-                if self.on_empty(self.queue):
-                    break
-            else:
+    def _queue(self, item: Tile | Job) -> "botocore.client.SQS":
+        return self.queues[min(max(self._priority(item), 0), len(self.queues) - 1)]
+
+    def _receive_lane(self, lane: int, wait_time: int) -> builtins.list[Any]:
+        kwargs: dict[str, Any] = {"MaxNumberOfMessages": _BATCH_SIZE, "WaitTimeSeconds": wait_time}
+        if self.visibility_timeout is not None:
+            kwargs["VisibilityTimeout"] = self.visibility_timeout
+        try:
+            sqs_messages = self.queues[lane].receive_messages(**kwargs)
+        except botocore.exceptions.EndpointConnectionError:
+            _LOGGER.warning("Error fetching SQS messages", exc_info=True)
+            return []
+        if self.visibility_timeout is not None and sqs_messages:
+            visible_time = time.monotonic() + self.visibility_timeout
+            with self._lock:
                 for sqs_message in sqs_messages:
-                    try:
-                        tile = decode_message(sqs_message.body.encode("utf-8"), sqs_message=sqs_message)
-                        yield tile
-                    except Exception:  # pylint: disable=broad-except
-                        _LOGGER.warning("Failed decoding the SQS message", exc_info=True)
-                        sqs_message.delete()
+                    self._in_flight[sqs_message.message_id] = (lane, sqs_message, visible_time)
+        return cast("builtins.list[Any]", sqs_messages)
+
+    def _receive(self) -> tuple[int, builtins.list[Any]]:
+        """Receive the messages of the lane chosen by the scheduler, or of the next non empty one."""
+        order = self._scheduler.order()
+        for index, lane in enumerate(order):
+            # A long poll of an empty lane would delay the other lanes
+            sqs_messages = self._receive_lane(lane, self.wait_time if index == len(order) - 1 else 0)
+            if sqs_messages:
+                self._scheduler.served(lane, order[:index])
+                return lane, sqs_messages
+        return 0, []
+
+    def list(self) -> Iterator[Tile]:
+        receivers = _Receivers(self, self.receivers, self.buffer_size) if self.receivers > 0 else None
+        stopping = threading.Event()
+        # The received messages of the batch not yet yielded
+        pending: deque[tuple[int, Any]] = deque()
+        if self.visibility_timeout is not None:
+            threading.Thread(
+                target=self._extend_visibility, args=(stopping,), name="sqs-visibility", daemon=True
+            ).start()
+        try:
+            while True:
+                # The jobs completed by dropped tiles
+                self._maybe_flush()
+                if receivers is None:
+                    lane, sqs_messages = self._receive()
+                else:
+                    received = receivers.get()
+                    lane, sqs_messages = (0, []) if received is None else (received[0], [received[1]])
+
+                if not sqs_messages:
+                    # Don't keep the processed tiles while the queue is empty
+                    self.flush()
+                    if all(self.on_empty(queue) for queue in self.queues):
+                        break
+                else:
+                    pending.extend((lane, sqs_message) for sqs_message in sqs_messages)
+                    while pending:
+                        lane, sqs_message = pending.popleft()
+                        try:
+                            for tile in self._jobs.decode(
+                                sqs_message.body.encode("utf-8"),
+                                sqs_message.message_id,
+                                sqs_message=sqs_message,
+                                priority=lane,
+                            ):
+                                if self.visibility_timeout is not None and not hasattr(tile, "job"):
+                                    # Stop extending the visibility of a tile that leaves the pipeline
+                                    # without being deleted, it is received again after the timeout
+                                    weakref.finalize(tile, self._forget_in_flight, sqs_message.message_id)
+                                yield tile
+                        except Exception:  # pylint: disable=broad-except
+                            _LOGGER.warning("Failed decoding the SQS message", exc_info=True)
+                            with self._lock:
+                                self._in_flight.pop(sqs_message.message_id, None)
+                            sqs_message.delete()
+        finally:
+            stopping.set()
+            if pending:
+                # The iteration stopped in the middle of a batch
+                self._release(pending)
+            if receivers is not None:
+                self._release(receivers.stop())
+            self.flush()
 
     def delete_one(self, tile: Tile) -> Tile:
         assert hasattr(tile, "sqs_message")
-        tile.sqs_message.delete()
+        if hasattr(tile, "job"):
+            self._jobs.done(tile)
+        else:
+            with self._lock:
+                self._to_delete.append((getattr(tile, "priority", 0), tile.sqs_message))
+        self._maybe_flush()
         delattr(tile, "sqs_message")
         return tile
 
+    def _complete_jobs(self) -> None:
+        """Requeue the failed tiles of the completed jobs, or drop them, and delete the jobs."""
+        for job, failed, delivery in self._jobs.completed():
+            if failed:
+                if job.attempt < self.max_retries:
+                    _LOGGER.info("Requeue %d failed tiles of %r", len(failed), job)
+                    self.put_jobs(job.retry(failed))
+                else:
+                    _LOGGER.error(
+                        "Drop %d failed tiles of %r after %d attempts: %s",
+                        len(failed),
+                        job,
+                        job.attempt + 1,
+                        ", ".join(str(tilecoord) for tilecoord in failed),
+                    )
+            with self._lock:
+                self._to_delete.append((delivery["priority"], delivery["sqs_message"]))
+
+    def _maybe_flush(self) -> None:
+        self._complete_jobs()
+        with self._lock:
+            flush = (
+                len(self._to_delete) >= self.delete_batch_size
+                or time.monotonic() - self._delete_time >= self.delete_interval
+            )
+        if flush:
+            self.flush()
+
+    def _batches(
+        self, sqs_messages: Iterable[tuple[int, Any]]
+    ) -> Iterator[tuple["botocore.client.SQS", builtins.list[Any]]]:
+        """Group the messages by queue, in batches of at most 10 messages."""
+        lanes: dict[int, builtins.list[Any]] = {}
+        for lane, sqs_message in sqs_messages:
+            lanes.setdefault(lane, []).append(sqs_message)
+        for lane, lane_messages in sorted(lanes.items()):
+            for start in range(0, len(lane_messages), _BATCH_SIZE):
+                yield self.queues[lane], lane_messages[start : start + _BATCH_SIZE]
+
+    def flush(self) -> None:
+        """Delete the deleted tiles from the queues."""
+        self._complete_jobs()
+        with self._lock:
+            to_delete, self._to_delete = self._to_delete, []
+            self._delete_time = time.monotonic()
+            for _, sqs_message in to_delete:
+                self._in_flight.pop(sqs_message.message_id, None)
+        for queue, sqs_messages in self._batches(to_delete):
+            try:
+                response = queue.delete_messages(
+                    Entries=[
+                        {"Id": str(index), "ReceiptHandle": sqs_message.receipt_handle}
+                        for index, sqs_message in enumerate(sqs_messages)
+                    ]
+                )
+                for failed in response.get("Failed", []):
+                    _LOGGER.warning("Failed deleting SQS message: %s", failed["Message"])
+            except Exception:  # pylint: disable=broad-except
+                _LOGGER.warning("Failed deleting SQS messages", exc_info=True)
+
+    def _change_visibility(self, sqs_messages: Iterable[tuple[int, Any]], visibility_timeout: int) -> None:
+        for queue, batch in self._batches(sqs_messages):
+            try:
+                response = queue.change_message_visibility_batch(
+                    Entries=[
+                        {
+                            "Id": str(index),
+                            "ReceiptHandle": sqs_message.receipt_handle,
+                            "VisibilityTimeout": visibility_timeout,
+                        }
+                        for index, sqs_message in enumerate(batch)
+                    ]
+                )
+                for failed in response.get("Failed", []):
+                    _LOGGER.warning("Failed changing SQS message visibility: %s", failed["Message"])
+            except Exception:  # pylint: disable=broad-except
+                _LOGGER.warning("Failed changing SQS messages visibility", exc_info=True)
+
+    def _forget_in_flight(self, message_id: str) -> None:
+        with self._lock:
+            self._in_flight.pop(message_id, None)
+
+    def _release(self, sqs_messages: Iterable[tuple[int, Any]]) -> None:
+        """Make the received but not processed messages visible again to the other consumers."""
+        sqs_messages = builtins.list(sqs_messages)
+        with self._lock:
+            for _, sqs_message in sqs_messages:
+                self._in_flight.pop(sqs_message.message_id, None)
+        self._change_visibility(sqs_messages, 0)
+
+    def _extend_visibility(self, stopping: threading.Event) -> None:
+        assert self.visibility_timeout is not None
+        while not stopping.wait(self.visibility_timeout / 4):
+            now = time.monotonic()
+            visible_time = now + self.visibility_timeout
+            to_extend = []
+            with self._lock:
+                for message_id, (lane, sqs_message, message_visible_time) in self._in_flight.items():
+                    if message_visible_time - now < self.visibility_timeout / 2:
+                        to_extend.append((lane, sqs_message))
+                        self._in_flight[message_id] = (lane, sqs_message, visible_time)
+            if to_extend:
+                _LOGGER.debug("Extend the visibility of %d SQS messages", len(to_extend))
+                self._change_visibility(to_extend, self.visibility_timeout)
+
+    def _message(self, body: str) -> dict[str, str]:
+        if not self.deduplicate:
+            return {"MessageBody": body}
+        deduplication_id = hashlib.sha256(body.encode("utf-8")).hexdigest()
+        return {
+            "MessageBody": body,
+            "MessageDeduplicationId": deduplication_id,
+            "MessageGroupId": deduplication_id,
+        }
+
+    def _encode(self, tile: Tile) -> str:
+        if self.binary_messages:
+            return base64.b64encode(encode_binary_message(tile)).decode("ascii")
+        return encode_message(tile)
+
+    def _encode_job(self, job: Job) -> str:
+        if self.binary_messages:
+            return base64.b64encode(encode_binary_job_message(job)).decode("ascii")
+        return encode_job_message(job)
+
     def put_one(self, tile: Tile) -> Tile:
-        sqs_message = encode_message(tile)
+        sqs_message = self._encode(tile)
 
         try:
-            self.queue.send_message(MessageBody=sqs_message)
+            self._queue(tile).send_message(**self._message(sqs_message))
         except Exception as exception:  # pylint: disable=broad-except
             _LOGGER.warning("Failed sending SQS message", exc_info=True)
             tile.error = exception
@@ -97,12 +490,42 @@ class SQSTileStore(TileStore):
             if len(buffered_tiles) > 0:
                 self._send_buffer(buffered_tiles)
 
+    def put_jobs(self, jobs: Iterable[Job]) -> int:
+        """Send job messages, each of them is expanded into tiles by :meth:`list`."""
+        count = 0
+        entries: dict[int, list[dict[str, Any]]] = {}
+        for job in jobs:
+            queue = self._queue(job)
+            lane_entries = entries.setdefault(id(queue), [])
+            lane_entries.append({"Id": str(len(lane_entries)), **self._message(self._encode_job(job))})
+            count += 1
+            if len(lane_entries) >= _BATCH_SIZE:
+                self._send_entries(queue, lane_entries)
+                del entries[id(queue)]
+        for queue in self.queues:
+            if entries.get(id(queue)):
+                self._send_entries(queue, entries[id(queue)])
+        return count
+
+    def _send_entries(self, queue: "botocore.client.SQS", entries: builtins.list[dict[str, Any]]) -> None:
+        response = queue.send_messages(Entries=entries)
+        for failed in response.get("Failed", []):
+            raise RuntimeError(f"Failed sending SQS message: {failed['Message']}")
+
     def _send_buffer(self, tiles: builtins.list[Tile]) -> None:
+        lanes: dict[int, builtins.list[Tile]] = {}
+        for tile in tiles:
+            lanes.setdefault(id(self._queue(tile)), []).append(tile)
+        for queue in self.queues:
+            if id(queue) in lanes:
+                self._send_lane_buffer(queue, lanes[id(queue)])
+
+    def _send_lane_buffer(self, queue: "botocore.client.SQS", tiles: builtins.list[Tile]) -> None:
         try:
             messages: list[dict[str, Any]] = [
-                {"Id": str(i), "MessageBody": encode_message(tile)} for i, tile in enumerate(tiles)
+                {"Id": str(i), **self._message(self._encode(tile))} for i, tile in enumerate(tiles)
             ]
-            response = self.queue.send_messages(Entries=messages)
+            response = queue.send_messages(Entries=messages)
             for failed in response.get("Failed", []):
                 _LOGGER.warning("Failed sending SQS message: %s", failed["Message"])
                 pos = int(failed["Id"])
@@ -113,15 +536,30 @@ class SQSTileStore(TileStore):
                 tile.error = exception
 
     def get_status(self) -> dict[str, str]:
-        """Return a map of stats."""
-        self.queue.load()
+        """Return a map of stats, the numbers of messages are summed over the priority lanes."""
+        nb_messages = 0
+        nb_not_visible = 0
+        lanes = {}
+        for lane, queue in enumerate(self.queues):
+            queue.load()
+            lane_messages = int(queue.attributes["ApproximateNumberOfMessages"])
+            lane_not_visible = int(queue.attributes["ApproximateNumberOfMessagesNotVisible"])
+            if _NB_MESSAGE_GAUGE is not None and _NOT_VISIBLE_GAUGE is not None:
+                _NB_MESSAGE_GAUGE.labels(queue.url, str(lane)).set(lane_messages)
+                _NOT_VISIBLE_GAUGE.labels(queue.url, str(lane)).set(lane_not_visible)
+            nb_messages += lane_messages
+            nb_not_visible += lane_not_visible
+            if len(self.queues) > 1:
+                lanes[f"Approximate number of tiles to generate in lane {lane}"] = str(lane_messages)
+                lanes[f"Approximate number of generating tiles in lane {lane}"] = str(lane_not_visible)
         attributes = dict(self.queue.attributes)
         return {
-            "Approximate number of tiles to generate": attributes["ApproximateNumberOfMessages"],
-            "Approximate number of generating tiles": attributes["ApproximateNumberOfMessagesNotVisible"],
+            "Approximate number of tiles to generate": str(nb_messages),
+            "Approximate number of generating tiles": str(nb_not_visible),
             "Delay in seconds": attributes["DelaySeconds"],
             "Receive message wait time in seconds": attributes["ReceiveMessageWaitTimeSeconds"],
             "Visibility timeout in seconds": attributes["VisibilityTimeout"],
             "Queue creation date": time.ctime(int(attributes["CreatedTimestamp"])),
             "Last modification in tile queue": time.ctime(int(attributes["LastModifiedTimestamp"])),
+            **lanes,
         }
@@ -1,37 +1,80 @@
 import logging
-from collections.abc import Iterable
+import time
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any
 
 import requests
 
 from tilecloud import NotSupportedOperation, Tile, TileLayout, TileStore
+from tilecloud.lib.concurrent_ import imap
+from tilecloud.lib.hostselector import ConsistentHashHostSelector, HostSelector
 
 _LOGGER = logging.getLogger(__name__)
 
 
 class URLTileStore(TileStore):
-    """A tile store that reads and writes tiles from a formatted URL."""
+    """
+    A tile store that reads and writes tiles from a formatted URL.
+
+        tilelayouts:
+        The tile layouts, one per host.
+
+        host_selector:
+        The :class:`tilecloud.lib.hostselector.HostSelector` used to choose the host of each tile,
+        default is a :class:`tilecloud.lib.hostselector.ConsistentHashHostSelector`.
+
+        max_workers:
+        The number of tiles fetched in parallel by :meth:`get`, default is 1.
+    """
 
     def __init__(
         self,
         tilelayouts: Iterable[TileLayout],
         headers: Any | None = None,
         allows_no_contenttype: bool = False,
+        host_selector: HostSelector | None = None,
+        max_workers: int = 1,
         **kwargs: Any,
     ) -> None:
         TileStore.__init__(self, **kwargs)
         self.allows_no_contenttype = allows_no_contenttype
         self.tilelayouts = tuple(tilelayouts)
+        self.host_selector = host_selector or ConsistentHashHostSelector(len(self.tilelayouts))
+        assert len(self.host_selector.hosts) == len(self.tilelayouts)
+        self.max_workers = max_workers
         self.session = requests.session()
         if headers is not None:
             self.session.headers.update(headers)
 
+    def get(self, tiles: Iterable[Tile | None]) -> Iterator[Tile | None]:
+        if self.max_workers <= 1:
+            yield from TileStore.get(self, tiles)
+            return
+        with ThreadPoolExecutor(self.max_workers) as executor:
+            yield from imap(executor, self.get_one, filter(None, tiles), 2 * self.max_workers)
+
     def get_one(self, tile: Tile) -> Tile | None:
         if tile is None:
             return None
         if self.bounding_pyramid is not None and tile.tilecoord not in self.bounding_pyramid:
             return None
-        tilelayout = self.tilelayouts[hash(tile.tilecoord) % len(self.tilelayouts)]
+        index = self.host_selector.acquire(tile.tilecoord)
+        start = time.perf_counter()
+        success = False
+        try:
+            result = self._get_one(tile, self.tilelayouts[index])
+            status_code = getattr(tile, "status_code", 0)
+            success = (
+                not isinstance(tile.error, requests.exceptions.RequestException)
+                and status_code < 500
+                and status_code != 429
+            )
+            return result
+        finally:
+            self.host_selector.release(index, time.perf_counter() - start, success)
+
+    def _get_one(self, tile: Tile, tilelayout: TileLayout) -> Tile | None:
         try:
             url = tilelayout.filename(tile.tilecoord, tile.metadata)
         except Exception as exception:  # pylint: disable=broad-except
@@ -42,6 +85,7 @@ class URLTileStore(TileStore):
         _LOGGER.info("GET %s", url)
         try:
             response = self.session.get(url)
+            tile.status_code = response.status_code
             if response.status_code in (404, 204):
                 _LOGGER.debug("Got empty tile from %s: %s", url, response.status_code)
                 return None
@@ -1,8 +1,24 @@
 import logging
 import sys
+from typing import Any
+
+from tilecloud import Tile
+from tilecloud.store.dict import DictTileStore
 
 logging.basicConfig(
     level=logging.DEBUG,
     format="TEST       | %(asctime)-15s %(levelname)5s %(name)s %(message)s",
     stream=sys.stdout,
 )
+
+
+class CountingTileStore(DictTileStore):
+    """A dict tile store that counts the calls of ``get_one`` in ``calls``."""
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.calls = 0
+
+    def get_one(self, tile: Tile) -> Tile | None:
+        self.calls += 1
+        return super().get_one(tile)
@@ -0,0 +1,51 @@
+import json
+import time
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+
+from tilecloud import Tile, TileCoord
+from tilecloud.filter.benchmark import LogHistogram, Profiler
+
+
+def test_histogram() -> None:
+    histogram = LogHistogram()
+    assert histogram.percentile(50) is None
+    for value in range(1, 101):
+        histogram.add(value / 1000)
+    assert abs(histogram.percentile(50) - 0.050) < 0.001
+    assert abs(histogram.percentile(99) - 0.099) < 0.002
+
+
+def test_profiler(tmp_path: Path) -> None:
+    def slow(tiles: Iterable[Tile | None]) -> Iterator[Tile | None]:
+        for tile in tiles:
+            time.sleep(0.01)
+            yield tile
+
+    def source() -> Iterator[Tile]:
+        for y in range(5):
+            time.sleep(0.002)
+            yield Tile(TileCoord(0, 0, y), data=b"1234")
+
+    profiler = Profiler()
+    tilestream = profiler.stage("slow", source(), slow)
+    tilestream = profiler.map("fast", lambda tile: tile, tilestream)
+    assert len(list(tilestream)) == 5
+
+    slow_statistics = profiler.statistics["slow"]
+    fast_statistics = profiler.statistics["fast"]
+    assert slow_statistics.count == 5
+    assert slow_statistics.bytes == 20
+    # Only the lower bounds and the ordering, a loaded machine can be slower
+    assert slow_statistics.wall >= 0.05
+    assert slow_statistics.wait >= 0.01
+    # The time spent upstream is not counted in the stage, but in its wait
+    assert fast_statistics.wall < slow_statistics.wall
+    assert fast_statistics.wait >= slow_statistics.wall
+
+    filename = tmp_path / "profile.json"
+    profiler.dump(str(filename))
+    with open(filename, encoding="utf-8") as file:
+        stages = json.load(file)
+    assert [stage["stage"] for stage in stages] == ["slow", "fast"]
+    assert stages[0]["p50"] >= 0.01
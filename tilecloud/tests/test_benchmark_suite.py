@@ -0,0 +1,31 @@
+from tilecloud import TileCoord
+from tilecloud.lib.benchmark import SCENARIOS, compare, regressions, run, synthetic_png, synthetic_tiles
+
+
+def test_synthetic_tiles_reproducible() -> None:
+    assert synthetic_png(1, 16) == synthetic_png(1, 16)
+    assert synthetic_png(1, 16) != synthetic_png(2, 16)
+    tilecoords = [TileCoord(5, x, 3) for x in range(8)]
+    first = [tile.data for tile in synthetic_tiles(iter(tilecoords), size=16)]
+    second = [tile.data for tile in synthetic_tiles(iter(tilecoords), size=16)]
+    assert first == second
+
+
+def test_run_all_scenarios() -> None:
+    results = run(scale=0.0005, repeat=1)
+    assert set(results) == set(SCENARIOS)
+    for result in results.values():
+        assert result["count"] >= 1
+        assert result["items_per_second"] > 0
+
+
+def test_compare() -> None:
+    baseline = {"a": {"items_per_second": 100.0}, "b": {"items_per_second": 100.0}}
+    results = {
+        "a": {"items_per_second": 80.0},
+        "b": {"items_per_second": 95.0},
+        "c": {"items_per_second": 1.0},
+    }
+    changes = compare(results, baseline)
+    assert set(changes) == {"a", "b"}
+    assert regressions(changes, 0.1) == ["a"]
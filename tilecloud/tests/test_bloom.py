@@ -0,0 +1,72 @@
+from pathlib import Path
+
+from tilecloud import Tile, TileCoord
+from tilecloud.lib.bloom import BloomFilter, CountingBloomFilter
+from tilecloud.store.bloom import BloomFilterTileStore
+from tilecloud.tests import CountingTileStore
+
+
+def test_bloom_filter() -> None:
+    bloom_filter = BloomFilter(1000, 0.01)
+    for index in range(1000):
+        bloom_filter.add(f"key-{index}")
+    assert all(f"key-{index}" in bloom_filter for index in range(1000))
+    false_positives = sum(f"other-{index}" in bloom_filter for index in range(10000))
+    assert false_positives < 300
+    assert 0.005 < bloom_filter.error_rate() < 0.02
+
+
+def test_counting_bloom_filter(tmp_path: Path) -> None:
+    bloom_filter = CountingBloomFilter(100, 0.01)
+    bloom_filter.add("a")
+    bloom_filter.add("b")
+    bloom_filter.remove("a")
+    assert "a" not in bloom_filter
+    assert "b" in bloom_filter
+    assert len(bloom_filter) == 1
+
+    filename = str(tmp_path / "filter.bloom")
+    bloom_filter.save(filename)
+    loaded = BloomFilter.load(filename)
+    assert isinstance(loaded, CountingBloomFilter)
+    assert "b" in loaded
+    assert "a" not in loaded
+    assert len(loaded) == 1
+
+
+def test_bloom_filter_tilestore() -> None:
+    tilestore = CountingTileStore({TileCoord(5, x, 0): {"data": b"data"} for x in range(10)})
+    bloom_tilestore = BloomFilterTileStore(tilestore, CountingBloomFilter(100))
+    bloom_tilestore.populate()
+    assert bloom_tilestore.get_one(Tile(TileCoord(5, 3, 0))).data == b"data"
+    assert bloom_tilestore.get_one(Tile(TileCoord(6, 3, 0))) is None
+    assert Tile(TileCoord(5, 3, 0)) in bloom_tilestore
+    assert tilestore.calls == 1
+    assert bloom_tilestore.misses == 1
+
+    bloom_tilestore.put_one(Tile(TileCoord(6, 3, 0), data=b"new"))
+    assert bloom_tilestore.get_one(Tile(TileCoord(6, 3, 0))).data == b"new"
+    bloom_tilestore.delete_one(Tile(TileCoord(6, 3, 0)))
+    assert Tile(TileCoord(6, 3, 0)) not in bloom_tilestore
+
+
+class _S3LikeTileStore(CountingTileStore):
+    """Like S3, the deletion of a missing tile succeeds."""
+
+    def delete_one(self, tile: Tile) -> Tile:
+        self.tiles.pop(tile.tilecoord, None)
+        return tile
+
+
+def test_bloom_filter_tilestore_delete_missing() -> None:
+    bloom_tilestore = BloomFilterTileStore(_S3LikeTileStore({}), CountingBloomFilter(100))
+    # A false positive
+    bloom_tilestore.bloom_filter.add(str(TileCoord(7, 0, 0)))
+    bloom_tilestore.delete_one(Tile(TileCoord(7, 0, 0)))
+    assert len(bloom_tilestore.bloom_filter) == 1
+    assert str(TileCoord(7, 0, 0)) in bloom_tilestore.bloom_filter
+
+    bloom_tilestore.put_one(Tile(TileCoord(7, 1, 0), data=b"data"))
+    bloom_tilestore.delete_one(Tile(TileCoord(7, 1, 0)))
+    assert len(bloom_tilestore.bloom_filter) == 1
+    assert str(TileCoord(7, 1, 0)) not in bloom_tilestore.bloom_filter
@@ -0,0 +1,82 @@
+import json
+from pathlib import Path
+
+from tilecloud import BoundingPyramid, Bounds, Tile
+from tilecloud.filter.checkpoint import Checkpoint
+from tilecloud.store.boundingpyramid import BoundingPyramidTileStore
+
+
+def _tiles() -> list[Tile]:
+    return list(BoundingPyramidTileStore(BoundingPyramid({5: (Bounds(0, 4), Bounds(0, 4))})).list())
+
+
+def test_out_of_order(tmp_path: Path) -> None:
+    checkpoint = Checkpoint(str(tmp_path / "checkpoint.json"), "job")
+    tiles = list(checkpoint.resume(_tiles()))
+    assert [tile.checkpoint_index for tile in tiles] == list(range(16))
+    for index in (1, 2, 0, 5, 6, 4):
+        checkpoint(tiles[index])
+    assert checkpoint.watermark == 3
+    assert checkpoint.done == {4, 5, 6}
+    checkpoint(tiles[3])
+    assert checkpoint.watermark == 7
+    assert checkpoint.done == set()
+
+
+def test_resume(tmp_path: Path) -> None:
+    filename = str(tmp_path / "checkpoint.json")
+    checkpoint = Checkpoint(filename, "job")
+    tiles = list(checkpoint.resume(_tiles()))
+    for index in (0, 1, 2, 5, 6, 7, 10):
+        checkpoint(tiles[index])
+    checkpoint.save()
+    with open(filename, encoding="utf-8") as file:
+        assert json.load(file)["jobs"]["job"] == {"watermark": 3, "done": [[5, 8], [10, 11]]}
+
+    resumed = Checkpoint(filename, "job")
+    tilecoords = [tile.tilecoord for tile in resumed.resume(_tiles())]
+    assert tilecoords == [tiles[index].tilecoord for index in (3, 4, 8, 9, 11, 12, 13, 14, 15)]
+
+    assert list(Checkpoint(filename, "other").resume(_tiles())) == _tiles()
+    assert len(list(Checkpoint(filename, "job", resume=False).resume(_tiles()))) == 16
+
+
+def test_dropped(tmp_path: Path) -> None:
+    filename = str(tmp_path / "checkpoint.json")
+    checkpoint = Checkpoint(filename, "job")
+    tiles = checkpoint.resume(_tiles())
+    for tile in tiles:
+        # Missing in the source or dropped on error, except the last ones in progress
+        if tile.checkpoint_index < 8 and tile.checkpoint_index != 2:
+            continue
+        checkpoint(tile)
+        if tile.checkpoint_index == 12:
+            break
+    in_progress = list(tiles)
+    assert checkpoint.watermark == 13
+    assert checkpoint.done == set()
+
+    checkpoint.close()
+    del in_progress
+    assert checkpoint.watermark == 13
+    with open(filename, encoding="utf-8") as file:
+        assert json.load(file)["jobs"]["job"] == {"watermark": 13, "done": []}
+
+
+def test_errors(tmp_path: Path) -> None:
+    checkpoint = Checkpoint(str(tmp_path / "checkpoint.json"), "job")
+    for tile in checkpoint.resume(_tiles()):
+        if tile.checkpoint_index == 1:
+            # Dropped on error, e.g. by DropErrors
+            tile.error = "503 Service Unavailable"
+            continue
+        if tile.checkpoint_index == 3:
+            tile.error = "error"
+        checkpoint(tile)
+    del tile
+    assert checkpoint.watermark == 1
+    assert checkpoint.done == {2, *range(4, 16)}
+    checkpoint.close()
+
+    resumed = Checkpoint(str(tmp_path / "checkpoint.json"), "job")
+    assert [tile.checkpoint_index for tile in resumed.resume(_tiles())] == [1, 3]
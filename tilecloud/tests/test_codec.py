@@ -0,0 +1,70 @@
+import gzip
+
+import pytest
+
+from tilecloud import Tile, TileCoord, TileStore
+from tilecloud.filter.codec import Compressor, Decompressor, negotiate, train_zstd_dictionary
+from tilecloud.filter.gzip_ import GzipCompressor, GzipDecompressor
+from tilecloud.layout.template import TemplateTileLayout
+from tilecloud.store.s3 import S3TileStore
+
+DATA = b'{"type": "FeatureCollection", "features": []}' * 100
+
+
+@pytest.mark.parametrize(
+    ("encoding", "module"), [("gzip", None), ("deflate", None), ("br", "brotli"), ("zstd", "zstandard")]
+)
+def test_round_trip(encoding: str, module: str | None) -> None:
+    if module is not None:
+        pytest.importorskip(module)
+    tile = Compressor([encoding])(Tile(TileCoord(0, 0, 0), data=DATA))
+    assert tile.content_encoding == encoding
+    assert len(tile.data) < len(DATA)
+    tile = Decompressor()(tile)
+    assert tile.content_encoding is None
+    assert tile.data == DATA
+
+
+def test_gzip_compatibility() -> None:
+    tile = GzipCompressor()(Tile(TileCoord(0, 0, 0), data=DATA))
+    assert gzip.decompress(tile.data) == DATA
+    tile = GzipDecompressor()(Tile(TileCoord(0, 0, 0), data=gzip.compress(DATA), content_encoding="gzip"))
+    assert tile.data == DATA
+
+
+def test_negotiate() -> None:
+    assert negotiate(["unknown", "deflate", "gzip"]) == "deflate"
+    assert negotiate(["deflate", "gzip"], TileStore(accept_encodings=["gzip"])) == "gzip"
+    with pytest.raises(ValueError, match="No supported content encoding"):
+        negotiate(["deflate"], TileStore(accept_encodings=["gzip"]))
+
+
+def test_zstd_dictionary() -> None:
+    pytest.importorskip("zstandard")
+    samples = [
+        f'{{"id": {index}, "type": "Feature", "name": "feature {index}"}}'.encode() for index in range(1000)
+    ]
+    dictionary = train_zstd_dictionary(samples, 1024)
+    tile = Compressor(["zstd"], dictionary=dictionary)(Tile(TileCoord(0, 0, 0), data=samples[0]))
+    assert tile.content_encoding == "zstd"
+    tile = Decompressor(zstd={"dictionary": dictionary})(tile)
+    assert tile.data == samples[0]
+
+
+def test_negotiate_s3() -> None:
+    tilestore = S3TileStore("bucket", TemplateTileLayout("%(z)d/%(x)d/%(y)d"), accept_encodings=["gzip"])
+    assert negotiate(["br", "deflate", "gzip"], tilestore) == "gzip"
+    tile = tilestore.put_one(Tile(TileCoord(0, 0, 0), data=DATA, content_encoding="deflate"))
+    assert tile.error == "Content encoding not accepted by the bucket: deflate"
+
+
+def test_adaptive_level() -> None:
+    compressor = Compressor(["gzip"], level=9, cpu_budget=0, min_samples=5)
+    for _ in range(4):
+        compressor(Tile(TileCoord(0, 0, 0), data=DATA))
+    assert compressor.level == 9
+    compressor(Tile(TileCoord(0, 0, 0), data=DATA))
+    assert compressor.level == 8
+    for _ in range(7 * 5):
+        compressor(Tile(TileCoord(0, 0, 0), data=DATA))
+    assert compressor.level == 1
@@ -0,0 +1,54 @@
+import gzip
+
+import pytest
+
+from tilecloud import Tile, TileCoord
+from tilecloud.filter.contenttype import ContentTypeAdder
+
+
+@pytest.mark.parametrize(
+    ("data", "content_type"),
+    [
+        (b"\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR", "image/png"),
+        (b"\xff\xd8\xff\xe0\x00\x10JFIF", "image/jpeg"),
+        (b"RIFF\x00\x00\x00\x00WEBPVP8 ", "image/webp"),
+        (b"GIF89a\x01\x00\x01\x00", "image/gif"),
+        (b'{"grid": []}', "application/json"),
+        (b'\n  [{"id": 1}]', "application/json"),
+        (b"\x1a\x1e\x78\x02\x0a\x05water", "application/vnd.mapbox-vector-tile"),
+        (b"\x1a\x96\x01\x0a\x05water", "application/vnd.mapbox-vector-tile"),
+        (b"\x1a\x1e\x0f\x00\x00\x00\x02", None),
+        (b"\x1a", None),
+        (b"unknown", None),
+    ],
+)
+def test_sniff(data: bytes, content_type: str | None) -> None:
+    tile = ContentTypeAdder()(Tile(TileCoord(0, 0, 0), data=data))
+    assert tile.content_type == content_type
+    assert tile.content_encoding is None
+
+
+def test_gzip() -> None:
+    tile = ContentTypeAdder()(Tile(TileCoord(0, 0, 0), data=gzip.compress(b'{"grid": []}' * 1000)))
+    assert tile.content_type == "application/json"
+    assert tile.content_encoding == "gzip"
+
+
+def test_forced() -> None:
+    tile = ContentTypeAdder("image/png")(Tile(TileCoord(0, 0, 0), data=b"{}"))
+    assert tile.content_type == "image/png"
+
+
+def test_single_type() -> None:
+    content_type_adder = ContentTypeAdder(single_type=True)
+    content_type_adder(Tile(TileCoord(0, 0, 0), data=b"{}"))
+    tile = content_type_adder(Tile(TileCoord(0, 0, 0), data=b"\x89PNG\r\n\x1a\n"))
+    assert tile.content_type == "application/json"
+
+
+def test_single_type_gzip() -> None:
+    content_type_adder = ContentTypeAdder(single_type=True)
+    for _ in range(2):
+        tile = content_type_adder(Tile(TileCoord(0, 0, 0), data=gzip.compress(b'{"grid": []}')))
+        assert tile.content_type == "application/json"
+        assert tile.content_encoding == "gzip"
@@ -0,0 +1,46 @@
+from tilecloud import BoundingPyramid, Tile, TileCoord
+from tilecloud.lib.existence import ExistenceIndex
+from tilecloud.store.dict import DictTileStore
+
+
+def test_existence_index() -> None:
+    bounding_pyramid = BoundingPyramid.from_string("3/2/1:5/7")
+    bounding_pyramid.add(TileCoord(4, 10, 3))
+    tilestore = DictTileStore(
+        {
+            TileCoord(3, 2, 1): {},
+            TileCoord(3, 4, 6): {},
+            TileCoord(4, 10, 3): {},
+            # Outside the bounding pyramid
+            TileCoord(3, 0, 0): {},
+            TileCoord(5, 1, 1): {},
+        }
+    )
+    index = ExistenceIndex.from_tilestore(tilestore, bounding_pyramid)
+    assert index.size == 3 * 6 + 1
+    assert len(index) == 3
+    for tilecoord in bounding_pyramid:
+        assert (Tile(tilecoord) in index) == (tilecoord in tilestore.tiles)
+    assert Tile(TileCoord(3, 0, 0)) not in index
+    assert Tile(TileCoord(5, 1, 1)) not in index
+
+
+def test_existence_index_set() -> None:
+    # The world up to the level 18 would need a bitmap of about 11 GB
+    bounding_pyramid = BoundingPyramid.full(0, 18)
+    index = ExistenceIndex(bounding_pyramid)
+    assert index._bitmap is None  # noqa: SLF001
+    index.add(TileCoord(18, 1000, 2000))
+    index.add(TileCoord(0, 0, 0))
+    index.add(TileCoord(19, 0, 0))
+    assert len(index) == 2
+    assert Tile(TileCoord(18, 1000, 2000)) in index
+    assert Tile(TileCoord(0, 0, 0)) in index
+    assert Tile(TileCoord(18, 1000, 2001)) not in index
+    assert Tile(TileCoord(19, 0, 0)) not in index
+
+    small = ExistenceIndex(BoundingPyramid.from_string("3/2/1:5/7"), max_bitmap_size=2)
+    assert small._bitmap is None  # noqa: SLF001
+    small.add(TileCoord(3, 4, 6))
+    assert Tile(TileCoord(3, 4, 6)) in small
+    assert len(small) == 1
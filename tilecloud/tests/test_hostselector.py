@@ -0,0 +1,76 @@
+import collections
+
+from tilecloud import TileCoord
+from tilecloud.lib.hostselector import (
+    ConsistentHashHostSelector,
+    EWMALatencyHostSelector,
+    LeastOutstandingHostSelector,
+)
+
+
+def test_consistent_hash_distribution() -> None:
+    selector = ConsistentHashHostSelector(4)
+    counter: collections.Counter[int] = collections.Counter()
+    for x in range(64):
+        for y in range(64):
+            index = selector.acquire(TileCoord(6, x, y))
+            selector.release(index, 0.1, True)
+            counter[index] += 1
+    assert len(counter) == 4
+    assert min(counter.values()) > 0.8 * 64 * 64 / 4
+
+
+def test_consistent_hash_stable() -> None:
+    selector = ConsistentHashHostSelector(3)
+    index = selector.acquire(TileCoord(5, 3, 7))
+    selector.release(index, 0.1, True)
+    assert selector.acquire(TileCoord(5, 3, 7)) == index
+
+
+def test_circuit_breaker() -> None:
+    selector = ConsistentHashHostSelector(2, failure_threshold=2, recovery_timeout=3600)
+    tilecoord = TileCoord(5, 3, 7)
+    index = selector.acquire(tilecoord)
+    selector.release(index, 0.1, False)
+    assert selector.acquire(tilecoord) == index
+    selector.release(index, 0.1, False)
+    # The circuit is open, the other host is used
+    other = selector.acquire(tilecoord)
+    assert other != index
+    selector.release(other, 0.1, True)
+
+
+def test_circuit_breaker_half_open() -> None:
+    selector = ConsistentHashHostSelector(2, failure_threshold=1, recovery_timeout=0)
+    tilecoord = TileCoord(5, 3, 7)
+    index = selector.acquire(tilecoord)
+    selector.release(index, 0.1, False)
+    # Only one probe request is sent to the failing host
+    assert selector.acquire(tilecoord) == index
+    assert selector.acquire(tilecoord) != index
+    selector.release(index, 0.1, True)
+    assert selector.acquire(tilecoord) == index
+
+
+def test_least_outstanding() -> None:
+    selector = LeastOutstandingHostSelector(3)
+    indexes = {selector.acquire(TileCoord(0, 0, 0)) for _ in range(3)}
+    assert indexes == {0, 1, 2}
+
+
+def test_max_concurrency() -> None:
+    selector = LeastOutstandingHostSelector(2, max_concurrency=1)
+    first = selector.acquire(TileCoord(0, 0, 0))
+    second = selector.acquire(TileCoord(0, 0, 0))
+    assert {first, second} == {0, 1}
+    assert all(host.outstanding == 1 for host in selector.hosts)
+
+
+def test_ewma_latency() -> None:
+    selector = EWMALatencyHostSelector(2)
+    first = selector.acquire(TileCoord(0, 0, 0))
+    selector.release(first, 1.0 if first == 0 else 0.1, True)
+    second = selector.acquire(TileCoord(0, 0, 0))
+    assert second != first
+    selector.release(second, 1.0 if second == 0 else 0.1, True)
+    assert selector.acquire(TileCoord(0, 0, 0)) == 1
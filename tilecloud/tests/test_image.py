@@ -0,0 +1,110 @@
+import sqlite3
+from io import BytesIO
+
+import PIL.ImageFilter
+from PIL import Image
+
+from tilecloud import Tile, TileCoord
+from tilecloud.filter.image import CompositeFilter, ImageFormatConverter, MarkUniform, PILImageFilter
+from tilecloud.lib.PIL_ import encode, find_uniform, get_uniform
+from tilecloud.store.dict import DictTileStore
+from tilecloud.store.mbtiles import MBTilesTileStore
+from tilecloud.tests import CountingTileStore
+
+
+def _png(image: Image.Image) -> bytes:
+    bytes_io = BytesIO()
+    image.save(bytes_io, "PNG")
+    return bytes_io.getvalue()
+
+
+def test_get_uniform() -> None:
+    data = _png(Image.new("RGBA", (4, 4), (1, 2, 3, 4)))
+    assert find_uniform(data) is None
+    assert get_uniform(data) == ("RGBA", (4, 4), (1, 2, 3, 4))
+    # Now known from the encoded data
+    assert find_uniform(data) == ("RGBA", (4, 4), (1, 2, 3, 4))
+
+    image = Image.new("RGBA", (4, 4), (1, 2, 3, 4))
+    image.putpixel((1, 1), (0, 0, 0, 0))
+    assert get_uniform(_png(image)) is None
+
+
+def test_get_uniform_palette() -> None:
+    image = Image.new("RGB", (4, 4), (10, 20, 30)).convert("P", palette=Image.Palette.ADAPTIVE)
+    assert get_uniform(_png(image)) == ("RGB", (4, 4), (10, 20, 30))
+    image.putpixel((1, 1), image.palette.getcolor((0, 0, 0)))
+    assert get_uniform(_png(image)) is None
+
+    image = Image.new("RGBA", (4, 4), (0, 0, 0, 0)).convert("P")
+    data = encode(image, "PNG")
+    assert find_uniform(data) == ("RGBA", (4, 4), (0, 0, 0, 0))
+    assert Image.open(BytesIO(data)).convert("RGBA").getpixel((3, 3)) == (0, 0, 0, 0)
+
+
+def test_encode_uniform() -> None:
+    data = encode(Image.new("L", (4, 4), 7), "PNG")
+    assert data is encode(Image.new("L", (4, 4), 7), "PNG")
+    assert find_uniform(data) == ("L", (4, 4), 7)
+    assert Image.open(BytesIO(data)).getpixel((3, 3)) == 7
+
+
+def test_mark_uniform() -> None:
+    image = Image.new("RGB", (4, 4), (10, 20, 30))
+    tile = MarkUniform()(Tile(TileCoord(0, 0, 0), data=_png(image)))
+    assert tile.uniform == (10, 20, 30)
+    image.putpixel((0, 0), (0, 0, 0))
+    tile = MarkUniform()(Tile(TileCoord(0, 0, 0), data=_png(image)))
+    assert tile.uniform is None
+
+
+def test_format_converter_uniform() -> None:
+    data = _png(Image.new("RGB", (4, 4), (10, 20, 30)))
+    get_uniform(data)
+    tile = ImageFormatConverter("image/jpeg")(Tile(TileCoord(0, 0, 0), data=data, content_type="image/png"))
+    assert tile.content_type == "image/jpeg"
+    image = Image.open(BytesIO(tile.data))
+    assert image.format == "JPEG"
+    assert image.size == (4, 4)
+
+
+def test_pil_image_filter_uniform() -> None:
+    image = Image.new("L", (8, 8), 100)
+    expected = image.filter(PIL.ImageFilter.EMBOSS)
+    image_filter = PILImageFilter(PIL.ImageFilter.EMBOSS)
+    for _ in range(2):
+        tile = image_filter(Tile(TileCoord(0, 0, 0), data=_png(image), content_type="image/png"))
+        assert Image.open(BytesIO(tile.data)).tobytes() == expected.tobytes()
+
+
+def test_composite() -> None:
+    tilecoord = TileCoord(0, 0, 0)
+    half = Image.new("RGBA", (4, 4), (0, 0, 0, 0))
+    half.paste((255, 0, 0, 255), (0, 0, 2, 4))
+    red = CountingTileStore()
+    red.put_one(Tile(tilecoord, data=_png(half)))
+    transparent = DictTileStore()
+    transparent.put_one(Tile(tilecoord, data=_png(Image.new("RGBA", (4, 4), (0, 0, 0, 0)))))
+    composite = CompositeFilter([red, transparent, DictTileStore()], static_tilestores=[red], max_workers=2)
+    for _ in range(2):
+        tile = Tile(tilecoord, data=_png(Image.new("RGB", (4, 4), (0, 0, 255))), content_type="image/png")
+        tile = composite(tile)
+        image = Image.open(BytesIO(tile.data))
+        assert image.convert("RGB").getpixel((0, 0)) == (255, 0, 0)
+        assert image.convert("RGB").getpixel((3, 0)) == (0, 0, 255)
+    # The static layer is decoded once
+    assert red.calls == 1
+    composite.close()
+
+
+def test_composite_mbtiles() -> None:
+    # The SQLite connection can only be used in the thread that created it
+    tilecoord = TileCoord(0, 0, 0)
+    layer = MBTilesTileStore(sqlite3.connect(":memory:"))
+    layer.put_one(Tile(tilecoord, data=_png(Image.new("RGBA", (4, 4), (255, 0, 0, 255)))))
+    composite = CompositeFilter([layer])
+    tile = composite(
+        Tile(tilecoord, data=_png(Image.new("RGB", (4, 4), (0, 0, 255))), content_type="image/png")
+    )
+    assert Image.open(BytesIO(tile.data)).convert("RGB").getpixel((0, 0)) == (255, 0, 0)
+    composite.close()
@@ -0,0 +1,61 @@
+import importlib
+import importlib.util
+import multiprocessing
+import sys
+import types
+
+import pytest
+
+from tilecloud import Tile, TileCoord, TileStore
+from tilecloud.grid.free import FreeTileGrid
+
+
+@pytest.fixture
+def mapnik_pool_class(monkeypatch: pytest.MonkeyPatch) -> type[TileStore]:
+    if importlib.util.find_spec("mapnik2") is None and importlib.util.find_spec("mapnik") is None:
+        # Only the pool is tested, with a stub rendering, the stub module is removed after the test
+        monkeypatch.setitem(sys.modules, "mapnik", types.ModuleType("mapnik"))
+        monkeypatch.setitem(sys.modules, "tilecloud.store.mapnik_", None)
+        monkeypatch.delitem(sys.modules, "tilecloud.store.mapnik_")
+    return importlib.import_module("tilecloud.store.mapnik_").MapnikRenderingPoolTileStore
+
+
+class _StubRenderingTileStore(TileStore):
+    def __init__(self, tilegrid: FreeTileGrid, mapfile: str, **kwargs: str) -> None:
+        super().__init__()
+        self.mapfile = mapfile
+        self.kwargs = kwargs
+
+    def get_one(self, tile: Tile) -> Tile | None:
+        if tile.tilecoord.y == 1:
+            return None
+        if tile.tilecoord.y == 2:
+            raise ValueError("bad tile")
+        tile.data = f"{self.mapfile} {self.kwargs['layer']} {tile.tilecoord}".encode()
+        return tile
+
+
+def test_rendering_pool(mapnik_pool_class: type[TileStore]) -> None:
+    store = mapnik_pool_class(
+        FreeTileGrid((1000, 500)),
+        "map.xml",
+        processes=2,
+        ordered=True,
+        mp_context=multiprocessing.get_context("fork"),
+        layer="a",
+    )
+    store.tilestore_class = _StubRenderingTileStore
+    # Started lazily
+    assert store.executor is None
+    tiles = [Tile(TileCoord(1, 0, y)) for y in range(4)]
+    try:
+        results = list(store.get([tiles[0], None, *tiles[1:]]))
+    finally:
+        store.close()
+
+    # The same semantic as TileStore.get: the input None are skipped, a tile without data is None
+    assert results == [tiles[0], None, tiles[2], tiles[3]]
+    assert results[0].data == b"map.xml a 1/0/0"
+    assert results[2].error == "ValueError: bad tile"
+    assert results[3].data == b"map.xml a 1/0/3"
+    assert store.executor is None
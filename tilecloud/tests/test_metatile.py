@@ -1,11 +1,16 @@
+import sqlite3
+import threading
+import time
+from collections.abc import Iterator
 from io import BytesIO
 
 import pytest
 from PIL import Image
 
-from tilecloud import Tile, TileCoord
+from tilecloud import Tile, TileCoord, TileStore
 from tilecloud.lib.PIL_ import FORMAT_BY_CONTENT_TYPE
-from tilecloud.store.metatile import MetaTileSplitterTileStore
+from tilecloud.store.mbtiles import MBTilesTileStore
+from tilecloud.store.metatile import MetaTileAssemblerTileStore, MetaTileSplitterTileStore
 
 
 @pytest.mark.parametrize("mime_type", ["image/png"])
@@ -74,3 +79,240 @@ def test_split_border(mime_type: str) -> None:
     image = Image.open(BytesIO(tiles[3].data))
     assert image.size == (2, 2)
     assert image.getpixel((0, 0)) == (0, 0, 0, 255)
+
+
+def test_split_parallel() -> None:
+    """
+    Test splitting a metatile with not uniform tiles in parallel.
+    """
+    mtsts = MetaTileSplitterTileStore("image/png", tile_size=2, max_workers=4)
+    image = Image.new("RGBA", (4, 4))
+    for x in range(4):
+        for y in range(4):
+            image.putpixel((x, y), (x * 60, y * 60, 0, 255))
+    bytes_io = BytesIO()
+    image.save(bytes_io, "PNG")
+    tiles = list(mtsts.get([Tile(TileCoord(1, 0, 0, 2), data=bytes_io.getvalue())]))
+    assert [tile.tilecoord for tile in tiles] == list(TileCoord(1, 0, 0, 2))
+    for tile in tiles:
+        tile_image = Image.open(BytesIO(tile.data))
+        assert tile_image.size == (2, 2)
+        for x in range(2):
+            for y in range(2):
+                assert tile_image.getpixel((x, y)) == image.getpixel(
+                    (2 * tile.tilecoord.x + x, 2 * tile.tilecoord.y + y)
+                )
+    executor = mtsts._executor  # noqa: SLF001
+    assert executor is not None
+    mtsts.close()
+    assert executor._shutdown  # noqa: SLF001
+
+
+def test_split_uniform() -> None:
+    """
+    Test that the uniform tiles share the same encoded data.
+    """
+    mtsts = MetaTileSplitterTileStore("image/png", tile_size=2)
+    image = Image.new("RGBA", (4, 4), (0, 0, 0, 0))
+    image.putpixel((3, 3), (255, 0, 0, 255))
+    bytes_io = BytesIO()
+    image.save(bytes_io, "PNG")
+    tiles = list(mtsts.get([Tile(TileCoord(1, 0, 0, 2), data=bytes_io.getvalue())]))
+    assert len(tiles) == 4
+    assert tiles[0].data is tiles[1].data
+    assert tiles[0].data is tiles[2].data
+    assert tiles[3].data is not tiles[0].data
+    assert Image.open(BytesIO(tiles[0].data)).getpixel((1, 1)) == (0, 0, 0, 0)
+    assert Image.open(BytesIO(tiles[3].data)).getpixel((1, 1)) == (255, 0, 0, 255)
+
+
+def test_split_uniform_palette() -> None:
+    """
+    Test that the uniform tiles of a palette metatile share the same encoded data.
+    """
+    mtsts = MetaTileSplitterTileStore("image/png", tile_size=2)
+    image = Image.new("RGB", (4, 4), (10, 20, 30))
+    image.putpixel((3, 3), (255, 0, 0))
+    image = image.convert("P", palette=Image.Palette.ADAPTIVE)
+    bytes_io = BytesIO()
+    image.save(bytes_io, "PNG")
+    tiles = list(mtsts.get([Tile(TileCoord(1, 0, 0, 2), data=bytes_io.getvalue())]))
+    assert tiles[0].data is tiles[1].data
+    assert tiles[0].data is tiles[2].data
+    assert tiles[3].data is not tiles[0].data
+    assert Image.open(BytesIO(tiles[0].data)).convert("RGB").getpixel((1, 1)) == (10, 20, 30)
+    assert Image.open(BytesIO(tiles[3].data)).convert("RGB").getpixel((1, 1)) == (255, 0, 0)
+
+
+def test_split_error() -> None:
+    """
+    Test that the error of the metatile is propagated to the tiles.
+    """
+    mtsts = MetaTileSplitterTileStore("image/png", tile_size=2)
+    tiles = list(mtsts.get([Tile(TileCoord(1, 0, 0, 2), data=b"", error="error")]))
+    assert len(tiles) == 4
+    assert all(tile.error == "error" for tile in tiles)
+
+
+@pytest.mark.parametrize(
+    ("data", "error"),
+    [(None, "The metatile has no data"), ("", "Unsupported metatile data type: str")],
+)
+def test_split_no_data(data: str | None, error: str) -> None:
+    """
+    Test that the tiles of a metatile without data are got with an error.
+    """
+    mtsts = MetaTileSplitterTileStore("image/png", tile_size=2)
+    tiles = list(mtsts.get([Tile(TileCoord(1, 0, 0, 2), data=data)]))
+    assert len(tiles) == 4
+    assert all(tile.error == error for tile in tiles)
+
+
+class MetaTileTileStore(TileStore):
+    """
+    A tile store that generates metatiles where each tile has a different color.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.requests: list[Tile] = []
+
+    def get_one(self, tile: Tile) -> Tile:
+        self.requests.append(tile)
+        n = tile.tilecoord.n
+        image = Image.new("RGB", (2 * n, 2 * n))
+        for tilecoord in tile.tilecoord:
+            x, y = 2 * (tilecoord.x - tile.tilecoord.x), 2 * (tilecoord.y - tile.tilecoord.y)
+            image.paste((tilecoord.x, tilecoord.y, 0), (x, y, x + 2, y + 2))
+        bytes_io = BytesIO()
+        image.save(bytes_io, "PNG")
+        tile.data = bytes_io.getvalue()
+        return tile
+
+
+def test_assemble() -> None:
+    """
+    Test getting tiles through metatiles.
+    """
+    upstream = MetaTileTileStore()
+    store = MetaTileAssemblerTileStore(
+        upstream, MetaTileSplitterTileStore("image/png", tile_size=2), n=2, flush_timeout=10
+    )
+    tilecoords = [TileCoord(3, x, y) for x in range(3) for y in range(2)]
+    tiles = list(store.get(Tile(tilecoord, metadata={"layer": "test"}) for tilecoord in tilecoords))
+    assert sorted(tile.tilecoord for tile in tiles) == sorted(tilecoords)
+    assert [tile.tilecoord for tile in upstream.requests] == [TileCoord(3, 0, 0, 2), TileCoord(3, 2, 0, 2)]
+    assert all(tile.metadata == {"layer": "test"} for tile in upstream.requests)
+    for tile in tiles:
+        assert tile.metadata == {"layer": "test"}
+        assert tile.content_type == "image/png"
+        image = Image.open(BytesIO(tile.data))
+        assert image.getpixel((0, 0)) == (tile.tilecoord.x, tile.tilecoord.y, 0)
+
+
+def test_assemble_flush_timeout() -> None:
+    """
+    Test that the incomplete metatiles are fetched after the flush timeout while the stream waits.
+    """
+
+    def tilestream() -> Iterator[Tile]:
+        yield Tile(TileCoord(3, 0, 0))
+        time.sleep(0.5)
+        assert len(upstream.requests) == 1
+        yield Tile(TileCoord(3, 1, 1))
+
+    upstream = MetaTileTileStore()
+    store = MetaTileAssemblerTileStore(
+        upstream,
+        MetaTileSplitterTileStore("image/png", tile_size=2),
+        n=2,
+        flush_timeout=0.1,
+        read_thread=True,
+    )
+    tiles = list(store.get(tilestream()))
+    assert [tile.tilecoord for tile in tiles] == [TileCoord(3, 0, 0), TileCoord(3, 1, 1)]
+    assert len(upstream.requests) == 2
+
+
+def test_assemble_flush_timeout_calling_thread() -> None:
+    """
+    Test that the incomplete metatiles are fetched when a tile comes after the flush timeout.
+    """
+    threads = set()
+
+    def tilestream() -> Iterator[Tile | None]:
+        threads.add(threading.current_thread())
+        yield Tile(TileCoord(3, 0, 0))
+        time.sleep(0.2)
+        assert len(upstream.requests) == 0
+        # Like a missing tile from an upstream store
+        yield None
+        assert len(upstream.requests) == 1
+        yield Tile(TileCoord(3, 1, 1))
+
+    upstream = MetaTileTileStore()
+    store = MetaTileAssemblerTileStore(
+        upstream, MetaTileSplitterTileStore("image/png", tile_size=2), n=2, flush_timeout=0.1
+    )
+    tiles = list(store.get(tilestream()))
+    assert [tile.tilecoord for tile in tiles] == [TileCoord(3, 0, 0), TileCoord(3, 1, 1)]
+    assert len(upstream.requests) == 2
+    assert threads == {threading.current_thread()}
+
+
+def test_assemble_mbtiles() -> None:
+    """
+    Test getting the tiles listed by an MBTiles store, the SQLite connection is bound to its thread.
+    """
+    tilestore = MBTilesTileStore(sqlite3.connect(":memory:"))
+    for _ in tilestore.put(Tile(TileCoord(3, x, 0), data=b"") for x in range(4)):
+        pass
+    store = MetaTileAssemblerTileStore(
+        MetaTileTileStore(), MetaTileSplitterTileStore("image/png", tile_size=2), n=2
+    )
+    tiles = list(store.get(tilestore.list()))
+    assert sorted(tile.tilecoord for tile in tiles) == [TileCoord(3, x, 0) for x in range(4)]
+
+
+def test_assemble_not_found() -> None:
+    """
+    Test that the tiles of a metatile not found upstream are not got.
+    """
+
+    class EmptyTileStore(TileStore):
+        def get_one(self, tile: Tile) -> None:
+            return None
+
+    store = MetaTileAssemblerTileStore(
+        EmptyTileStore(), MetaTileSplitterTileStore("image/png", tile_size=2), n=2, flush_timeout=0.1
+    )
+    assert list(store.get([Tile(TileCoord(3, 0, 0)), Tile(TileCoord(3, 1, 1))])) == []
+
+
+@pytest.mark.parametrize("read_thread", [False, True])
+def test_assemble_close(read_thread: bool) -> None:
+    """
+    Test that the incoming tile stream, and the read thread, stop when the iteration stops early.
+    """
+    closed = threading.Event()
+
+    def tilestream() -> Iterator[Tile]:
+        try:
+            x = 0
+            while True:
+                yield Tile(TileCoord(10, x, 0))
+                x += 1
+        finally:
+            closed.set()
+
+    store = MetaTileAssemblerTileStore(
+        MetaTileTileStore(),
+        MetaTileSplitterTileStore("image/png", tile_size=2),
+        n=2,
+        max_buffered=1,
+        read_thread=read_thread,
+    )
+    tiles = store.get(tilestream())
+    assert next(tiles).tilecoord == TileCoord(10, 0, 0)
+    tiles.close()
+    assert closed.wait(5)
@@ -0,0 +1,96 @@
+import os
+from collections.abc import Iterator
+from io import BytesIO
+from pathlib import Path
+
+from PIL import Image
+
+from tilecloud import Tile, TileCoord
+from tilecloud.filter.optipng import BatchOptiPNG, PNGOptimizer, benchmark, optimize_png
+
+
+def _png() -> bytes:
+    image = Image.new("RGBA", (64, 64), (0, 0, 0, 0))
+    for x in range(64):
+        image.putpixel((x, x), (255, 0, 0, 128))
+        image.putpixel((x, 63 - x), (0, 0, 255, 255))
+    bytes_io = BytesIO()
+    image.save(bytes_io, "PNG", compress_level=1)
+    return bytes_io.getvalue()
+
+
+def test_optimize_png() -> None:
+    data = _png()
+    optimized = optimize_png(data)
+    assert len(optimized) < len(data)
+    original = Image.open(BytesIO(data))
+    image = Image.open(BytesIO(optimized))
+    assert image.mode == "P"
+    assert image.convert("RGBA").tobytes() == original.tobytes()
+
+
+def test_optimize_png_alpha() -> None:
+    # The same color with two alpha values can't be in a palette
+    image = Image.new("RGBA", (64, 64), (255, 0, 0, 255))
+    image.putpixel((0, 0), (255, 0, 0, 128))
+    bytes_io = BytesIO()
+    image.save(bytes_io, "PNG", compress_level=1)
+    optimized = Image.open(BytesIO(optimize_png(bytes_io.getvalue())))
+    assert optimized.mode == "RGBA"
+    assert optimized.tobytes() == image.tobytes()
+
+
+def test_png_optimizer() -> None:
+    data = _png()
+    tiles = [
+        Tile(TileCoord(0, 0, 0), data=data, content_type="image/png"),
+        Tile(TileCoord(0, 0, 1), data=b"{}", content_type="application/json"),
+        Tile(TileCoord(0, 0, 2), data=data, content_type="image/png"),
+        Tile(TileCoord(0, 0, 3), data=b"{}"),
+    ]
+    result = list(PNGOptimizer(processes=2).optimize([*tiles, None]))
+    assert result == tiles
+    assert tiles[1].data == b"{}"
+    assert len(tiles[0].data) < len(data)
+    assert len(tiles[2].data) < len(data)
+    assert tiles[3].data == b"{}"
+
+
+def test_png_optimizer_streaming() -> None:
+    consumed = []
+
+    def tilestream() -> Iterator[Tile]:
+        for y in range(1000):
+            consumed.append(y)
+            yield Tile(TileCoord(10, 0, y), data=b"{}", content_type="application/json")
+
+    # The not PNG tiles are yielded while the stream is read
+    result = PNGOptimizer(processes=1).optimize(tilestream())
+    assert next(result).tilecoord == TileCoord(10, 0, 0)
+    assert len(consumed) == 1
+    result.close()
+
+
+def test_benchmark() -> None:
+    results = benchmark([_png()], {"fast": {"compress_level": 1, "palette": False}, "best": {}})
+    assert results["best"]["bytes_saved"] > 0
+    assert results["best"]["tiles_per_second"] > 0
+    assert set(results) == {"fast", "best"}
+
+
+def test_batch_optipng(tmp_path: Path) -> None:
+    # A fake optipng that logs its calls and shortens the files except the ones named 1.png
+    optipng = tmp_path / "optipng"
+    optipng.write_text(
+        "#!/bin/sh\n"
+        f'echo "$@" >> {tmp_path / "calls"}\n'
+        'for f; do case "$f" in -*) ;; */1.png) ;; *) printf short > "$f" ;; esac; done\n'
+    )
+    os.chmod(optipng, 0o700)
+    tiles = [Tile(TileCoord(1, 0, y), data=b"long data") for y in range(3)]
+    result = list(BatchOptiPNG(["-o2"], arg0=str(optipng), batch_size=2).optimize([*tiles, None]))
+    assert result == tiles
+    assert [tile.data for tile in tiles] == [b"short", b"long data", b"short"]
+    calls = (tmp_path / "calls").read_text().splitlines()
+    assert len(calls) == 2
+    assert all(call.startswith("-q -o2 ") for call in calls)
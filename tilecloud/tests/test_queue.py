@@ -0,0 +1,149 @@
+import base64
+
+import pytest
+
+from tilecloud import BoundingPyramid, Tile, TileCoord
+from tilecloud.store.queue import (
+    Job,
+    JobTracker,
+    LaneScheduler,
+    decode_message,
+    encode_binary_job_message,
+    encode_binary_message,
+    encode_job_message,
+    encode_message,
+    zoom_priority,
+)
+
+
+def test_job_from_bounding_pyramid() -> None:
+    bounding_pyramid = BoundingPyramid.from_string("6/3/2:40/29")
+    jobs = list(Job.from_bounding_pyramid(bounding_pyramid, n=4, size=3))
+    tilecoords = [tilecoord for job in jobs for tilecoord in job.tilecoords()]
+    assert sorted(tilecoords) == sorted(bounding_pyramid.metatilecoords(4))
+    assert max(len(job) for job in jobs) == 9
+
+
+def test_job_split() -> None:
+    job = Job(5, 0, 0, n=2, nx=3, ny=4)
+    failed = [TileCoord(5, 0, 0, 2), TileCoord(5, 0, 2, 2), TileCoord(5, 0, 6, 2), TileCoord(5, 4, 4, 2)]
+    jobs = job.split(failed)
+    assert [(sub.x, sub.y, sub.nx, sub.ny) for sub in jobs] == [(0, 0, 1, 2), (0, 6, 1, 1), (4, 4, 1, 1)]
+    assert sorted(tilecoord for sub in jobs for tilecoord in sub.tilecoords()) == sorted(failed)
+
+
+def test_job_tracker() -> None:
+    tracker = JobTracker()
+    tiles = list(tracker.decode(encode_job_message(Job(3, 0, 0, nx=2, ny=2, metadata={"a": "b"})), "id"))
+    assert [tile.tilecoord for tile in tiles] == [
+        TileCoord(3, 0, 0),
+        TileCoord(3, 0, 1),
+        TileCoord(3, 1, 0),
+        TileCoord(3, 1, 1),
+    ]
+    assert all(tile.metadata == {"a": "b"} for tile in tiles)
+    tiles[1].error = "error"
+    tracker.done(tiles[0])
+    tracker.done(tiles[1])
+    tracker.done(tiles[3])
+    assert tracker.completed() == []
+    tracker.done(tiles[2])
+    ((job, failed, delivery),) = tracker.completed()
+    assert failed == [TileCoord(3, 0, 1)]
+    assert delivery == {}
+    assert len(tracker) == 0
+
+    # The failed tiles are sent back with the next attempt
+    (retry,) = job.retry(failed)
+    (tile,) = tracker.decode(encode_job_message(retry), "id")
+    tracker.done(tile)
+    ((job, _, _),) = tracker.completed()
+    assert job.attempt == 1
+    assert job.metadata == {"a": "b"}
+
+    # The tile messages are not tracked
+    (tile,) = tracker.decode(encode_message(tiles[0]), "id2", sqs_message="id2")
+    assert tile.tilecoord == TileCoord(3, 0, 0)
+    assert not hasattr(tile, "job")
+
+
+def test_job_tracker_dropped() -> None:
+    tracker = JobTracker()
+    message = encode_binary_job_message(Job(3, 0, 0, nx=2, ny=1))
+    tiles = list(tracker.decode(message, "id", sqs_message="first"))
+    # Delivered again while in progress
+    again = list(tracker.decode(message, "id", sqs_message="second"))
+    assert len(tracker) == 2
+
+    tracker.done(tiles[0])
+    # Not found by get
+    del tiles[1]
+    ((_, failed, delivery),) = tracker.completed()
+    assert failed == []
+    assert delivery == {"sqs_message": "first"}
+
+    # Removed by DropErrors
+    again[0].error = "error"
+    del again
+    ((_, failed, delivery),) = tracker.completed()
+    assert failed == [TileCoord(3, 0, 0)]
+    assert delivery == {"sqs_message": "second"}
+    assert len(tracker) == 0
+
+
+def test_binary_message() -> None:
+    tile = Tile(TileCoord(18, 123456, 654321, 8), metadata={"layer": "a"})
+    legacy = encode_message(tile)
+    binary = encode_binary_message(tile)
+    assert len(binary) < len(legacy) / 2
+    assert len(encode_binary_message(Tile(TileCoord(18, 1, 2)))) == 13
+    for message in (legacy, binary, base64.b64encode(binary).decode(), base64.b64encode(binary)):
+        decoded = decode_message(message)
+        assert decoded.tilecoord == tile.tilecoord
+        assert decoded.metadata == {"layer": "a"}
+
+
+def test_binary_message_range() -> None:
+    with pytest.raises(ValueError, match="The z of a binary message"):
+        encode_binary_message(Tile(TileCoord(256, 0, 0)))
+    with pytest.raises(ValueError, match="The x of a binary message"):
+        encode_binary_message(Tile(TileCoord(3, -1, 0)))
+    with pytest.raises(ValueError, match="The ny of a binary message"):
+        encode_binary_job_message(Job(3, 0, 0, ny=70000))
+
+
+def test_binary_job_message() -> None:
+    (tile,) = JobTracker().decode(encode_binary_message(Tile(TileCoord(3, 1, 2))), "id")
+    assert tile.tilecoord == TileCoord(3, 1, 2)
+    tiles = list(JobTracker().decode(encode_binary_job_message(Job(3, 0, 0, nx=2, ny=3)), "id"))
+    assert len(tiles) == 6
+    assert tiles[-1].tilecoord == TileCoord(3, 1, 2)
+
+
+def test_lane_scheduler() -> None:
+    scheduler = LaneScheduler([4, 2, 1])
+    served = []
+    for _ in range(70):
+        lane = scheduler.order()[0]
+        scheduler.served(lane)
+        served.append(lane)
+    assert [served.count(lane) for lane in range(3)] == [40, 20, 10]
+    assert served[:7].count(0) == 4
+
+    # An empty lane doesn't accumulate credit
+    scheduler = LaneScheduler([1, 1])
+    for _ in range(10):
+        order = scheduler.order()
+        scheduler.served(1, order[: order.index(1)])
+    served = []
+    for _ in range(4):
+        lane = scheduler.order()[0]
+        scheduler.served(lane)
+        served.append(lane)
+    assert sorted(served) == [0, 0, 1, 1]
+
+
+def test_zoom_priority() -> None:
+    priority = zoom_priority([8, 4])
+    assert [priority(Tile(TileCoord(z, 0, 0))) for z in (0, 4, 5, 8, 9, 18)] == [0, 0, 1, 1, 2, 2]
+    assert priority(Job(6, 0, 0)) == 1
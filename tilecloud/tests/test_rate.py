@@ -0,0 +1,49 @@
+import multiprocessing
+
+from tilecloud import Tile, TileCoord
+from tilecloud.filter.rate import AdaptiveRateLimit, SharedTokenBucket, TokenBucket, TokenBucketRateLimit
+
+
+def test_token_bucket_burst() -> None:
+    bucket = TokenBucket(rate=1, burst=3)
+    assert [bucket.acquire() for _ in range(3)] == [0, 0, 0]
+    assert 0.9 < bucket.acquire() <= 1
+    assert 1.9 < bucket.acquire() <= 2
+
+
+def _acquire(bucket: SharedTokenBucket, results: "multiprocessing.Queue[float]") -> None:
+    results.put(bucket.acquire())
+
+
+def test_shared_token_bucket() -> None:
+    bucket = SharedTokenBucket(rate=1, burst=1)
+    results: multiprocessing.Queue[float] = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=_acquire, args=(bucket, results)) for _ in range(3)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    waits = sorted(results.get() for _ in processes)
+    assert waits[0] == 0
+    assert 0.5 < waits[1] <= 1
+    assert 1.5 < waits[2] <= 2
+
+
+def test_keys() -> None:
+    rate_limit = TokenBucketRateLimit(rate=1000, burst=2, key=lambda tile: str(tile.tilecoord.z))
+    for z in range(3):
+        rate_limit(Tile(TileCoord(z, 0, 0)))
+    assert set(rate_limit.buckets) == {"0", "1", "2"}
+
+
+def test_adaptive() -> None:
+    rate_limit = AdaptiveRateLimit(rate=100, increase=10)
+    tile = rate_limit(Tile(TileCoord(0, 0, 0), status_code=429))
+    rate_limit.feedback(tile)
+    bucket = rate_limit.get_bucket(tile)
+    assert bucket.rate == 50
+    rate_limit.feedback(Tile(TileCoord(0, 0, 0), status_code=200))
+    assert bucket.rate == 60
+    for _ in range(10):
+        rate_limit.feedback(Tile(TileCoord(0, 0, 0), status_code=200))
+    assert bucket.rate == 100
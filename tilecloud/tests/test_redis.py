@@ -1,11 +1,14 @@
 import os
+import threading
 import time
 
 import pytest
 import redis
+from prometheus_client import REGISTRY
 
-from tilecloud import Tile, TileCoord
-from tilecloud.store.redis import RedisTileStore
+from tilecloud import BoundingPyramid, Tile, TileCoord
+from tilecloud.store.queue import Job, decode_message, encode_binary_message, encode_message, zoom_priority
+from tilecloud.store.redis import CONSUMER_NAME, RedisTileStore
 
 url = os.environ.get("REDIS_URL")
 if url is not None:
@@ -142,3 +145,351 @@ def test_put(store):
         count += 1
         store.delete_one(tile)
     assert count == 20
+
+
+@skip_no_redis
+@pytest.mark.usefixtures("store")
+def test_batch():
+    batch_store = RedisTileStore(
+        url,
+        name="test",
+        stop_if_empty=True,
+        timeout=0.1,
+        pending_timeout=0.5,
+        read_count=4,
+        ack_batch_size=3,
+        ack_interval=60,
+        binary_messages=True,
+    )
+    for _ in batch_store.put(Tile(TileCoord(0, 0, y)) for y in range(10)):
+        pass
+
+    count = 0
+    for y, tile in enumerate(batch_store.list()):
+        assert y == tile.tilecoord.y
+        count += 1
+        batch_store.delete_one(tile)
+        if y < 3:
+            messages = batch_store.get_status()
+            # The deleted tiles are acknowledged by batch
+            assert messages["Approximate number of tiles to generate"] == (10 if y < 2 else 7)
+            assert messages["Approximate number of generating tiles"] == (4 if y < 2 else 1)
+    assert count == 10
+
+    messages = batch_store.get_status()
+    assert messages["Approximate number of tiles to generate"] == 0
+    assert messages["Approximate number of generating tiles"] == 0
+
+
+@skip_no_redis
+@pytest.mark.usefixtures("store")
+def test_pending_max_count():
+    claim_store = RedisTileStore(
+        url, name="test", timeout=0.1, pending_timeout=0.1, pending_count=5, pending_max_count=2
+    )
+    for y in range(3):
+        claim_store.put_one(Tile(TileCoord(0, 0, y)))
+    tiles = claim_store.list()
+    for _ in range(3):
+        next(tiles)
+    tiles.close()
+    time.sleep(0.2)
+
+    queues, has_pendings = claim_store._claim_olds()
+    assert has_pendings
+    # At most pending_max_count messages claimed by a scan
+    assert [len(messages) for _, messages in queues] == [2]
+    queues, _ = claim_store._claim_olds()
+    assert [len(messages) for _, messages in queues] == [1]
+
+
+@skip_no_redis
+def test_put_bounding_pyramid(store):
+    bounding_pyramid = BoundingPyramid.from_string("5/3/2:21/13")
+    bounding_pyramid.add(TileCoord(6, 60, 40))
+    progress = []
+    count = store.put_bounding_pyramid(
+        bounding_pyramid, n=4, metadata={"layer": "a"}, max_script_messages=5, progress=progress.append
+    )
+    expected = list(bounding_pyramid.metatilecoords(4))
+    assert count == len(expected)
+    assert progress[-1] == count
+    assert len(progress) > 1
+
+    tiles = []
+    for tile in store.list():
+        tiles.append(tile)
+        store.delete_one(tile)
+    assert [tile.tilecoord for tile in tiles] == expected
+    assert all(tile.metadata == {"layer": "a"} for tile in tiles)
+
+
+@skip_no_redis
+@pytest.mark.usefixtures("store")
+@pytest.mark.parametrize("binary_messages", [False, True])
+@pytest.mark.parametrize("metadata", [None, {"layer": "a"}])
+def test_put_bounding_pyramid_messages(binary_messages, metadata):
+    # The messages are encoded like the ones of put, so they are read by the older consumers
+    messages_store = RedisTileStore(url, name="test", binary_messages=binary_messages)
+    bounding_pyramid = BoundingPyramid.from_string("3/0/0:2/2")
+    bounding_pyramid.add(TileCoord(20, 1000000, 700000))
+    assert messages_store.put_bounding_pyramid(bounding_pyramid, metadata=metadata) == 5
+    messages = [fields[b"message"] for _, fields in messages_store._master.xrange(messages_store._lanes[0])]
+    tiles = [Tile(tilecoord, metadata=metadata or {}) for tilecoord in bounding_pyramid.metatilecoords(1)]
+    if binary_messages:
+        assert messages == [encode_binary_message(tile) for tile in tiles]
+    else:
+        assert messages == [encode_message(tile).encode() for tile in tiles]
+
+
+@skip_no_redis
+@pytest.mark.usefixtures("store")
+def test_put_bounding_pyramid_lanes():
+    lanes_store = RedisTileStore(
+        url,
+        name="test",
+        stop_if_empty=True,
+        timeout=0.1,
+        lane_weights=(1, 1),
+        priority=zoom_priority([3]),
+    )
+    lanes_store.delete_all()
+    bounding_pyramid = BoundingPyramid.from_string("3/0/0:2/2")
+    bounding_pyramid.add(TileCoord(5, 0, 0))
+    assert lanes_store.put_bounding_pyramid(bounding_pyramid) == 5
+    status = lanes_store.get_status()
+    assert status["Approximate number of tiles to generate in lane 0"] == 4
+    assert status["Approximate number of tiles to generate in lane 1"] == 1
+
+    # Clamped to the last lane
+    assert (
+        RedisTileStore(url, name="test", lane_weights=(1, 1)).put_bounding_pyramid(
+            BoundingPyramid.from_string("3/0/0:1/1"), priority=5
+        )
+        == 1
+    )
+    assert lanes_store.get_status()["Approximate number of tiles to generate in lane 1"] == 2
+    for tile in lanes_store.list():
+        lanes_store.delete_one(tile)
+
+
+def test_decode_message() -> None:
+    tile = Tile(TileCoord(3, 2, 1, 2), metadata={"layer": "a"})
+    for message in (encode_message(tile), '{"z": 3, "x": 2, "y": 1, "n": 2, "metadata": {"layer": "a"}}'):
+        decoded = decode_message(message)
+        assert decoded.tilecoord == tile.tilecoord
+        assert decoded.metadata == tile.metadata
+
+
+@skip_no_redis
+def test_jobs(store):
+    assert store.put_jobs(Job.from_bounding_pyramid(BoundingPyramid.from_string("4/0/0:4/4"), size=2)) == 4
+
+    tiles = []
+    for tile in store.list():
+        tiles.append(tile)
+        if tile.tilecoord == TileCoord(4, 1, 1) and len(tiles) < 16:
+            tile.error = "error"
+        store.delete_one(tile)
+        if len(tiles) == 3:
+            # The first job is not yet acknowledged
+            assert store.get_status()["Approximate number of tiles to generate"] == 4
+    # The failed tile is requeued and processed again at the end
+    assert len(tiles) == 17
+    assert tiles[-1].tilecoord == TileCoord(4, 1, 1)
+    assert store.get_status()["Approximate number of tiles to generate"] == 0
+
+
+@skip_no_redis
+def test_jobs_retries(store):
+    store.put_jobs([Job(4, 0, 0, nx=2)])
+
+    tiles = []
+    for tile in store.list():
+        tiles.append(tile)
+        if tile.tilecoord == TileCoord(4, 1, 0):
+            # Always fails
+            tile.error = "error"
+        store.delete_one(tile)
+    # The first attempt and 2 retries
+    assert [tile.tilecoord for tile in tiles] == [TileCoord(4, 0, 0)] + [TileCoord(4, 1, 0)] * 3
+    status = store.get_status()
+    assert status["Approximate number of tiles to generate"] == 0
+    assert status["Tiles in error"] == "4/1/0"
+
+    # The dropped tiles are done
+    store.put_jobs([Job(4, 0, 0, nx=2)])
+    assert list(store.list()) != []
+    store.flush()
+    assert store.get_status()["Approximate number of generating tiles"] == 0
+
+
+@skip_no_redis
+@pytest.mark.usefixtures("store")
+def test_priority_lanes():
+    lanes_store = RedisTileStore(
+        url,
+        name="test",
+        stop_if_empty=True,
+        timeout=0.1,
+        pending_timeout=0.5,
+        lane_weights=(3, 1),
+        priority=zoom_priority([5]),
+    )
+    lanes_store.delete_all()
+    for _ in lanes_store.put(Tile(TileCoord(z, 0, y)) for z in (10, 4) for y in range(8)):
+        pass
+    status = lanes_store.get_status()
+    assert status["Approximate number of tiles to generate"] == 16
+    assert status["Approximate number of tiles to generate in lane 0"] == 8
+    assert status["Approximate number of tiles to generate in lane 1"] == 8
+
+    tiles = []
+    for tile in lanes_store.list():
+        tiles.append(tile)
+        lanes_store.delete_one(tile)
+    # Weighted fair consumption: 3 high priority tiles for 1 low priority tile
+    assert [tile.tilecoord.z for tile in tiles[:8]].count(4) == 6
+    assert all(tile.priority == (0 if tile.tilecoord.z == 4 else 1) for tile in tiles)
+    assert len(tiles) == 16
+    assert lanes_store.get_status()["Approximate number of tiles to generate"] == 0
+
+
+@skip_no_redis
+@pytest.mark.usefixtures("store")
+def test_deduplicate():
+    dedup_store = RedisTileStore(
+        url, name="test", stop_if_empty=True, timeout=0.1, pending_timeout=0.5, deduplicate=True
+    )
+    for _ in dedup_store.put(Tile(TileCoord(3, 0, y % 4)) for y in range(10)):
+        pass
+    dedup_store.put_one(Tile(TileCoord(3, 0, 1)))
+    dedup_store.put_one(Tile(TileCoord(3, 0, 1), metadata={"layer": "a"}))
+    assert dedup_store.put_jobs([Job(4, 0, 0, nx=2), Job(4, 0, 0, nx=2)]) == 1
+    assert dedup_store.get_status()["Approximate number of tiles to generate"] == 6
+
+    tiles = []
+    for tile in dedup_store.list():
+        tiles.append(tile)
+        if len(tiles) == 1:
+            # Added again while the first one is processed
+            dedup_store.put_one(Tile(TileCoord(3, 0, 0)))
+        dedup_store.delete_one(tile)
+    assert len(tiles) == 4 + 1 + 2 + 1
+    assert tiles[-1].tilecoord == TileCoord(3, 0, 0)
+
+    # Read by a consumer that doesn't deduplicate
+    dedup_store.put_one(Tile(TileCoord(3, 0, 2)))
+    consumer = RedisTileStore(url, name="test", stop_if_empty=True, timeout=0.1, pending_timeout=0.5)
+    for tile in consumer.list():
+        consumer.delete_one(tile)
+    dedup_store.put_one(Tile(TileCoord(3, 0, 2)))
+    tiles = []
+    for tile in consumer.list():
+        tiles.append(tile)
+        consumer.delete_one(tile)
+    assert [tile.tilecoord for tile in tiles] == [TileCoord(3, 0, 2)]
+
+
+@skip_no_redis
+@pytest.mark.usefixtures("store")
+def test_heartbeat():
+    heartbeat_store = RedisTileStore(
+        url,
+        name="test",
+        stop_if_empty=True,
+        timeout=0.1,
+        pending_timeout=0.5,
+        heartbeat_interval=0.1,
+    )
+    heartbeat_store.put_one(Tile(TileCoord(0, 0, 0)))
+    heartbeat_store.put_one(Tile(TileCoord(0, 0, 1)))
+
+    tiles = []
+    for tile in heartbeat_store.list():
+        tiles.append(tile)
+        if len(tiles) == 1:
+            # A slow tile
+            time.sleep(1)
+            (pending,) = heartbeat_store._master.xpending_range(
+                name="queue_test", groupname="tilecloud", min="-", max="+", count=10
+            )
+            assert pending["time_since_delivered"] < 500
+            assert pending["times_delivered"] == 1
+        heartbeat_store.delete_one(tile)
+    # Not stolen by the second read
+    assert [tile.tilecoord.y for tile in tiles] == [0, 1]
+
+
+@skip_no_redis
+@pytest.mark.usefixtures("store")
+def test_heartbeat_dropped():
+    heartbeat_store = RedisTileStore(
+        url,
+        name="test",
+        stop_if_empty=True,
+        timeout=0.1,
+        pending_timeout=0.5,
+        heartbeat_interval=0.1,
+    )
+    heartbeat_store.put_one(Tile(TileCoord(0, 0, 0)))
+    heartbeat_store.put_one(Tile(TileCoord(0, 0, 1)))
+
+    tiles = heartbeat_store.list()
+    # Not found by get
+    assert next(tiles).tilecoord.y == 0
+    tile = next(tiles)
+    time.sleep(1)
+    dropped, in_progress = heartbeat_store._master.xpending_range(
+        name="queue_test", groupname="tilecloud", min="-", max="+", count=10
+    )
+    # The lease of the dropped tile isn't renewed
+    assert dropped["time_since_delivered"] >= 900
+    assert in_progress["time_since_delivered"] < 500
+    heartbeat_store.delete_one(tile)
+    tiles.close()
+
+
+@skip_no_redis
+def test_monitor(store):
+    for y in range(3):
+        store.put_one(Tile(TileCoord(0, 0, y)))
+    tiles = store.list()
+    next(tiles)
+
+    samples = store.sample()
+    assert samples["queue_test"]["length"] == 3
+    assert samples["queue_test"]["pending"] == 1
+    assert samples["queue_test"]["consumers"][CONSUMER_NAME]["pending"] == 1
+    if samples["queue_test"]["lag"] is not None:
+        assert samples["queue_test"]["lag"] == 2
+    assert REGISTRY.get_sample_value("tilecloud_redis_pending", {"name": "queue_test"}) == 1
+    tiles.close()
+
+    # Another monitor is elected, this one publishes nothing
+    store._master.set("queue_test_monitor", "other", px=1000)
+    stopping = threading.Event()
+    thread = threading.Thread(target=store.monitor, args=(0.1, stopping))
+    thread.start()
+    time.sleep(0.3)
+    assert REGISTRY.get_sample_value("tilecloud_redis_pending", {"name": "queue_test"}) is None
+    # Elected when the other monitor is gone
+    time.sleep(1)
+    assert REGISTRY.get_sample_value("tilecloud_redis_nb_messages", {"name": "queue_test"}) == 3
+    stopping.set()
+    thread.join()
+    assert REGISTRY.get_sample_value("tilecloud_redis_nb_messages", {"name": "queue_test"}) is None
+
+
+@skip_no_redis
+def test_monitor_interval(store):
+    store.put_one(Tile(TileCoord(0, 0, 0)))
+    monitor_store = RedisTileStore(url, name="test", timeout=0.1, monitor_interval=0.1)
+    tiles = monitor_store.list()
+    next(tiles)
+    # Sampled by the monitor thread of the worker
+    time.sleep(0.3)
+    assert REGISTRY.get_sample_value("tilecloud_redis_pending", {"name": "queue_test"}) == 1
+    tiles.close()
+    time.sleep(0.3)
+    assert REGISTRY.get_sample_value("tilecloud_redis_pending", {"name": "queue_test"}) is None
@@ -0,0 +1,116 @@
+import time
+from collections.abc import Iterable
+
+from tilecloud import Tile, TileCoord
+from tilecloud.lib.benchmark import FakeSQSQueue
+from tilecloud.store.queue import Job, zoom_priority
+from tilecloud.store.sqs import SQSTileStore
+
+
+def put(store: SQSTileStore, tiles: Iterable[Tile]) -> None:
+    for _ in store.put(tiles):
+        pass
+
+
+def test_list_batch_delete() -> None:
+    queue = FakeSQSQueue()
+    store = SQSTileStore(queue, wait_time=0, delete_batch_size=10, delete_interval=60, binary_messages=True)
+    put(store, (Tile(TileCoord(5, 0, y)) for y in range(25)))
+    store.put_jobs([Job(6, 0, 0, nx=2, ny=2)])
+    queue.requests.clear()
+
+    tiles = list(store.delete(store.list()))
+    assert sorted(tile.tilecoord for tile in tiles)[:4] == [TileCoord(5, 0, y) for y in range(4)]
+    assert len(tiles) == 29
+    assert queue.messages == {}
+    assert queue.requests["delete_messages"] == 3
+    assert queue.requests["receive_messages"] == 4
+
+
+def test_receivers() -> None:
+    queues = [FakeSQSQueue(url="high"), FakeSQSQueue(url="low")]
+    store = SQSTileStore(
+        queues[0],
+        lane_queues=queues[1:],
+        lane_weights=(3, 1),
+        priority=zoom_priority([5]),
+        wait_time=0,
+        receivers=2,
+        buffer_size=20,
+        delete_batch_size=10,
+    )
+    put(store, (Tile(TileCoord(z, 0, y)) for z in (4, 10) for y in range(100)))
+
+    tiles = []
+    for tile in store.list():
+        tiles.append(tile)
+        store.delete_one(tile)
+    assert len(tiles) == 200
+    assert len({tile.tilecoord for tile in tiles}) == 200
+    # The high priority tiles are processed first on average
+    positions = {z: [index for index, tile in enumerate(tiles) if tile.tilecoord.z == z] for z in (4, 10)}
+    assert sum(positions[4]) < sum(positions[10])
+    assert all(queue.messages == {} for queue in queues)
+    status = store.get_status()
+    assert status["Approximate number of tiles to generate in lane 1"] == "0"
+
+
+def test_release_buffered() -> None:
+    queue = FakeSQSQueue()
+    store = SQSTileStore(queue, wait_time=0, receivers=1, visibility_timeout=60)
+    put(store, (Tile(TileCoord(5, 0, y)) for y in range(30)))
+
+    tiles = store.list()
+    store.delete_one(next(tiles))
+    tiles.close()
+    queue.load()
+    # The buffered messages are visible again
+    assert queue.attributes["ApproximateNumberOfMessages"] == "29"
+    assert queue.attributes["ApproximateNumberOfMessagesNotVisible"] == "0"
+
+
+def test_release_batch() -> None:
+    queue = FakeSQSQueue()
+    store = SQSTileStore(queue, wait_time=0)
+    put(store, (Tile(TileCoord(5, 0, y)) for y in range(10)))
+
+    tiles = store.list()
+    store.delete_one(next(tiles))
+    tiles.close()
+    queue.load()
+    # The not yielded messages of the received batch are visible again
+    assert queue.attributes["ApproximateNumberOfMessages"] == "9"
+    assert queue.attributes["ApproximateNumberOfMessagesNotVisible"] == "0"
+
+
+def test_visibility_extension() -> None:
+    queue = FakeSQSQueue()
+    store = SQSTileStore(queue, wait_time=0, visibility_timeout=1)
+    other_store = SQSTileStore(queue, wait_time=0, on_empty=lambda _: True)
+    put(store, [Tile(TileCoord(5, 0, 0))])
+
+    for tile in store.list():
+        # A slow tile isn't received by another consumer
+        time.sleep(1.5)
+        assert list(other_store.list()) == []
+        store.delete_one(tile)
+    assert queue.requests["change_message_visibility_batch"] >= 1
+    assert queue.messages == {}
+
+
+def test_visibility_dropped() -> None:
+    queue = FakeSQSQueue()
+    store = SQSTileStore(queue, wait_time=0, visibility_timeout=1)
+    other_store = SQSTileStore(queue, wait_time=0, on_empty=lambda _: True)
+    put(store, [Tile(TileCoord(5, 0, y)) for y in range(2)])
+
+    tiles = store.list()
+    # Dropped from the pipeline, e.g. not found
+    next(tiles)
+    # The generator frame keeps the last yielded tile
+    kept = next(tiles)
+    time.sleep(1.5)
+    # The visibility of the dropped tile isn't extended anymore
+    assert [tile.tilecoord for tile in other_store.list()] == [TileCoord(5, 0, 0)]
+    store.delete_one(kept)
+    tiles.close()
@@ -0,0 +1,91 @@
+import functools
+import os
+import time
+from collections.abc import Iterator
+from pathlib import Path
+
+from tilecloud import Tile, TileCoord, TileStore
+from tilecloud.lib.benchmark import FakeSQSQueue
+from tilecloud.lib.supervisor import Supervisor
+from tilecloud.store.sqs import SQSTileStore
+
+
+def _render(tile: Tile) -> Tile | None:
+    if tile.tilecoord.y == 3:
+        return None
+    if tile.tilecoord.y == 4:
+        raise ValueError("bad tile")
+    tile.data = f"{tile.tilecoord} by {os.getpid()}".encode()
+    return tile
+
+
+def _crash(marker: Path, tile: Tile) -> Tile:
+    if tile.tilecoord.y == 0 and not marker.exists():
+        marker.touch()
+        os._exit(1)
+    if tile.tilecoord.y == 1:
+        os._exit(1)
+    tile.data = b"data"
+    return tile
+
+
+class _IdleStore(TileStore):
+    def list(self) -> Iterator[Tile]:
+        yield Tile(TileCoord(5, 0, 0))
+        # An idle queue
+        time.sleep(60)
+
+    def delete_one(self, tile: Tile) -> Tile:
+        return tile
+
+
+def _store(nb_tiles: int) -> tuple[FakeSQSQueue, SQSTileStore]:
+    queue = FakeSQSQueue()
+    store = SQSTileStore(
+        queue, wait_time=0, delete_batch_size=10, delete_interval=60, on_empty=lambda _: True
+    )
+    for _ in store.put(Tile(TileCoord(5, 0, y)) for y in range(nb_tiles)):
+        pass
+    return queue, store
+
+
+def test_supervisor() -> None:
+    queue, store = _store(20)
+    tiles = list(Supervisor(store, _render, processes=3).run())
+
+    assert sorted(tile.tilecoord.y for tile in tiles) == [y for y in range(20) if y != 3]
+    for tile in tiles:
+        if tile.tilecoord.y == 4:
+            assert tile.error == "ValueError: bad tile"
+        else:
+            assert tile.error is None
+            assert tile.data.startswith(str(tile.tilecoord).encode())
+    assert len({tile.data.split(b" by ")[1] for tile in tiles if tile.data is not None}) > 1
+    # All acknowledged, in batches
+    assert queue.messages == {}
+    assert queue.requests["delete_messages"] <= 3
+
+
+def test_supervisor_crash(tmp_path: Path) -> None:
+    queue, store = _store(10)
+    # The other tiles held by the crashed worker are not failed
+    tiles = list(
+        Supervisor(store, functools.partial(_crash, tmp_path / "crashed"), processes=1, prefetch=3).run()
+    )
+
+    assert sorted(tile.tilecoord.y for tile in tiles) == list(range(10))
+    for tile in tiles:
+        if tile.tilecoord.y == 1:
+            assert tile.error == "The worker crashed 3 times processing the tile"
+        else:
+            assert tile.error is None
+            assert tile.data == b"data"
+    assert queue.messages == {}
+
+
+def test_supervisor_stop_idle() -> None:
+    tiles = Supervisor(_IdleStore(), _render, processes=1, stop_timeout=0.5).run()
+    assert next(tiles).tilecoord == TileCoord(5, 0, 0)
+    start = time.monotonic()
+    tiles.close()
+    assert time.monotonic() - start < 5